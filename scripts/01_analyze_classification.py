@@ -5,6 +5,7 @@
 
 import sys
 import os
+import argparse
 
 # Добавляем пути
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,10 +13,6 @@ project_root = os.path.dirname(script_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from utils.data_utils import setup_dataset_structure
-from utils.data_balancer import DataBalancer, check_dataset_quality
-from utils.imbalance_utils import ImbalanceHandler
-
 def setup_classification_structure(base_path="./data"):
     """Create classification dataset structure"""
     folders = [
@@ -37,15 +34,23 @@ def setup_classification_structure(base_path="./data"):
     return True
 
 def main():
+    parser = argparse.ArgumentParser(description='Classification dataset analysis: folder structure, class balance, quality')
+    parser.add_argument('--data', type=str, default='./data', help='Dataset root')
+    args = parser.parse_args()
+
+    # numpy и утилиты датасета нужны только для самого анализа, не для --help
+    from utils.data_balancer import DataBalancer, check_dataset_quality
+    from utils.imbalance_utils import ImbalanceHandler
+
     print("🎯 АНАЛИЗ ДАННЫХ ДЛЯ КЛАССИФИКАЦИИ")
     print("=" * 50)
     
     # Создаем структуру для классификации
-    setup_classification_structure('./data')
+    setup_classification_structure(args.data)
     
     try:
         # 1. Инициализация балансера
-        balancer = DataBalancer('./data')
+        balancer = DataBalancer(args.data)
         
         # 2. Анализ текущего баланса
         current_counts = balancer.analyze_current_balance()
@@ -54,10 +59,10 @@ def main():
         balancer.recommend_actions(current_counts)
         
         # 4. Проверка качества датасета
-        is_quality_ok = check_dataset_quality('./data')
+        is_quality_ok = check_dataset_quality(args.data)
         
         # 5. Анализ стратегии дисбаланса
-        handler = ImbalanceHandler('./data/labels/train')
+        handler = ImbalanceHandler(os.path.join(args.data, 'labels', 'train'))
         strategy = handler.get_imbalance_strategy()
         weights = handler.calculate_class_weights()
         
@@ -5,6 +5,7 @@
 
 import sys
 import os
+import argparse
 
 # 🔥 ПРАВИЛЬНОЕ ДОБАВЛЕНИЕ ПУТЕЙ
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,16 +13,21 @@ parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-try:
-    from utils.data_utils import setup_dataset_structure
-    from utils.data_balancer import DataBalancer, check_dataset_quality
-    from utils.imbalance_utils import ImbalanceHandler
-    print("✅ Все импорты успешны!")
-except ImportError as e:
-    print(f"❌ Ошибка импорта: {e}")
-    sys.exit(1)
-
 def main():
+    parser = argparse.ArgumentParser(description='Detection dataset analysis: folder structure, class balance, '
+                                                 'quality checks and configs/clavicle_config.yaml')
+    parser.parse_args()
+
+    # Тяжелые модули грузим после разбора аргументов, чтобы --help отвечал сразу
+    try:
+        from utils.data_utils import setup_dataset_structure
+        from utils.data_balancer import DataBalancer, check_dataset_quality
+        from utils.imbalance_utils import ImbalanceHandler
+        print("✅ Все импорты успешны!")
+    except ImportError as e:
+        print(f"❌ Ошибка импорта: {e}")
+        sys.exit(1)
+
     print("🔍 РАСШИРЕННЫЙ АНАЛИЗ ДАННЫХ")
     print("=" * 50)
     
@@ -5,7 +5,7 @@ Classification training for chest X-ray pathology detection
 
 import sys
 import os
-import torch
+import argparse
 
 # Добавляем пути
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,8 +13,6 @@ project_root = os.path.dirname(script_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from ultralytics import YOLO
-
 def check_training_data():
     """Проверяет наличие данных для обучения"""
     required_folders = [
@@ -35,6 +33,43 @@ def check_training_data():
     return total_files > 0
 
 def main():
+    parser = argparse.ArgumentParser(description='Chest X-Ray classification training')
+    parser.add_argument('--roi', action='store_true',
+                        help='Train on thoracic ROI crops (data/roi), cached per image')
+    parser.add_argument('--imgsz', type=int, default=None,
+                        help='Training image size (default: 224, or 160 with --roi)')
+    parser.add_argument('--dicom-size', type=int, default=None,
+                        help='Shorter side DICOM files in data/ are downsampled to when converted '
+                             '(default: --imgsz, x2 with --roi; 0 = full resolution)')
+    parser.add_argument('--auto-config', action='store_true',
+                        help='Use batch/workers/imgsz/device from configs/auto_config.yaml (probed on first use)')
+    parser.add_argument('--refresh-config', action='store_true', help='Re-run the auto-config probes')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-batch/per-epoch timing and resources to <run>/profile.csv')
+    parser.add_argument('--hyp', type=str, default=None,
+                        help='Hyperparameters YAML, e.g. runs/sweep/best_hyp.yaml from 12_sweep.py')
+    parser.add_argument('--kfold', type=int, default=0,
+                        help='Stratified k-fold CV over data/images/*/<class> instead of a single run')
+    parser.add_argument('--kfold-workers', type=int, default=None,
+                        help='Folds trained concurrently (default: min(k, cores))')
+    parser.add_argument('--update', action='store_true',
+                        help='Fine-tune the existing best.pt on images added since it was trained')
+    parser.add_argument('--update-epochs', type=int, default=3, help='Epochs for --update')
+    parser.add_argument('--replay-per-class', type=int, default=10,
+                        help='Already-trained images per class mixed into --update')
+    args = parser.parse_args()
+
+    # torch/ultralytics грузим после разбора аргументов, чтобы --help отвечал сразу
+    import torch
+    import yaml
+    from ultralytics import YOLO
+    from utils.dicom_utils import link_dicom_tree
+    from utils.incremental_utils import incremental_update, save_manifest
+    from utils.kfold_utils import run_kfold
+    from utils.roi_utils import crop_dataset
+    from utils.run_registry import RunRegistry
+    from utils.training_utils import TrainingProfiler, get_optimal_config, load_training_config
+
     print("🎯 ЗАПУСК КЛАССИФИКАЦИИ CHEST X-RAY")
     print("=" * 50)
     
@@ -44,6 +79,11 @@ def main():
     print("- Возвращает: normal / clavicle_fracture / foreign_body")
     print("- НЕ ищет bounding boxes!")
     
+    # DICOM из больниц: конвертируем в кэш PNG и кладем ссылки dcm_*.png рядом с исходниками
+    imgsz = args.imgsz or (160 if args.roi else 224)
+    dicom_size = args.dicom_size if args.dicom_size is not None else imgsz * (2 if args.roi else 1)
+    link_dicom_tree('./data', dicom_size)
+
     # Проверяем данные
     print("\n🔍 ПРОВЕРКА ДАННЫХ...")
     if not check_training_data():
@@ -54,32 +94,80 @@ def main():
         print("   data/images/train/foreign_body/")
         return
     
+    data_path = './data'
+    run_name = 'train_roi' if args.roi else 'train'
+    if args.roi:
+        # Кропы грудной клетки: меньше фона - можно меньший imgsz
+        print("\n✂️ Готовим ROI кропы...")
+        data_path = crop_dataset('./data', './data/roi')
+
     # Проверяем GPU
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"🔧 Устройство: {device}")
+
+    train_args = {
+        'epochs': 10,
+        'imgsz': imgsz,
+        'batch': 8,
+        'device': device,
+        'workers': 0,
+        'lr0': 0.001,
+        'patience': 3,
+    }
+    if args.auto_config or args.refresh_config:
+        config_path = get_optimal_config(data_path, 'yolov8n-cls.pt', refresh=args.refresh_config)
+        if config_path is None:
+            print("⚠️ Автоконфиг не получен - используем параметры по умолчанию")
+        else:
+            train_args.update(load_training_config(config_path))
+            if args.imgsz or args.roi:
+                train_args['imgsz'] = imgsz  # явный размер важнее замеренного
+            print(f"⚙️ Автоконфиг: batch={train_args['batch']} workers={train_args['workers']} "
+                  f"imgsz={train_args['imgsz']} device={train_args['device']}")
+    if args.hyp:
+        with open(args.hyp, 'r') as f:
+            train_args.update(yaml.safe_load(f))
+        if args.imgsz or args.roi:
+            train_args['imgsz'] = imgsz  # явный размер и размер ROI-кропов важнее найденного поиском
+        print(f"⚙️ Гиперпараметры из {args.hyp}")
     
+    if args.kfold:
+        # Фолды поверх всех сплитов data/images, обучаются параллельно в отдельных процессах
+        run_kfold('data/images', k=args.kfold, model_path='yolov8n-cls.pt', train_args=train_args,
+                  workers=args.kfold_workers)
+        print("📁 Результаты в: runs/classify/kfold/")
+        return
+
+    if args.update:
+        train_args.pop('epochs', None)
+        train_args.pop('lr0', None)
+        train_args.pop('patience', None)
+        incremental_update(f'runs/classify/{run_name}', data_path, epochs=args.update_epochs,
+                           replay_per_class=args.replay_per_class, train_args=train_args)
+        return
+
     # Загружаем модель для классификации
     print("📦 Загружаем YOLOv8 для классификации...")
     model = YOLO('yolov8n-cls.pt')
+    if args.profile:
+        TrainingProfiler().register(model)
+    # Запуск попадает в реестр (scripts/17_runs.py) сразу после финальной валидации
+    RunRegistry().track(model)
     
     # Обучаем модель классификации
     print("🎯 НАЧИНАЕМ ОБУЧЕНИЕ КЛАССИФИКАЦИИ...")
     try:
         results = model.train(
-            data='./data',  # Указываем папку с данными, а не файл конфига
-            epochs=10,
-            imgsz=224,
-            batch=8,
-            device=device,
-            workers=0,
-            lr0=0.001,
-            patience=3,
+            data=data_path,  # Указываем папку с данными, а не файл конфига
             save=True,
-            exist_ok=True
+            exist_ok=True,
+            name=run_name,
+            **train_args
         )
         
         print("✅ Обучение классификации завершено!")
-        print("📁 Результаты в: runs/classify/train/")
+        save_manifest(f'runs/classify/{run_name}', data_path)
+        print(f"📁 Результаты в: runs/classify/{run_name}/")
         
     except Exception as e:
         print(f"❌ Ошибка при обучении классификации: {e}")
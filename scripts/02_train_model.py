@@ -5,7 +5,7 @@ Training script for YOLOv8 model
 
 import sys
 import os
-import torch
+import argparse
 
 # Добавляем пути
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,10 +13,11 @@ project_root = os.path.dirname(script_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from ultralytics import YOLO
+DETECT_AUTO_CONFIG_PATH = 'configs/auto_config_detect.yaml'
 
 def check_gpu():
     """Проверяет доступность GPU"""
+    import torch
     if torch.cuda.is_available():
         device = "cuda"
         device_count = torch.cuda.device_count()
@@ -27,6 +28,19 @@ def check_gpu():
         return "cpu"
 
 def main():
+    parser = argparse.ArgumentParser(description='YOLOv8 detector training')
+    parser.add_argument('--auto-config', action='store_true',
+                        help=f'Use batch/workers/imgsz/device from {DETECT_AUTO_CONFIG_PATH} (probed on first use)')
+    parser.add_argument('--refresh-config', action='store_true', help='Re-run the auto-config probes')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-batch/per-epoch timing and resources to <run>/profile.csv')
+    args = parser.parse_args()
+
+    # torch/ultralytics грузим после разбора аргументов, чтобы --help отвечал сразу
+    from ultralytics import YOLO
+    from utils.run_registry import RunRegistry
+    from utils.training_utils import TrainingProfiler, get_optimal_config, load_training_config
+
     print("🚀 ЗАПУСК ОБУЧЕНИЯ YOLOv8")
     print("=" * 40)
     
@@ -42,25 +56,43 @@ def main():
     # Проверяем GPU
     device = check_gpu()
     
+    train_args = {
+        'epochs': 10,    # Минимум для тестирования
+        'imgsz': 320,    # Уменьшили размер для CPU
+        'batch': 4,      # Уменьшили батч для CPU
+        'device': device,  # Автоматический выбор устройства
+        'workers': 0,    # Для избежания проблем в Colab
+    }
+    if args.auto_config or args.refresh_config:
+        # Загрузчик YOLO-датасета ImageFolder не замерить - подбираем только batch/imgsz по шагу обучения
+        config_path = get_optimal_config('./data', 'yolov8n.pt', output=DETECT_AUTO_CONFIG_PATH,
+                                         refresh=args.refresh_config, imgsz_candidates=(256, 320, 416),
+                                         probe_loader=False)
+        if config_path is None:
+            print("⚠️ Автоконфиг не получен - используем параметры по умолчанию")
+        else:
+            train_args.update(load_training_config(config_path))
+            print(f"⚙️ Автоконфиг: batch={train_args['batch']} workers={train_args['workers']} "
+                  f"imgsz={train_args['imgsz']} device={train_args['device']}")
+
     # Загружаем модель
     print("📦 Загружаем модель YOLOv8...")
     model = YOLO('yolov8n.pt')  # Начальная модель
+    if args.profile:
+        TrainingProfiler().register(model)
+    RunRegistry().track(model)
     
     # Обучаем модель
     print("🎯 НАЧИНАЕМ ОБУЧЕНИЕ...")
     try:
         results = model.train(
             data='configs/clavicle_config.yaml',
-            epochs=10,  # Минимум для тестирования
-            imgsz=320,  # Уменьшили размер для CPU
-            batch=4,    # Уменьшили батч для CPU
             patience=5,
-            device=device,  # Автоматический выбор устройства
-            workers=0,  # Для избежания проблем в Colab
             lr0=0.01,
             save=True,
             exist_ok=True,
-            verbose=True  # Подробный вывод
+            verbose=True,  # Подробный вывод
+            **train_args
         )
         
         print("✅ Обучение завершено!")
@@ -9,14 +9,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 import argparse
-from ultralytics import YOLO
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import classification_report, confusion_matrix
-import numpy as np
+import copy
+
+from utils.memory_utils import AdaptiveBatchController
+
+# torch/ultralytics, sklearn и matplotlib импортируются внутри функций: --help отвечает без них
 
 def evaluate_model(model_path, data_path):
     """Оценка модели на тестовых данных"""
+    from ultralytics import YOLO
     
     print("🧪 ОЦЕНКА МОДЕЛИ")
     print("=" * 50)
@@ -29,8 +30,7 @@ def evaluate_model(model_path, data_path):
     results = model.val(data=data_path, split='test')
     
     # Вывод результатов
-    print("
-📈 РЕЗУЛЬТАТЫ ОЦЕНКИ:")
+    print("\n📈 РЕЗУЛЬТАТЫ ОЦЕНКИ:")
     print(f"mAP50: {results.box.map50:.4f}")
     print(f"mAP50-95: {results.box.map:.4f}") 
     print(f"Precision: {results.box.mp:.4f}")
@@ -41,8 +41,53 @@ def evaluate_model(model_path, data_path):
     
     return results
 
+def evaluate_classification_tta(model_path, images_dir='data/images', split='test', tta_band=(0.4, 0.7), batch=16):
+    """Оценка классификатора по папкам классов: без TTA и с TTA для неуверенных случаев
+
+    batch - размер батча или AdaptiveBatchController (utils.memory_utils)
+    """
+    import numpy as np
+    from sklearn.metrics import classification_report, confusion_matrix
+    from utils.inference_utils import list_labeled_images, predict_paths
+    from utils.tta_utils import apply_tta
+    from utils.weights_utils import load_model
+
+    print("🧪 ОЦЕНКА КЛАССИФИКАЦИИ С TTA")
+    print("=" * 50)
+
+    model = load_model(model_path)
+    class_names = [model.names[i] for i in sorted(model.names)]
+
+    paths, y_true = list_labeled_images(os.path.join(images_dir, split), class_names)
+
+    if not paths:
+        print(f"❌ Изображения не найдены: {os.path.join(images_dir, split)}")
+        return None
+
+    # Первый проход считаем один раз, TTA применяем к копии
+    base_records = predict_paths(model, paths, batch=batch)
+    if isinstance(batch, AdaptiveBatchController):
+        batch.close()
+    tta_records = apply_tta(model, copy.deepcopy(base_records), tta_band)
+    n_tta = sum(1 for r in tta_records if 'tta_views' in r)
+
+    print(f"🖼️ Изображений: {len(paths)} | TTA применен к {n_tta} (диапазон уверенности {tta_band})")
+    results = {}
+    for title, records in [("Без TTA", base_records), ("С TTA", tta_records)]:
+        y_pred = [r['top1'] for r in records]
+        accuracy = np.mean(np.array(y_pred) == np.array(y_true))
+        results[title] = accuracy
+        print(f"\n📈 {title}: accuracy_top1 = {accuracy:.4f}")
+        print(classification_report(y_true, y_pred, labels=list(range(len(class_names))),
+                                    target_names=class_names, zero_division=0))
+        print(confusion_matrix(y_true, y_pred, labels=list(range(len(class_names)))))
+
+    return results
+
 def plot_training_results():
     """Визуализация результатов обучения"""
+    import matplotlib.pyplot as plt
+
     try:
         # Чтение результатов из YOLO
         results_img = 'runs/detect/train/results.png'
@@ -58,12 +103,22 @@ def plot_training_results():
     except Exception as e:
         print(f"⚠️ Не удалось визуализировать графики: {e}")
 
-def test_single_image(model_path, image_path):
+def test_single_image(model_path, image_path, render=False):
     """Тестирование на одном изображении"""
-    model = YOLO(model_path)
+    from utils.inference_utils import result_to_record
+    from utils.render_utils import AnnotationRenderer
+    from utils.weights_utils import load_model
+
+    model = load_model(model_path)
     
     print(f"🔍 Тестируем изображение: {image_path}")
-    results = model.predict(source=image_path, save=True, conf=0.5)
+    results = model.predict(source=image_path, save=False, conf=0.5)
+
+    renderer = None
+    if render:
+        # Отрисовка в фоновом потоке, сохраняется в runs/<task>/predict
+        renderer = AnnotationRenderer(workers=1)
+        renderer.submit([result_to_record(r) for r in results])
     
     # Вывод результатов
     for r in results:
@@ -74,6 +129,9 @@ def test_single_image(model_path, image_path):
                 print(f"   Обнаружено: {model.names[cls]} ({conf:.2%})")
         else:
             print("   Патологий не обнаружено")
+
+    if renderer is not None:
+        renderer.close()
     
     return results
 
@@ -82,11 +140,27 @@ def main():
     parser.add_argument('--model', type=str, required=True, help='Path to trained model')
     parser.add_argument('--data', type=str, default='./data/data.yaml', help='Path to data config')
     parser.add_argument('--image', type=str, help='Test single image')
+    parser.add_argument('--render', action='store_true', help='Save annotated copy of --image')
+    parser.add_argument('--tta', action='store_true',
+                        help='Classification: compare accuracy with and without test-time augmentation')
+    parser.add_argument('--tta-band', type=float, nargs=2, default=[0.4, 0.7], metavar=('LOW', 'HIGH'),
+                        help='Apply TTA only when first-pass top-1 confidence is in [LOW, HIGH)')
+    parser.add_argument('--images-dir', type=str, default='data/images', help='Class-folder dataset root for --tta')
+    parser.add_argument('--batch', type=int, default=16, help='Batch size for --tta')
+    parser.add_argument('--adaptive-batch', action='store_true',
+                        help='--tta: tune the batch size from throughput and memory (starts at --batch)')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='Memory budget in GB for --adaptive-batch (default: current RSS + 80%% of free memory)')
     
     args = parser.parse_args()
     
     if args.image:
-        test_single_image(args.model, args.image)
+        test_single_image(args.model, args.image, render=args.render)
+    elif args.tta:
+        batch = args.batch
+        if args.adaptive_batch:
+            batch = AdaptiveBatchController(initial=args.batch, memory_budget_gb=args.memory_budget)
+        evaluate_classification_tta(args.model, args.images_dir, tta_band=tuple(args.tta_band), batch=batch)
     else:
         evaluate_model(args.model, args.data)
 
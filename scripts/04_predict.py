@@ -6,6 +6,7 @@ Prediction script for chest X-ray pathology detection
 import sys
 import os
 import argparse
+import time
 
 # Добавляем пути
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,15 +14,160 @@ project_root = os.path.dirname(script_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from ultralytics import YOLO
+from utils.inference_utils import iter_predictions, iter_sharded, list_images, print_record, watch_and_predict
+from utils.memory_utils import AdaptiveBatchController
+
+class RecordSink:
+    """Принимает пачки предсказаний: пишет в файл и/или печатает в консоль"""
+
+    def __init__(self, writer=None, renderer=None, verbose=True, flush_each_batch=False, similar=None, metrics=None):
+        self.path_map = {}  # кэш PNG -> (исходный DICOM, его хэш)
+        self.writer = writer
+        self.metrics = metrics
+        self.renderer = renderer
+        self.similar = similar
+        self.verbose = verbose
+        self.flush_each_batch = flush_each_batch
+        self.count = 0
+
+    def __call__(self, records):
+        originals = [self.path_map.get(os.path.abspath(record['path'])) for record in records] if self.path_map else []
+        for record, original in zip(records, originals):
+            if original is not None:
+                # Хэш DICOM уже посчитан при конвертации - writer и индекс его не пересчитывают
+                record['image_hash'] = original[1]
+        if self.metrics is not None:
+            self.metrics.observe(records)
+        if self.similar is not None:
+            # Эмбеддинги читают картинку - путь пока указывает на PNG из кэша, а не на DICOM
+            self.similar(records)
+        for record, original in zip(records, originals):
+            if original is not None:
+                # В вывод идет исходный DICOM; рендер читает PNG из image_path
+                record['image_path'], record['path'] = record['path'], original[0]
+        if self.writer is not None:
+            self.writer.write(records)
+            if self.flush_each_batch:
+                self.writer.flush()
+        if self.renderer is not None:
+            self.renderer.submit(records)
+        if self.verbose:
+            for record in records:
+                self.count += 1
+                print_record(record, self.count)
+        else:
+            self.count += len(records)
+
+    def count_errors(self, reason, count=1):
+        if self.metrics is not None:
+            self.metrics.count_errors(reason, count)
+
+    def close(self):
+        if self.renderer is not None:
+            self.renderer.close()
+        if self.writer is not None:
+            self.writer.close()
+            print(f"💾 Предсказания сохранены: {self.writer.location} ({self.writer.rows_written} строк)")
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics.print_summary()
+            if self.metrics.path:
+                print(f"📈 Метрики (OpenMetrics): {self.metrics.path}")
 
 def main():
     parser = argparse.ArgumentParser(description='Chest X-Ray Prediction')
-    parser.add_argument('--model', type=str, required=True, help='Path to model weights')
-    parser.add_argument('--source', type=str, required=True, help='Path to image or directory')
+    parser.add_argument('--model', type=str, required=True,
+                        help='Path to model weights (.pt or .safetensors from 16_export_weights.py)')
+    parser.add_argument('--source', type=str, required=True, help='Path to image or directory (DICOM files included), or s3://bucket/prefix')
     parser.add_argument('--conf', type=float, default=0.5, help='Confidence threshold')
+    parser.add_argument('--watch', action='store_true', help='Watch --source directory and predict new files as they arrive')
+    parser.add_argument('--batch', type=int, default=16,
+                        help='Batch size; with --adaptive-batch the starting size, tuned while predicting')
+    parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds (watch mode)')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='Seconds a file must stay unchanged before it is processed (watch mode)')
+    parser.add_argument('--rescan', type=float, default=60.0,
+                        help='Seconds between full rescans that catch images overwritten in place (watch mode)')
+    parser.add_argument('--checkpoint', type=str, default='runs/watch/processed.txt',
+                        help='Processed-file checkpoint used to resume watch mode')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for bulk prediction')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Torch threads per worker (default: CPU cores / workers)')
+    parser.add_argument('--affinity', action='store_true', help='Pin each worker to its own group of CPU cores')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write predictions to a columnar file (.parquet needs pyarrow, .npz writes part files)')
+    parser.add_argument('--row-group-size', type=int, default=10000, help='Rows per Parquet row group / .npz part')
+    parser.add_argument('--quiet', action='store_true', help='Do not print per-image results')
+    parser.add_argument('--render', action='store_true',
+                        help='Save annotated images (rendered in background threads, off the inference path)')
+    parser.add_argument('--render-below', type=float, default=None,
+                        help='Render only predictions with top-1 confidence below this value')
+    parser.add_argument('--render-positive', action='store_true',
+                        help='Render only positive findings (top-1 is not normal / any detection)')
+    parser.add_argument('--render-dir', type=str, default=None,
+                        help='Output directory for annotated images (default: runs/<task>/predict)')
+    parser.add_argument('--render-workers', type=int, default=2, help='Background rendering threads')
+    parser.add_argument('--tta', action='store_true',
+                        help='Test-time augmentation (flip, scale, shift) for uncertain classification results')
+    parser.add_argument('--tta-band', type=float, nargs=2, default=[0.4, 0.7], metavar=('LOW', 'HIGH'),
+                        help='Apply TTA only when first-pass top-1 confidence is in [LOW, HIGH)')
+    parser.add_argument('--roi', action='store_true',
+                        help='Classify only the thoracic ROI crop (use with a model trained by 02_classify.py --roi)')
+    parser.add_argument('--roi-cache', type=str, default='data/roi_cache.json', help='ROI box cache file')
+    parser.add_argument('--tiled', action='store_true',
+                        help='Detection: run on overlapping full-resolution tiles and merge boxes with NMS')
+    parser.add_argument('--tile-size', type=int, default=640, help='Tile size in pixels (also used as imgsz)')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='Tile overlap fraction')
+    parser.add_argument('--tile-std', type=float, default=6.0,
+                        help='Skip tiles whose intensity std is below this value (uniform background)')
+    parser.add_argument('--similar', type=int, default=0,
+                        help='Show this many most similar archived cases for flagged predictions (see 14_similar_cases.py)')
+    parser.add_argument('--similar-classes', type=str, nargs='+', default=['foreign_body'],
+                        help='Predicted classes that get similar-case lookup')
+    parser.add_argument('--similar-index', type=str, default='data/retrieval', help='Similar-case index directory')
+    parser.add_argument('--index-insert', action='store_true',
+                        help='Add every predicted image to the similar-case index under its predicted label')
+    parser.add_argument('--adaptive-batch', action='store_true',
+                        help='Tune the batch size while predicting from throughput and memory (starts at --batch)')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='Memory budget in GB for --adaptive-batch (default: current RSS + 80%% of free memory)')
+    parser.add_argument('--batch-log', type=str, default=None, help='CSV log of --adaptive-batch decisions')
+    parser.add_argument('--dicom-size', type=int, default=None,
+                        help='Shorter side DICOM images are downsampled to while converting '
+                             '(default: model imgsz, x2 with --roi, full resolution with --tiled; 0 = full)')
+    parser.add_argument('--dicom-cache', type=str, default='data/dicom_cache', help='Converted DICOM image cache')
+    parser.add_argument('--dicom-workers', type=int, default=None,
+                        help='Processes converting DICOM files (default: CPU cores)')
+    parser.add_argument('--endpoint-url', type=str, default=None,
+                        help='S3-compatible endpoint for s3:// sources, e.g. MinIO (default: AWS_ENDPOINT_URL or AWS)')
+    parser.add_argument('--s3-concurrency', type=int, default=32, help='Concurrent GET requests for s3:// sources')
+    parser.add_argument('--s3-prefetch', type=int, default=256,
+                        help='Images fetched ahead of the model for s3:// sources (bounds memory; '
+                             'raised to --batch if smaller)')
+    parser.add_argument('--decode-threads', type=int, default=4, help='Threads decoding fetched images (s3://)')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Record spans (load, decode, forward, write; workers included) into this directory '
+                             'and write a Chrome/Perfetto trace.json')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='OpenMetrics textfile with latency histograms and counters, e.g. '
+                             '<node-exporter textfile dir>/cxr_predict.prom (written at the end and every --metrics-interval)')
+    parser.add_argument('--metrics-interval', type=float, default=15.0, help='Seconds between metrics file updates')
+    parser.add_argument('--metrics-label', type=str, nargs='+', default=[], metavar='KEY=VALUE',
+                        help='Labels added to every exported series (e.g. job=nightly)')
+    parser.add_argument('--latency', action='store_true',
+                        help='Print per-stage latency percentiles at the end (implied by --metrics)')
     
     args = parser.parse_args()
+    if args.trace:
+        from utils.trace_utils import enable_tracing
+        enable_tracing(args.trace)
+
+    # cv2/torch/ultralytics грузим после разбора аргументов, чтобы --help отвечал сразу
+    from utils.metrics_utils import PredictionMetrics
+    from utils.object_store_utils import is_object_uri
+    from utils.prediction_writer import PredictionWriter
+    from utils.render_utils import AnnotationRenderer
+    from utils.retrieval_utils import RetrievalIndex, SimilarCaseLookup
     
     print("🎯 ЗАПУСК ПРЕДСКАЗАНИЙ")
     print("=" * 40)
@@ -32,45 +178,231 @@ def main():
         return
     
     # Проверяем источник
-    if not os.path.exists(args.source):
+    if is_object_uri(args.source):
+        if args.render or args.render_below is not None or args.render_positive or args.similar or args.index_insert:
+            print("⚠️ Рендер и похожие случаи читают локальные файлы - для s3:// они отключены")
+            args.render, args.render_below, args.render_positive = False, None, False
+            args.similar, args.index_insert = 0, False
+    elif not os.path.exists(args.source):
         print(f"❌ Источник не найден: {args.source}")
         return
     
+    writer = None
+    if args.output:
+        try:
+            writer = PredictionWriter(args.output, args.model, row_group_size=args.row_group_size, append=args.watch)
+        except (ImportError, ValueError) as e:
+            print(f"❌ {e}")
+            return
+    renderer = None
+    if args.render or args.render_below is not None or args.render_positive:
+        renderer = AnnotationRenderer(
+            output_dir=args.render_dir,
+            below=args.render_below,
+            positive=args.render_positive,
+            workers=args.render_workers
+        )
+    similar = None
+    if args.similar or args.index_insert:
+        index = RetrievalIndex(args.similar_index)
+        if index.model_path is None:
+            # Новый индекс: эмбеддинги считает модель предсказаний
+            index.model_path = args.model
+        if len(index) or args.index_insert:
+            similar = SimilarCaseLookup(index, k=args.similar or 5,
+                                        classes=args.similar_classes if args.similar else (),
+                                        insert=args.index_insert)
+        else:
+            print(f"⚠️ Индекс похожих случаев пуст: {args.similar_index} - поиск отключен")
+            print(f"💡 Соберите архив: python scripts/14_similar_cases.py build --model {args.model}")
+    metrics = None
+    if args.metrics or args.latency:
+        labels = dict(label.split('=', 1) for label in args.metrics_label if '=' in label)
+        metrics = PredictionMetrics(args.metrics, interval=args.metrics_interval, labels=labels)
+    sink = RecordSink(writer, renderer, verbose=not args.quiet, flush_each_batch=args.watch, similar=similar,
+                      metrics=metrics)
+
+    try:
+        run_prediction(args, sink)
+    finally:
+        sink.close()
+        if args.trace:
+            from utils.trace_utils import merge_traces, print_trace_summary
+            output, events = merge_traces(args.trace)
+            print_trace_summary(events)
+            print(f"📁 Трасса (chrome://tracing или ui.perfetto.dev): {output}")
+
+def source_images(args, sink, model=None):
+    """Изображения источника; DICOM конвертируются в кэш по мере предсказания (генератор)
+
+    Размер конвертации берется из загруженной модели; без нее (--workers) - из файла весов.
+    """
+    from itertools import chain
+    from utils.dicom_utils import DICOM_PREFIX, iter_converted, list_dicoms
+    from utils.weights_utils import model_imgsz
+
+    images = list_images(args.source)
+    dicoms = list_dicoms(args.source)
+    if not dicoms:
+        return images
+    # dcm_*.png - ссылки на тот же кэш (02_classify), иначе снимок попал бы дважды
+    images = [path for path in images if not os.path.basename(path).startswith(DICOM_PREFIX)]
+    size = args.dicom_size
+    if size is None:
+        imgsz = model_imgsz(model if model is not None else args.model)
+        size = 0 if args.tiled else (imgsz or 0) * (2 if args.roi else 1)
+    print(f"🩻 DICOM: {len(dicoms)} файлов | меньшая сторона → {size or 'без уменьшения'} | кэш {args.dicom_cache}")
+
+    def converted():
+        failed = []
+        for source, dst, _, source_hash in iter_converted(dicoms, size, args.dicom_cache, args.dicom_workers, failed):
+            sink.path_map[os.path.abspath(dst)] = (source, source_hash)
+            yield dst
+        sink.count_errors('dicom', len(failed))
+
+    return chain(images, converted())
+
+def predict_object_store(args, sink, tta_band):
+    """s3:// источник: загрузка и декодирование идут параллельно с батчами модели"""
+    from utils.object_store_utils import ObjectStoreSource
+    from utils.weights_utils import load_model
+
+    if args.workers > 1 or args.watch or args.tiled or args.roi:
+        print("⚠️ Для s3:// используется обычный батчевый режим (--workers/--watch/--tiled/--roi игнорируются)")
+    print(f"📦 Загружаем модель: {args.model}")
+    model = load_model(args.model)
+    batch = args.batch
+    if args.adaptive_batch:
+        batch = AdaptiveBatchController(initial=args.batch, memory_budget_gb=args.memory_budget,
+                                        log_path=args.batch_log)
+
+    print(f"☁️ Читаем {args.source} | запросов одновременно: {args.s3_concurrency}")
+    start = time.perf_counter()
+    try:
+        # Слоты освобождаются после батча: их должно хватать на самый большой батч
+        with ObjectStoreSource(args.source, concurrency=args.s3_concurrency, prefetch=args.s3_prefetch,
+                               decode_threads=args.decode_threads, endpoint_url=args.endpoint_url,
+                               batch=batch.max_batch if args.adaptive_batch else batch) as source:
+            reported = 0
+            for records in iter_predictions(model, source, conf=args.conf, batch=batch, save=False,
+                                            tta_band=tta_band, loader=source.load):
+                source.finish(records)
+                sink(records)
+                failed = len(source.failed)
+                sink.count_errors('fetch', failed - reported)
+                reported = failed
+            sink.count_errors('fetch', len(source.failed) - reported)
+    finally:
+        if args.adaptive_batch:
+            batch.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Предсказания завершены! Изображений: {sink.count} | {source.bytes_fetched / 1e6:.1f} MB за {elapsed:.1f} с "
+          f"| модель ждала данные {source.wait_seconds:.1f} с")
+    if source.failed:
+        print(f"⚠️ Пропущено объектов: {len(source.failed)}")
+
+def run_prediction(args, sink):
+    """Выбирает режим предсказаний и передает результаты в sink"""
+    from utils.object_store_utils import is_object_uri
+    from utils.roi_utils import RoiCache
+    from utils.tiling_utils import iter_tiled_predictions
+    from utils.weights_utils import load_model
+
+    tta_band = tuple(args.tta_band) if args.tta else None
+    roi_cache = RoiCache(args.roi_cache) if args.roi else None
+
+    if is_object_uri(args.source):
+        predict_object_store(args, sink, tta_band)
+        return
+
+    if args.adaptive_batch and (args.workers > 1 or args.watch):
+        # Контроллер подстраивает батч одного процесса по ходу iter_predictions
+        print("⚠️ --adaptive-batch работает только в обычном батчевом режиме - "
+              "с --workers/--watch используется фиксированный --batch")
+
+    if args.workers > 1 and not args.watch:
+        images = list(source_images(args, sink))
+        print(f"🧵 Воркеров: {args.workers} | Изображений: {len(images)}")
+        for records in iter_sharded(
+            args.model,
+            images,
+            args.workers,
+            conf=args.conf,
+            batch=args.batch,
+            threads=args.threads,
+            affinity=args.affinity,
+            save=False,
+            tta_band=tta_band,
+            roi_cache=roi_cache
+        ):
+            sink(records)
+        print(f"✅ Предсказания завершены! Изображений: {sink.count}")
+        return
+
     # Загружаем модель
     print(f"📦 Загружаем модель: {args.model}")
-    model = YOLO(args.model)
+    model = load_model(args.model)
     
+    if args.watch:
+        if not os.path.isdir(args.source):
+            print(f"❌ Для --watch нужен каталог: {args.source}")
+            return
+        from utils.dicom_utils import list_dicoms
+        if list_dicoms(args.source):
+            # Наблюдатель берет только файлы изображений - DICOM были бы молча пропущены
+            print(f"❌ --watch не конвертирует DICOM: {args.source}")
+            print("💡 Запустите без --watch (DICOM конвертируются в кэш) или наблюдайте каталог без .dcm")
+            return
+        watch_and_predict(
+            model,
+            args.source,
+            args.checkpoint,
+            conf=args.conf,
+            batch=args.batch,
+            interval=args.interval,
+            settle=args.settle,
+            rescan=args.rescan,
+            save=False,
+            on_records=sink,
+            on_error=lambda path, error: sink.count_errors('predict'),
+            tta_band=tta_band,
+            roi_cache=roi_cache
+        )
+        if roi_cache is not None:
+            roi_cache.save()
+        return
+
     # Делаем предсказания
     print(f"🔍 Анализируем: {args.source}")
-    results = model.predict(
-        source=args.source,
-        conf=args.conf,
-        save=True,
-        exist_ok=True
-    )
-    
-    print("✅ Предсказания завершены!")
-    
-    # Показываем результаты
-    for i, result in enumerate(results):
-        print(f"\n📊 Результат {i+1}:")
-        if hasattr(result, 'probs'):
-            # Классификация
-            if result.probs is not None:
-                print("Вероятности классов:")
-                for class_name, prob in zip(result.names.values(), result.probs.data.tolist()):
-                    print(f"   {class_name}: {prob:.2%}")
+    if args.tiled:
+        if model.task != 'detect':
+            print("⚠️ --tiled поддерживается только для модели детекции, используем обычный режим")
         else:
-            # Детекция
-            if len(result.boxes) > 0:
-                print("Обнаруженные объекты:")
-                for box in result.boxes:
-                    class_id = int(box.cls[0])
-                    confidence = box.conf[0]
-                    class_name = result.names[class_id]
-                    print(f"   {class_name}: {confidence:.2%}")
-            else:
-                print("   Объекты не обнаружены")
+            if args.adaptive_batch:
+                print("⚠️ --adaptive-batch не поддерживается с --tiled - используется фиксированный --batch")
+            for records in iter_tiled_predictions(model, list(source_images(args, sink, model)), batch=args.batch,
+                                                  tile=args.tile_size, overlap=args.tile_overlap,
+                                                  conf=args.conf, std_threshold=args.tile_std):
+                sink(records)
+            print(f"✅ Предсказания завершены! Изображений: {sink.count}")
+            return
+
+    batch = args.batch
+    if args.adaptive_batch:
+        batch = AdaptiveBatchController(initial=args.batch, memory_budget_gb=args.memory_budget,
+                                        log_path=args.batch_log)
+    try:
+        for records in iter_predictions(model, source_images(args, sink, model), conf=args.conf, batch=batch,
+                                        save=False, tta_band=tta_band, roi_cache=roi_cache):
+            sink(records)
+    finally:
+        if args.adaptive_batch:
+            batch.close()
+    if roi_cache is not None:
+        roi_cache.save()
+    
+    print(f"✅ Предсказания завершены! Изображений: {sink.count}")
 
 if __name__ == "__main__":
     main()
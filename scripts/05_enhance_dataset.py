@@ -5,6 +5,7 @@ Dataset enhancement and balancing script
 
 import sys
 import os
+import argparse
 
 # Добавляем пути
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +14,7 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 try:
+    from utils.augment_utils import AUG_CACHE_DIR, augment_minority_classes
     from utils.data_balancer import DataBalancer
     print("✅ Импорты успешны!")
 except ImportError as e:
@@ -20,25 +22,47 @@ except ImportError as e:
     sys.exit(1)
 
 def main():
+    parser = argparse.ArgumentParser(description='Balance the training set with cached augmentations')
+    parser.add_argument('--data', type=str, default='./data', help='Dataset root with train/<class>/')
+    parser.add_argument('--train-dir', type=str, default=None,
+                        help='Class folders the augmentations are linked into (default: <data>/train, '
+                             'the folder 02_classify.py trains on)')
+    parser.add_argument('--target', type=int, default=None, help='Images per class (default: largest class)')
+    parser.add_argument('--seed', type=int, default=0, help='Augmentation seed')
+    parser.add_argument('--workers', type=int, default=None, help='Augmentation processes (default: CPU cores)')
+    parser.add_argument('--cache-dir', type=str, default=AUG_CACHE_DIR, help='Content-addressed augmentation cache')
+    parser.add_argument('--dry-run', action='store_true', help='Only analyze and recommend')
+    args = parser.parse_args()
+
     print("🔄 УЛУЧШЕНИЕ И БАЛАНСИРОВКА ДАТАСЕТА")
     print("=" * 50)
     
-    # Инициализация балансера
-    balancer = DataBalancer('./data')
-    
-    # Анализ текущего состояния
-    current_counts = balancer.analyze_current_balance()
+    train_dir = args.train_dir or os.path.join(args.data, 'train')
+    if not os.path.isdir(train_dir):
+        print(f"❌ Папка обучения не найдена: {train_dir}")
+        return
+
+    # Анализ той же папки, которую балансируем
+    balancer = DataBalancer(args.data)
+    current_counts = balancer.analyze_current_balance(split_dir=train_dir)
+    if not current_counts:
+        return
     
-    # Рекомендации по улучшению
-    balancer.recommend_actions(current_counts)
+    # Одна цель для рекомендаций и аугментации
+    target = args.target or max(current_counts.values())
+    balancer.recommend_actions(current_counts, target)
+    if args.dry_run:
+        return
     
-    print("\n🎯 МЕТОДЫ УЛУЧШЕНИЯ:")
-    print("1. Аугментация данных для minority классов")
-    print("2. Сбор дополнительных данных")
-    print("3. Использование взвешенной функции потерь")
-    print("4. Применение техник oversampling")
+    # Аугментация minority классов до целевого размера
+    print("\n🎨 АУГМЕНТАЦИЯ MINORITY КЛАССОВ...")
+    summary = augment_minority_classes(train_dir, target=target,
+                                       seed=args.seed, cache_dir=args.cache_dir, workers=args.workers)
+    for class_name, (originals, augmented) in summary.items():
+        print(f"   {class_name}: {originals} исходных + {augmented} аугментаций = {originals + augmented}")
     
-    print("\n✅ Рекомендации по балансировке применены!")
+    print(f"\n✅ Балансировка применена! Аугментации подключены в {train_dir} как aug_*")
+    print("💡 Веса классов в функции потерь - альтернатива: см. utils/imbalance_utils.py")
 
 if __name__ == "__main__":
     main()
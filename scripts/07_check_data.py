@@ -3,33 +3,50 @@
 Проверка реальных данных перед обучением
 """
 
+import sys
 import os
-import glob
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.cache_utils import STATUS_OK, class_counts, read_dataset_cache
+from utils.dicom_utils import dicom_link_name, list_dicoms
 
 def check_real_data():
     print("🔍 ПРОВЕРКА РЕАЛЬНЫХ ДАННЫХ")
     print("=" * 40)
     
-    folders = {
-        'normal': 'data/images/train/normal',
-        'clavicle_fracture': 'data/images/train/clavicle_fracture', 
-        'foreign_body': 'data/images/train/foreign_body'
-    }
+    expected = ['normal', 'clavicle_fracture', 'foreign_body']
+    train_dir = 'data/train'  # папка, на которой обучается 02_classify.py
     
     total_files = 0
     
-    for class_name, folder_path in folders.items():
-        if os.path.exists(folder_path):
-            # Ищем все изображения
-            image_files = []
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.JPG', '*.JPEG', '*.PNG']:
-                image_files.extend(glob.glob(os.path.join(folder_path, ext)))
-            
-            print(f"📁 {class_name}: {len(image_files)} файлов")
-            
-            total_files += len(image_files)
-        else:
-            print(f"❌ {class_name}: папка не существует")
+    if os.path.isdir(train_dir):
+        # Статусы и размеры из data/train.cache (пересобирается, если папки или файлы менялись)
+        arrays = read_dataset_cache(train_dir)
+        counts = class_counts(arrays)
+        for class_name in expected:
+            if class_name in counts:
+                print(f"📁 {class_name}: {counts[class_name]} файлов")
+            else:
+                print(f"❌ {class_name}: папка не существует")
+        total_files = sum(counts.values())
+        broken = int((arrays['status'] != STATUS_OK).sum())
+        if broken:
+            print(f"⚠️  Битых/нечитаемых файлов: {broken}")
+        # DICOM попадает в обучение как ссылка dcm_<имя>.png на сконвертированный снимок
+        dicoms = list_dicoms(train_dir)
+        pending = [p for p in dicoms if not os.path.lexists(os.path.join(os.path.dirname(p), dicom_link_name(p)))]
+        if pending:
+            print(f"🩻 DICOM: {len(dicoms)} файлов, не сконвертировано {len(pending)} "
+                  f"(конвертирует 02_classify.py, --dicom-size)")
+        elif dicoms:
+            print(f"🩻 DICOM: {len(dicoms)} файлов, все сконвертированы и учтены выше")
+    else:
+        print(f"❌ {train_dir}: папка не существует")
     
     print(f"\n📊 ВСЕГО ФАЙЛОВ: {total_files}")
     
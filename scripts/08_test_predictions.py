@@ -4,15 +4,30 @@
 Автоматически находит модели и изображения для тестирования
 """
 
+import sys
 import os
 import glob
 import argparse
 from ultralytics import YOLO
 
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.inference_utils import result_to_record
+from utils.prediction_writer import PredictionWriter
+from utils.render_utils import AnnotationRenderer
+from utils.run_registry import RunRegistry
+
 def find_models():
-    """Находит все обученные модели"""
+    """Находит обученные модели в реестре запусков (новые первыми)"""
     print("🔍 ПОИСК ОБУЧЕННЫХ МОДЕЛЕЙ...")
-    model_paths = glob.glob("runs/**/best.pt", recursive=True)
+    registry = RunRegistry()
+    # Запуски, обученные до появления реестра или без него (уже записанные пропускаются без хэширования)
+    registry.import_runs('runs')
+    model_paths = registry.checkpoints()
     
     if not model_paths:
         print("❌ Модели не найдены! Сначала обучите модель.")
@@ -52,20 +67,21 @@ def find_images():
     
     return all_images
 
-def test_single_prediction(model_path, image_path):
-    """Тестирует одну модель на одном изображении"""
+def test_single_prediction(model_path, image_path, model=None, renderer=None):
+    """Тестирует одну модель на одном изображении, возвращает запись предсказания"""
     print(f"\\n🎯 ТЕСТ: {os.path.basename(model_path)} → {os.path.basename(image_path)}")
     print("=" * 60)
     
     try:
         # Загружаем модель
-        model = YOLO(model_path)
+        if model is None:
+            model = YOLO(model_path)
         
         # Делаем предсказание
         results = model.predict(
             source=image_path,
-            save=True,
-            exist_ok=True
+            save=False,
+            verbose=False
         )
         
         # Выводим результаты
@@ -85,11 +101,26 @@ def test_single_prediction(model_path, image_path):
                 
         else:
             print("❌ Модель не вернула вероятности классов")
+
+        record = result_to_record(results[0])
+        if renderer is not None:
+            renderer.submit([record])
+        return record
             
     except Exception as e:
         print(f"❌ Ошибка при предсказании: {e}")
+        return None
+
+def save_records(records, model_path, output):
+    """Сохраняет записи предсказаний в колоночный файл"""
+    records = [r for r in records if r is not None]
+    if not records:
+        return
+    with PredictionWriter(output, model_path) as writer:
+        writer.write(records)
+    print(f"\n💾 Предсказания сохранены: {writer.location} ({len(records)} строк)")
 
-def run_comprehensive_test():
+def run_comprehensive_test(output=None, renderer=None):
     """Запускает комплексное тестирование"""
     print("🎯 КОМПЛЕКСНОЕ ТЕСТИРОВАНИЕ ПРЕДСКАЗАНИЙ")
     print("=" * 50)
@@ -107,27 +138,49 @@ def run_comprehensive_test():
     test_images = [img for img in images if 'test' in img.lower()][:3]  # Берем первые 3 тестовых
     
     print(f"\\n🚀 ТЕСТИРУЕМ МОДЕЛЬ: {os.path.basename(model_path)}")
+    model = YOLO(model_path)
     
+    records = []
     for i, image_path in enumerate(test_images, 1):
         print(f"\\n📸 ИЗОБРАЖЕНИЕ {i}/{len(test_images)}:")
-        test_single_prediction(model_path, image_path)
+        records.append(test_single_prediction(model_path, image_path, model=model, renderer=renderer))
+
+    if output:
+        save_records(records, model_path, output)
 
 def main():
     parser = argparse.ArgumentParser(description='Тестирование предсказаний на доступных данных')
     parser.add_argument('--comprehensive', action='store_true', help='Запуск комплексного тестирования')
     parser.add_argument('--model', type=str, help='Путь к конкретной модели')
     parser.add_argument('--image', type=str, help='Путь к конкретному изображению')
+    parser.add_argument('--output', type=str, help='Сохранить предсказания в .parquet / .npz')
+    parser.add_argument('--render', action='store_true', help='Сохранить аннотированные изображения (в фоне)')
+    parser.add_argument('--render-below', type=float, default=None, help='Сохранять только при уверенности ниже порога')
     
     args = parser.parse_args()
+    if args.output and not args.output.lower().endswith(('.parquet', '.npz')):
+        # Проверяем до прогона модели, а не при записи результатов
+        print(f"❌ Неизвестный формат вывода {args.output}: нужен .parquet или .npz")
+        return
+
+    renderer = None
+    if args.render or args.render_below is not None:
+        renderer = AnnotationRenderer(below=args.render_below)
     
-    if args.comprehensive:
-        run_comprehensive_test()
-    elif args.model and args.image:
-        test_single_prediction(args.model, args.image)
-    else:
-        print("🎯 ИСПОЛЬЗОВАНИЕ:")
-        print("  python 08_test_predictions.py --comprehensive  # Автотест всех данных")
-        print("  python 08_test_predictions.py --model path/to/model.pt --image path/to/image.jpg  # Тест конкретной пары")
+    try:
+        if args.comprehensive:
+            run_comprehensive_test(args.output, renderer)
+        elif args.model and args.image:
+            record = test_single_prediction(args.model, args.image, renderer=renderer)
+            if args.output:
+                save_records([record], args.model, args.output)
+        else:
+            print("🎯 ИСПОЛЬЗОВАНИЕ:")
+            print("  python 08_test_predictions.py --comprehensive  # Автотест всех данных")
+            print("  python 08_test_predictions.py --model path/to/model.pt --image path/to/image.jpg  # Тест конкретной пары")
+    finally:
+        if renderer is not None:
+            renderer.close()
 
 if __name__ == "__main__":
     main()
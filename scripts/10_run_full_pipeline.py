@@ -35,21 +35,43 @@ import subprocess
 import time
 from pathlib import Path
 
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.trace_utils import enable_tracing, merge_traces, print_trace_summary, span
+
+# Трасса и полные логи этапов этого запуска (задается в run_full_pipeline)
+TRACE_DIR = None
+_stage_counter = 0
+
 def run_command(command, description):
     """Запускает команду с обработкой ошибок"""
+    global _stage_counter
     print(f"\\n🎯 {description}")
     print(f"🚀 Выполняю: {command}")
     print("-" * 60)
     
     try:
-        # Запускаем команду
-        result = subprocess.run(
-            command, 
-            shell=True, 
-            capture_output=True, 
-            text=True,
-            check=False  # Не выбрасывать исключение при ошибке
-        )
+        # Запускаем команду; дочерний процесс пишет свои спаны в ту же трассу (CXR_TRACE_DIR)
+        with span(description, cat='stage', command=command):
+            result = subprocess.run(
+                command, 
+                shell=True, 
+                capture_output=True, 
+                text=True,
+                check=False  # Не выбрасывать исключение при ошибке
+            )
+
+        # Полный вывод этапа - в лог рядом с трассой, в консоль только хвост
+        _stage_counter += 1
+        log_path = None
+        if TRACE_DIR:
+            log_path = os.path.join(TRACE_DIR, f'stage_{_stage_counter:02d}.log')
+            with open(log_path, 'w', encoding='utf-8') as f:
+                f.write(f"$ {command}\n\n--- stdout ---\n{result.stdout}\n--- stderr ---\n{result.stderr}")
         
         if result.returncode == 0:
             print(f"✅ Успешно: {description}")
@@ -60,9 +82,13 @@ def run_command(command, description):
                     if line.strip():
                         print(f"   📝 {line}")
         else:
-            print(f"⚠️  Проблема в {description}")
+            print(f"⚠️  Проблема в {description} (код {result.returncode})")
             if result.stderr:
-                print(f"   ❌ Ошибка: {result.stderr[:200]}...")
+                # Traceback заканчивается самой ошибкой - показываем конец, а не начало
+                for line in result.stderr.strip().splitlines()[-15:]:
+                    print(f"   ❌ {line}")
+            if log_path:
+                print(f"   📄 Полный вывод: {log_path}")
         
         return result.returncode == 0
         
@@ -93,7 +119,20 @@ def check_prerequisites():
     return all_ok
 
 def run_full_pipeline():
-    """Запускает полный пайплайн"""
+    """Запускает полный пайплайн с трассировкой этапов (runs/trace/<время запуска>/)"""
+    global TRACE_DIR
+    TRACE_DIR = enable_tracing(os.path.join('runs', 'trace', time.strftime('%Y%m%d-%H%M%S')))
+    try:
+        with span('pipeline', cat='stage'):
+            _run_stages()
+    finally:
+        output, events = merge_traces(TRACE_DIR)
+        print("\n" + "="*60)
+        print_trace_summary(events)
+        print(f"📁 Трасса (chrome://tracing или ui.perfetto.dev): {output}")
+
+def _run_stages():
+    """Этапы пайплайна по порядку"""
     print("🎯 ЗАПУСК ПОЛНОГО ПАЙПЛАЙНА CHEST X-RAY CLASSIFICATION")
     print("=" * 65)
     print("📋 Этапы пайплайна:")
@@ -139,8 +178,15 @@ def run_full_pipeline():
     
     # Проверяем, не обучена ли модель уже
     if os.path.exists("runs/classify/train/weights/best.pt"):
-        print("✅ Модель уже обучена! Пропускаем этап обучения.")
-        print("💡 Для переобучения удалите папку: runs/classify/train/")
+        print("✅ Модель уже обучена! Дообучаем только на новых изображениях (если они есть).")
+        print("💡 Для полного переобучения удалите папку: runs/classify/train/")
+        update_success = run_command(
+            "python scripts/02_classify.py --update",
+            "Инкрементальное дообучение на новых изображениях"
+        )
+        if not update_success:
+            print("❌ Ошибка дообучения модели! Пропускаем следующие этапы.")
+            return
     else:
         stage2_success = run_command(
             "python scripts/02_classify.py", 
@@ -223,7 +269,8 @@ def run_full_pipeline():
     print("\\n🚀 ДАЛЬНЕЙШИЕ ДЕЙСТВИЯ:")
     next_steps = [
         "• Для отдельных предсказаний: python scripts/04_predict.py --model best.pt --source your_image.jpg",
-        "• Для переобучения: удалите папку runs/classify/train/ и запустите снова",
+        "• Для дообучения на новых снимках: python scripts/02_classify.py --update",
+        "• Для полного переобучения: удалите папку runs/classify/train/ и запустите снова",
         "• Для анализа: python scripts/09_analyze_results.py",
         "• Для тестирования: python scripts/08_test_predictions.py --comprehensive"
     ]
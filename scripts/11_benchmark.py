@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки производительности инференса
+"""
+
+import sys
+import os
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.inference_utils import list_images, list_labeled_images, predict_paths, predict_sharded
+from utils.startup_utils import append_startup_history, measure_startup
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... up to max_workers (always including max_workers)"""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def benchmark_workers(model_path, source, max_workers, batch=16, repeat=1, affinity=False):
+    """Отчет о масштабировании: пропускная способность от 1 до N воркеров"""
+    images = list_images(source) * repeat
+    if not images:
+        print(f"❌ Изображения не найдены: {source}")
+        return []
+
+    print("📈 МАСШТАБИРОВАНИЕ ПО ВОРКЕРАМ")
+    print(f"🖼️ Изображений: {len(images)} | Батч: {batch}")
+    print("=" * 50)
+
+    rows = []
+    for workers in worker_counts(max_workers):
+        # Запуск процессов и загрузка моделей растут с числом воркеров - меряем их отдельно от предсказания
+        ready = []
+        start = time.perf_counter()
+        predict_sharded(model_path, images, workers, batch=batch, affinity=affinity,
+                        on_ready=lambda: ready.append(time.perf_counter()))
+        elapsed = time.perf_counter() - ready[0]
+        rows.append((workers, ready[0] - start, elapsed, len(images) / elapsed))
+
+    base = rows[0][3]
+    print(f"{'Воркеры':>8} | {'Запуск, с':>9} | {'Время, с':>9} | {'изобр/с':>8} | {'Ускорение':>9}")
+    print("-" * 57)
+    for workers, startup, elapsed, throughput in rows:
+        print(f"{workers:>8} | {startup:>9.2f} | {elapsed:>9.2f} | {throughput:>8.1f} | {throughput / base:>8.2f}x")
+    return rows
+
+
+def benchmark_tiling(model_path, source, labels_dir, tile=640, overlap=0.2, conf=0.25, std_threshold=6.0):
+    """Сравнение тайлового и обычного инференса детектора: скорость и recall"""
+    from ultralytics import YOLO
+    from utils.tiling_utils import recall_at_iou, tiled_detect
+
+    images = list_images(source)
+    if not images:
+        print(f"❌ Изображения не найдены: {source}")
+        return None
+
+    model = YOLO(model_path)
+    if model.task != 'detect':
+        print(f"❌ Нужна модель детекции, а не {model.task}")
+        return None
+
+    print("🧩 ТАЙЛОВЫЙ ИНФЕРЕНС vs ЦЕЛОЕ ИЗОБРАЖЕНИЕ")
+    print(f"🖼️ Изображений: {len(images)} | Тайл: {tile} | Перекрытие: {overlap:.0%}")
+    print("=" * 50)
+
+    # Прогрев, чтобы не мерить инициализацию
+    predict_paths(model, images[:1], conf=conf)
+
+    start = time.perf_counter()
+    whole = predict_paths(model, images, conf=conf, batch=1)
+    whole_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiled = [tiled_detect(model, path, tile=tile, overlap=overlap, conf=conf, std_threshold=std_threshold)
+             for path in images]
+    tiled_time = time.perf_counter() - start
+
+    total_tiles = sum(r['tiles'] for r in tiled)
+    skipped = sum(r['skipped_tiles'] for r in tiled)
+    whole_recall, n_boxes = recall_at_iou(whole, labels_dir)
+    tiled_recall, _ = recall_at_iou(tiled, labels_dir)
+
+    print(f"{'Режим':>14} | {'изобр/с':>8} | {'Recall@0.5':>10}")
+    print("-" * 40)
+    print(f"{'целое':>14} | {len(images) / whole_time:>8.2f} | {whole_recall:>10.3f}")
+    print(f"{'тайлы':>14} | {len(images) / tiled_time:>8.2f} | {tiled_recall:>10.3f}")
+    print(f"\n📦 GT боксов: {n_boxes} | Тайлов: {total_tiles} | Пропущено фоновых: {skipped}")
+    return {'whole': (whole_time, whole_recall), 'tiled': (tiled_time, tiled_recall)}
+
+
+def _timed_accuracy(model, paths, labels, **kwargs):
+    start = time.perf_counter()
+    records = predict_paths(model, paths, **kwargs)
+    elapsed = time.perf_counter() - start
+    correct = sum(1 for record, label in zip(records, labels) if record['top1'] == label)
+    return len(paths) / elapsed, correct / len(paths)
+
+
+def benchmark_roi(model_path, roi_model_path, images_dir='data', split='test', batch=16):
+    """Скорость и точность: полный кадр vs ROI кроп (холодный и теплый кэш боксов)"""
+    from ultralytics import YOLO
+    from utils.roi_utils import RoiCache
+
+    model = YOLO(model_path)
+    roi_model = YOLO(roi_model_path)
+    class_names = [model.names[i] for i in sorted(model.names)]
+    paths, labels = list_labeled_images(os.path.join(images_dir, split), class_names)
+    if not paths:
+        print(f"❌ Изображения не найдены: {os.path.join(images_dir, split)}")
+        return None
+
+    print("✂️ ROI КРОП vs ПОЛНЫЙ КАДР")
+    print(f"🖼️ Изображений: {len(paths)} | imgsz: {model.overrides.get('imgsz')} → {roi_model.overrides.get('imgsz')}")
+    print("=" * 50)
+
+    # Прогрев
+    predict_paths(model, paths[:1])
+    predict_paths(roi_model, paths[:1])
+
+    cache_path = os.path.join('runs', 'benchmark', 'roi_cache.json')
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+
+    rows = [("полный кадр", *_timed_accuracy(model, paths, labels, batch=batch))]
+    rows.append(("ROI, холодный", *_timed_accuracy(roi_model, paths, labels, batch=batch,
+                                                  roi_cache=RoiCache(cache_path))))
+    cache = RoiCache(cache_path)
+    for path in paths:
+        cache.get_box(path)
+    rows.append(("ROI, теплый", *_timed_accuracy(roi_model, paths, labels, batch=batch, roi_cache=cache)))
+
+    print(f"{'Режим':>14} | {'изобр/с':>8} | {'Accuracy':>8}")
+    print("-" * 38)
+    for name, throughput, accuracy in rows:
+        print(f"{name:>14} | {throughput:>8.2f} | {accuracy:>8.3f}")
+    return rows
+
+
+def benchmark_startup(budget_ms=200, repeat=5, history='runs/benchmark/startup.csv'):
+    """Время запуска `cxr --help` и `cxr <команда> --help` (без тяжелых импортов)"""
+    from scripts.cli import COMMANDS
+
+    print("⏱️ ВРЕМЯ ЗАПУСКА CLI (python -X importtime)")
+    print(f"🎯 Бюджет: {budget_ms} мс | лучшее из {repeat}")
+    print("=" * 50)
+
+    commands = [['-m', 'scripts.cli', '--help']] + [['-m', 'scripts.cli', name, '--help'] for name in COMMANDS]
+    rows = [measure_startup(args, repeat=repeat, cwd=project_root) for args in commands]
+
+    print(f"{'Команда':>28} | {'Запуск, мс':>10} | {'Импорты, мс':>11} | Самые тяжелые импорты")
+    print("-" * 90)
+    slow = 0
+    for row in rows:
+        mark = '✅' if row['wall_ms'] <= budget_ms else '❌'
+        slow += row['wall_ms'] > budget_ms
+        name = row['command'].replace('-m scripts.cli', 'cxr')
+        print(f"{name:>28} | {row['wall_ms']:>10.1f} | {row['import_ms']:>11.1f} | {row['heaviest']} {mark}")
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    append_startup_history(rows, history, commit)
+    print(f"\n📁 История замеров: {history}")
+    return slow == 0
+
+
+# Холодный старт в отдельном процессе: импорты -> загрузка весов -> первое предсказание
+_COLDSTART_SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import torch, ultralytics
+imported = time.perf_counter()
+from utils.weights_utils import load_model
+model = load_model({model!r})
+loaded = time.perf_counter()
+model.predict({image!r}, verbose=False)
+done = time.perf_counter()
+import psutil
+memory = psutil.Process().memory_full_info()
+print(json.dumps({{'imports': imported - start, 'load': loaded - imported, 'predict': done - loaded,
+                  'uss_mb': memory.uss / 1e6, 'shared_mb': memory.shared / 1e6}}))
+"""
+
+
+def benchmark_coldstart(model_path, source, mapped_path=None, repeat=3):
+    """Холодный старт: чекпоинт .pt vs веса .safetensors (mmap), медиана по свежим процессам"""
+    from utils.weights_utils import WEIGHTS_SUFFIX, export_inference_weights
+
+    images = list_images(source)
+    if not images:
+        print(f"❌ Изображения не найдены: {source}")
+        return None
+    mapped_path = mapped_path or os.path.splitext(model_path)[0] + WEIGHTS_SUFFIX
+    if not os.path.exists(mapped_path):
+        export_inference_weights(model_path, mapped_path)
+
+    print("🧊 ХОЛОДНЫЙ СТАРТ: .pt vs .safetensors")
+    print(f"🔁 Свежих процессов на формат: {repeat}")
+    print("=" * 50)
+
+    rows = []
+    for path in (model_path, mapped_path):
+        code = _COLDSTART_SNIPPET.format(root=project_root, model=os.path.abspath(path), image=images[0])
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+            wall = time.perf_counter() - start
+            if completed.returncode != 0:
+                print(f"❌ {path}: {completed.stderr[-500:]}")
+                return None
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            run['wall'] = wall
+            runs.append(run)
+        rows.append((os.path.basename(path), {key: statistics.median(run[key] for run in runs) for key in runs[0]}))
+
+    print(f"{'Веса':>18} | {'импорты':>8} | {'загрузка':>8} | {'1-й прогноз':>11} | {'всего':>7} | {'USS, MB':>8}")
+    print("-" * 78)
+    for name, m in rows:
+        print(f"{name:>18} | {m['imports'] * 1000:>6.0f}мс | {m['load'] * 1000:>6.0f}мс | "
+              f"{m['predict'] * 1000:>9.0f}мс | {m['wall']:>6.2f}с | {m['uss_mb']:>8.1f}")
+    return rows
+
+def write_synthetic_dicoms(images, out_dir, count, size=(2500, 2048)):
+    """12-bit MONOCHROME1 DICOM files (detector-sized, windowed) made from ordinary images"""
+    import cv2
+    import numpy as np
+    import pydicom
+    from pydicom.dataset import FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(count):
+        gray = cv2.imread(images[i % len(images)], cv2.IMREAD_GRAYSCALE)
+        pixels = cv2.resize(gray, (size[1], size[0]), interpolation=cv2.INTER_LINEAR).astype(np.uint16) * 16
+        pixels = 4095 - pixels  # MONOCHROME1: кости темные в сырых значениях
+        pixels[0, 0] = i  # разное содержимое - разные ключи кэша
+
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1.1'  # Digital X-Ray Image
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = pydicom.Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID, ds.SOPInstanceUID = meta.MediaStorageSOPClassUID, meta.MediaStorageSOPInstanceUID
+        ds.Modality = 'DX'
+        ds.Rows, ds.Columns = pixels.shape
+        ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME1'
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+        ds.RescaleSlope, ds.RescaleIntercept = 1, 0
+        ds.WindowCenter, ds.WindowWidth = 2048, 3500
+        ds.PixelData = pixels.tobytes()
+        path = os.path.join(out_dir, f'study_{i:05d}.dcm')
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def benchmark_dicom(source, max_workers, size=224, count=32):
+    """Конвертация DICOM в кэш PNG: исследований/с от 1 до N процессов, плюс повтор из кэша"""
+    import shutil
+    import tempfile
+    from utils.dicom_utils import iter_converted, list_dicoms
+
+    work_dir = tempfile.mkdtemp(prefix='cxr_dicom_bench_')
+    try:
+        dicoms = list_dicoms(source)
+        if not dicoms:
+            images = list_images(source)
+            if not images:
+                print(f"❌ Нет ни DICOM, ни изображений: {source}")
+                return []
+            print(f"🧪 DICOM в {source} нет - генерируем {count} синтетических (12 бит, MONOCHROME1, 2500x2048)")
+            dicoms = write_synthetic_dicoms(images, os.path.join(work_dir, 'dicom'), count)
+
+        megabytes = sum(os.path.getsize(p) for p in dicoms) / 1e6
+        print("🩻 КОНВЕРТАЦИЯ DICOM")
+        print(f"📄 Исследований: {len(dicoms)} ({megabytes:.0f} MB) | меньшая сторона → {size or 'без уменьшения'}")
+        print("=" * 50)
+
+        rows = []
+        for workers in worker_counts(max_workers):
+            cache_dir = os.path.join(work_dir, f'cache_{workers}')
+            start = time.perf_counter()
+            for _ in iter_converted(dicoms, size, cache_dir, workers):
+                pass
+            elapsed = time.perf_counter() - start
+            rows.append((workers, elapsed, len(dicoms) / elapsed))
+        # Повтор: все в кэше, остается только хэш содержимого
+        start = time.perf_counter()
+        for _ in iter_converted(dicoms, size, cache_dir, max_workers):
+            pass
+        cached = len(dicoms) / (time.perf_counter() - start)
+
+        base = rows[0][2]
+        print(f"{'Процессы':>8} | {'Время, с':>9} | {'иссл/с':>8} | {'Ускорение':>9}")
+        print("-" * 45)
+        for workers, elapsed, throughput in rows:
+            print(f"{workers:>8} | {elapsed:>9.2f} | {throughput:>8.1f} | {throughput / base:>8.2f}x")
+        print(f"♻️ Повтор из кэша ({max_workers} проц.): {cached:.1f} иссл/с")
+        return rows
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _start_local_s3(port=5055):
+    """moto в отдельном потоке вместо S3/MinIO; фиктивные ключи только для него"""
+    import logging
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    for key, value in (('AWS_ACCESS_KEY_ID', 'bench'), ('AWS_SECRET_ACCESS_KEY', 'bench'),
+                       ('AWS_DEFAULT_REGION', 'us-east-1')):
+        os.environ.setdefault(key, value)
+    server = ThreadedMotoServer(port=port, verbose=False)
+    server.start()
+    return server, f'http://127.0.0.1:{port}'
+
+
+def benchmark_object_store(model_path, source, endpoint_url=None, batch=16, repeat=1, concurrency=32):
+    """Перекрытие загрузки и инференса: только загрузка, только модель, конвейер"""
+    from ultralytics import YOLO
+    from utils.inference_utils import iter_predictions
+    from utils.object_store_utils import ObjectStoreSource, is_object_uri, upload_directory
+
+    server = None
+    uri = source
+    if not is_object_uri(source):
+        try:
+            server, endpoint_url = _start_local_s3()
+        except ImportError:
+            print("❌ Для локального S3 нужен moto[server] (или укажите s3:// источник и --endpoint-url)")
+            return None
+        uri = 's3://cxr-bench/images'
+        count = upload_directory(source, uri, endpoint_url=endpoint_url, repeat=repeat)
+        print(f"🧪 Локальный S3 (moto): загружено {count} объектов из {source}")
+
+    def open_source():
+        return ObjectStoreSource(uri, concurrency=concurrency, endpoint_url=endpoint_url, batch=batch)
+
+    try:
+        model = YOLO(model_path)
+        # Только загрузка + декодирование (изображения сохраняем для прогона модели)
+        images = {}
+        start = time.perf_counter()
+        with open_source() as store:
+            for key in store:
+                images[key] = store.load(key)
+                store.finish([{'path': key}])
+        fetch_s = time.perf_counter() - start
+        megabytes = store.bytes_fetched / 1e6
+        if not images:
+            print(f"❌ Изображения не найдены: {uri}")
+            return None
+
+        # Прогрев, затем только модель на уже декодированных изображениях
+        predict_paths(model, list(images)[:batch], batch=batch, loader=images.get)
+        start = time.perf_counter()
+        for _ in iter_predictions(model, list(images), batch=batch, loader=images.get):
+            pass
+        infer_s = time.perf_counter() - start
+
+        # Конвейер: загрузка идет, пока модель считает предыдущие батчи
+        start = time.perf_counter()
+        with open_source() as store:
+            for records in iter_predictions(model, store, batch=batch, loader=store.load):
+                store.finish(records)
+        pipeline_s = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.stop()
+
+    serial_s = fetch_s + infer_s
+    hidden = max(0.0, serial_s - pipeline_s)
+    efficiency = min(1.0, hidden / min(fetch_s, infer_s)) if min(fetch_s, infer_s) > 0 else 0.0
+    print("☁️ ПЕРЕКРЫТИЕ ЗАГРУЗКИ И ИНФЕРЕНСА")
+    print(f"🖼️ Объектов: {len(images)} ({megabytes:.1f} MB) | батч {batch} | запросов одновременно: {concurrency}")
+    print("=" * 50)
+    print(f"{'загрузка + декодирование':>26}: {fetch_s:>7.2f} с ({len(images) / fetch_s:.1f} изобр/с, "
+          f"{megabytes / fetch_s:.1f} MB/с)")
+    print(f"{'только модель':>26}: {infer_s:>7.2f} с ({len(images) / infer_s:.1f} изобр/с)")
+    print(f"{'последовательно (сумма)':>26}: {serial_s:>7.2f} с")
+    print(f"{'конвейер':>26}: {pipeline_s:>7.2f} с (модель ждала данные {store.wait_seconds:.2f} с)")
+    # 1.0 - более короткая стадия полностью спрятана за более длинной
+    print(f"🔀 Эффективность перекрытия: {efficiency:.0%} | ускорение к последовательному: {serial_s / pipeline_s:.2f}x")
+    return {'fetch_s': fetch_s, 'infer_s': infer_s, 'pipeline_s': pipeline_s, 'efficiency': efficiency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inference benchmarks')
+    parser.add_argument('--mode', type=str, default='workers', choices=['workers', 'tiling', 'roi', 'startup', 'coldstart', 'dicom', 's3'],
+                        help='Benchmark to run (startup: CLI start time via python -X importtime; '
+                             'coldstart: .pt vs .safetensors load in fresh processes; '
+                             'dicom: DICOM conversion studies/s by process count; '
+                             's3: fetch/inference overlap for an s3:// source or a local moto copy of --source)')
+    parser.add_argument('--model', type=str, default='runs/classify/train/weights/best.pt', help='Path to model weights')
+    parser.add_argument('--source', type=str, default='data/images', help='Image or directory')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='Largest worker count to test')
+    parser.add_argument('--batch', type=int, default=16, help='Batch size')
+    parser.add_argument('--repeat', type=int, default=1, help='Repeat the image list to get a larger workload')
+    parser.add_argument('--affinity', action='store_true', help='Pin workers to CPU core groups')
+    parser.add_argument('--labels', type=str, default='data/labels/test', help='YOLO labels for recall (tiling)')
+    parser.add_argument('--tile-size', type=int, default=640, help='Tile size (tiling)')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='Tile overlap fraction (tiling)')
+    parser.add_argument('--roi-model', type=str, default='runs/classify/train_roi/weights/best.pt',
+                        help='Model trained on ROI crops (roi)')
+    parser.add_argument('--data-dir', type=str, default='data/images', help='Class-folder dataset root with test split (roi)')
+    parser.add_argument('--mapped', type=str, default=None,
+                        help='Exported .safetensors weights (coldstart; default: next to --model, exported if missing)')
+    parser.add_argument('--budget-ms', type=float, default=200, help='Startup budget per command in ms (startup)')
+    parser.add_argument('--startup-repeat', type=int, default=5,
+                        help='Fresh processes per command (startup, best kept) or per weights format (coldstart, median)')
+    parser.add_argument('--dicom-size', type=int, default=224, help='Shorter side after DICOM conversion (dicom)')
+    parser.add_argument('--dicom-count', type=int, default=32,
+                        help='Synthetic studies generated when --source has no DICOM files (dicom)')
+    parser.add_argument('--endpoint-url', type=str, default=None, help='S3-compatible endpoint for an s3:// --source (s3)')
+    parser.add_argument('--s3-concurrency', type=int, default=32, help='Concurrent GET requests (s3)')
+
+    args = parser.parse_args()
+
+    if args.mode == 'startup':
+        # Ненулевой код возврата при превышении бюджета - для CI
+        if not benchmark_startup(args.budget_ms, args.startup_repeat):
+            sys.exit(1)
+        return
+    if args.mode == 'dicom':
+        benchmark_dicom(args.source, args.max_workers, size=args.dicom_size, count=args.dicom_count)
+        return
+
+    if not os.path.exists(args.model):
+        print(f"❌ Модель не найдена: {args.model}")
+        return
+
+    if args.mode == 'workers':
+        benchmark_workers(args.model, args.source, args.max_workers,
+                          batch=args.batch, repeat=args.repeat, affinity=args.affinity)
+    elif args.mode == 'tiling':
+        benchmark_tiling(args.model, args.source, args.labels, tile=args.tile_size, overlap=args.tile_overlap)
+    elif args.mode == 'roi':
+        benchmark_roi(args.model, args.roi_model, args.data_dir, batch=args.batch)
+    elif args.mode == 'coldstart':
+        benchmark_coldstart(args.model, args.source, args.mapped, repeat=args.startup_repeat)
+    elif args.mode == 's3':
+        benchmark_object_store(args.model, args.source, args.endpoint_url, batch=args.batch, repeat=args.repeat,
+                               concurrency=args.s3_concurrency)
+
+
+if __name__ == "__main__":
+    main()
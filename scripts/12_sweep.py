@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Параллельный подбор гиперпараметров классификации (ASHA)
+"""
+
+import sys
+import os
+import argparse
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.sweep_utils import prepare_sweep_cache, run_sweep
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hyperparameter search with asynchronous successive halving')
+    parser.add_argument('--data', type=str, default='./data', help='Classification dataset root (train/val)')
+    parser.add_argument('--model', type=str, default='yolov8n-cls.pt', help='Starting weights')
+    parser.add_argument('--trials', type=int, default=18, help='Number of sampled configurations')
+    parser.add_argument('--min-epochs', type=int, default=1, help='Epoch budget of the first rung')
+    parser.add_argument('--max-epochs', type=int, default=9, help='Epoch budget of the last rung')
+    parser.add_argument('--eta', type=int, default=3, help='Keep the top 1/eta at each rung')
+    parser.add_argument('--workers', type=int, default=None, help='Concurrent trials (default: cores / 2)')
+    parser.add_argument('--threads', type=int, default=None, help='Torch threads per trial (default: cores / workers)')
+    parser.add_argument('--device', type=str, default='cpu', help='Training device')
+    parser.add_argument('--project', type=str, default='runs/sweep', help='Output directory')
+    parser.add_argument('--cache-dir', type=str, default='data/sweep_cache', help='Shared preprocessed dataset')
+    parser.add_argument('--max-side', type=int, default=320, help='Long side of cached images')
+    parser.add_argument('--seed', type=int, default=0, help='Sampling seed')
+    args = parser.parse_args()
+
+    print("🔎 ПОДБОР ГИПЕРПАРАМЕТРОВ")
+    print("=" * 50)
+
+    data_path = prepare_sweep_cache(args.data, args.cache_dir, max_side=args.max_side)
+    run_sweep(os.path.abspath(data_path), args.model, n_trials=args.trials, min_epochs=args.min_epochs,
+              max_epochs=args.max_epochs, eta=args.eta, workers=args.workers, threads=args.threads,
+              device=args.device, project=args.project, seed=args.seed)
+    print("💡 Обучение с найденными параметрами: python scripts/02_classify.py --hyp runs/sweep/best_hyp.yaml")
+
+
+if __name__ == "__main__":
+    main()
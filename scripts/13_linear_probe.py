@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Быстрые эксперименты: линейная голова на кэшированных эмбеддингах замороженного backbone
+"""
+
+import sys
+import os
+import argparse
+import time
+import numpy as np
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.embedding_utils import EMBEDDING_CACHE_DIR, embed_images, evaluate_head, export_head, train_linear_head
+from utils.inference_utils import list_labeled_images
+
+
+def print_report(split, report, class_names):
+    print(f"\n📊 {split}: accuracy {report['accuracy']:.3f}")
+    for name in class_names:
+        print(f"   recall {name}: {report['recall'][name]:.3f}")
+    print(f"   матрица ошибок (строки - истина): {report['confusion'].tolist()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Linear probe on cached backbone embeddings')
+    parser.add_argument('--model', type=str, default='runs/classify/train/weights/best.pt', help='Backbone weights')
+    parser.add_argument('--images-dir', type=str, default='data/images', help='Root with <split>/<class>/ folders')
+    parser.add_argument('--cache-dir', type=str, default=EMBEDDING_CACHE_DIR, help='Embedding cache root')
+    parser.add_argument('--batch', type=int, default=32, help='Backbone batch size')
+    parser.add_argument('--class-weight', type=str, default='none', choices=['none', 'balanced'],
+                        help='Class weighting of the logistic regression')
+    parser.add_argument('--sampling', type=str, default='none', choices=['none', 'oversample'],
+                        help='Resampling of the training embeddings')
+    parser.add_argument('--C', type=float, default=1.0, help='Inverse regularization strength')
+    parser.add_argument('--export', type=str, default=None,
+                        help='Write the head into a copy of the model, e.g. runs/classify/probe/best.pt')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Модель не найдена: {args.model}")
+        return
+
+    print("🧪 ЛИНЕЙНАЯ ГОЛОВА НА ЭМБЕДДИНГАХ")
+    print("=" * 50)
+
+    from ultralytics import YOLO
+    names = YOLO(args.model).names
+    class_names = [names[i] for i in sorted(names)]
+
+    splits = {}
+    for split in ('train', 'val', 'test'):
+        paths, labels = list_labeled_images(os.path.join(args.images_dir, split), class_names)
+        if paths:
+            splits[split] = (paths, labels)
+    if 'train' not in splits:
+        print(f"❌ Нет обучающих изображений в {args.images_dir}/train")
+        return
+
+    all_paths = [p for paths, _ in splits.values() for p in paths]
+    features, _ = embed_images(args.model, all_paths, args.cache_dir, batch=args.batch)
+    by_path = dict(zip(all_paths, features))
+
+    start = time.perf_counter()
+    train_paths, train_labels = splits['train']
+    clf = train_linear_head(np.stack([by_path[p] for p in train_paths]), train_labels,
+                            class_weight=None if args.class_weight == 'none' else args.class_weight,
+                            C=args.C, sampling=None if args.sampling == 'none' else args.sampling)
+    print(f"⏱️ Обучение головы: {time.perf_counter() - start:.2f} с")
+
+    for split, (paths, labels) in splits.items():
+        report = evaluate_head(clf, np.stack([by_path[p] for p in paths]), labels, class_names)
+        print_report(split, report, class_names)
+
+    if args.export:
+        export_head(args.model, clf, args.export)
+        print(f"\n💾 Чекпоинт с новой головой: {args.export}")
+
+
+if __name__ == "__main__":
+    main()
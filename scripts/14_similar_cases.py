@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Поиск похожих размеченных случаев в архиве снимков
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.inference_utils import list_images
+from utils.retrieval_utils import RETRIEVAL_DIR, RetrievalIndex, build_archive_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Similar-case retrieval over the labeled archive')
+    parser.add_argument('command', choices=['build', 'query'], help='build/update the index or query it')
+    parser.add_argument('--model', type=str, default='runs/classify/train/weights/best.pt',
+                        help='Embedding model (build; query uses the model the index was built with)')
+    parser.add_argument('--images-dir', type=str, default='data/images', help='Archive root: <split>/<class>/ (build)')
+    parser.add_argument('--index', type=str, default=RETRIEVAL_DIR, help='Index directory')
+    parser.add_argument('--ivf-lists', type=int, default=None,
+                        help='Build the IVF coarse index with this many lists (automatic for large archives)')
+    parser.add_argument('--source', type=str, default=None, help='Query image or directory (query)')
+    parser.add_argument('-k', type=int, default=5, help='Number of similar cases')
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF lists scanned per query')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not os.path.exists(args.model):
+            print(f"❌ Модель не найдена: {args.model}")
+            return
+        build_archive_index(args.model, args.images_dir, args.index, n_lists=args.ivf_lists)
+        return
+
+    if not args.source:
+        print("❌ Укажите --source для поиска")
+        return
+    index = RetrievalIndex(args.index)
+    if not len(index):
+        print(f"❌ Индекс пуст: {args.index} (сначала: 14_similar_cases.py build)")
+        return
+
+    paths = list_images(args.source)
+    start = time.perf_counter()
+    vectors = index.embed(paths)
+    embed_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    scores, rows = index.search_vectors(vectors, args.k + 1, args.nprobe)
+    search_ms = (time.perf_counter() - start) * 1000
+
+    mode = 'IVF' if index.centroids is not None and len(index) >= index.ivf_threshold else 'точный'
+    print(f"🔎 {len(paths)} запросов | архив {len(index)} | поиск {mode}: {search_ms:.1f} мс "
+          f"(эмбеддинги {embed_ms:.0f} мс)")
+    for path, query_scores, query_rows in zip(paths, scores, rows):
+        print(f"\n🖼️ {path}")
+        shown = 0
+        for score, row in zip(query_scores, query_rows):
+            item = index.items[row] if row >= 0 else None
+            if item is None or item['path'] == os.path.abspath(path) or shown == args.k:
+                continue
+            shown += 1
+            print(f"   {score:.3f} {item['label']:<18} {item['path']}")
+
+
+if __name__ == "__main__":
+    main()
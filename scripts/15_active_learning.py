@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Отбор снимков для разметки: ранжирование неразмеченного пула по неопределенности модели
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.active_learning import SCORES, UncertaintyRanker, iter_pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank an unlabeled pool by uncertainty for labeling')
+    parser.add_argument('--models', type=str, nargs='+', default=['runs/classify/train/weights/best.pt'],
+                        help='Checkpoint(s); several enable the disagreement score')
+    parser.add_argument('--source', type=str, default='data/nih/normal_images_list.txt',
+                        help='Unlabeled pool: directory or list file (one path/file name per line)')
+    parser.add_argument('--image-root', type=str, default=None,
+                        help='Directory that relative names in a list file refer to (default: its folder)')
+    parser.add_argument('--top-k', type=int, default=500, help='Size of the labeling queue')
+    parser.add_argument('--score', type=str, default='combined', choices=SCORES, help='Ranking score')
+    parser.add_argument('--batch', type=int, default=32, help='Inference batch size')
+    parser.add_argument('--state-dir', type=str, default='runs/active', help='Resume state directory')
+    parser.add_argument('--queue-dir', type=str, default='data/labeling_queue', help='Labeling queue output')
+    args = parser.parse_args()
+
+    for model_path in args.models:
+        if not os.path.exists(model_path):
+            print(f"❌ Модель не найдена: {model_path}")
+            return
+    if not os.path.exists(args.source):
+        print(f"❌ Пул не найден: {args.source}")
+        return
+
+    print("🏷️ ОТБОР СНИМКОВ ДЛЯ РАЗМЕТКИ")
+    print("=" * 50)
+    ranker = UncertaintyRanker(args.models, top_k=args.top_k, score=args.score, state_dir=args.state_dir)
+    print(f"📦 Моделей: {len(args.models)} | оценка: {args.score} | top-K: {args.top_k}")
+
+    start = time.perf_counter()
+    scored, skipped = ranker.run(iter_pool(args.source, args.image_root), batch=args.batch)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Оценено {scored} (пропущено уже оцененных: {skipped}) за {elapsed:.1f} с"
+          + (f" | {scored / elapsed:.1f} изобр/с" if scored else ""))
+
+    ranked = ranker.write_queue(args.queue_dir)
+    print(f"\n🔝 Самые неопределенные ({len(ranked)} в очереди):")
+    for score, path, predicted, *_ in ranked[:10]:
+        print(f"   {score:.3f} {predicted:<18} {path}")
+    print(f"📁 Очередь разметки: {args.queue_dir}/<класс>/ + ranking.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Экспорт весов только для инференса (.safetensors, отображается в память при загрузке)
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export inference-only, memory-mappable weights')
+    parser.add_argument('--model', type=str, default='runs/classify/train/weights/best.pt', help='Checkpoint (.pt)')
+    parser.add_argument('--output', type=str, default=None, help='Output file (default: next to --model, .safetensors)')
+    parser.add_argument('--verify', type=str, default='data/images/test',
+                        help='Compare predictions of both formats on these images ("" to skip)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Модель не найдена: {args.model}")
+        return
+
+    import numpy as np
+    from utils.inference_utils import list_images, predict_paths
+    from utils.weights_utils import WEIGHTS_SUFFIX, export_inference_weights, load_model
+
+    print("📦 ЭКСПОРТ ВЕСОВ ДЛЯ ИНФЕРЕНСА")
+    print("=" * 50)
+    output = export_inference_weights(args.model, args.output)
+    print(f"💾 {args.model}: {os.path.getsize(args.model) / 1e6:.2f} MB → "
+          f"{output}: {os.path.getsize(output) / 1e6:.2f} MB (FP32, Conv+BN слиты, без состояния обучения)")
+
+    if not args.verify or not os.path.exists(args.verify):
+        return
+    paths = list_images(args.verify)[:64]
+    if not paths:
+        return
+    start = time.perf_counter()
+    original = load_model(args.model)
+    pt_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    mapped = load_model(output)
+    mapped_ms = (time.perf_counter() - start) * 1000
+
+    a, b = predict_paths(original, paths), predict_paths(mapped, paths)
+    # Классификация: top-1 и вероятности; детекция: классы найденных боксов
+    same = sum(x.get('top1', [box[0] for box in x.get('boxes', [])]) ==
+               y.get('top1', [box[0] for box in y.get('boxes', [])]) for x, y in zip(a, b))
+    print(f"⏱️ Загрузка (после импортов): .pt {pt_ms:.0f} мс | {WEIGHTS_SUFFIX} {mapped_ms:.0f} мс")
+    mark = '✅' if same == len(paths) else '❌'
+    print(f"{mark} Совпадение предсказаний: {same}/{len(paths)}")
+    if 'probs' in a[0]:
+        max_diff = max(float(np.abs(np.array(x['probs']) - np.array(y['probs'])).max()) for x, y in zip(a, b))
+        print(f"   макс. расхождение вероятностей: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
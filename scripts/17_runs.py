@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Реестр запусков обучения: лучшие и самые быстрые модели, история, импорт старых запусков
+"""
+
+import sys
+import os
+import argparse
+import time
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+def print_runs(metric, runs):
+    short = metric.split('/')[-1]
+    print(f"{'ID':>5} | {short[:14]:>14} | {'Эпоха':>5} | {'Задержка, мс':>12} | {'Обучение, мин':>13} | "
+          f"{'Датасет':<16} | {'Завершен':<16} | Запуск")
+    print("-" * 130)
+    for run in runs:
+        latency = f"{run['latency_ms']:.2f}" if run['latency_ms'] is not None else '-'
+        minutes = f"{run['train_seconds'] / 60:.1f}" if run['train_seconds'] is not None else '-'
+        finished = time.strftime('%Y-%m-%d %H:%M', time.localtime(run['finished']))
+        print(f"{run['id']:>5} | {run['value']:>14.4f} | {run['best_epoch']:>5} | {latency:>12} | {minutes:>13} | "
+              f"{(run['dataset_fingerprint'] or '-'):<16} | {finished:<16} | {os.path.relpath(run['run_dir'])}")
+
+
+def print_run(run, registry):
+    print(f"🗂️ Запуск #{run['id']}: {os.path.relpath(run['run_dir'])}")
+    print(f"   Задача: {run['task']} | модель: {run['model']} | устройство: {run['device']} | "
+          f"imgsz: {run['imgsz']} | batch: {run['batch']}")
+    print(f"   Данные: {run['data']} (отпечаток {run['dataset_fingerprint'] or '-'})")
+    print(f"   Чекпоинт: {registry.checkpoint_path(run) or 'перезаписан, копии нет'} (хэш {run['checkpoint_hash']})")
+    minutes = f"{run['train_seconds'] / 60:.1f} мин" if run['train_seconds'] is not None else '-'
+    latency = f"{run['latency_ms']:.2f} мс/изобр." if run['latency_ms'] is not None else '-'
+    print(f"   Эпох: {run['epochs']} | обучение: {minutes} | задержка на валидации: {latency}")
+    print(f"   {'Метрика':<28} | {'Итог':>10} | {'Лучшее':>10} | {'Эпоха':>5}")
+    for name, (final, best, epoch) in run['metrics'].items():
+        print(f"   {name:<28} | {final:>10.4f} | {best:>10.4f} | {epoch:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the registry of finished training runs')
+    parser.add_argument('command', choices=['best', 'fastest', 'list', 'show', 'import'],
+                        help='best: top runs by a metric; fastest: lowest latency above --min; list: newest runs; '
+                             'show: one run; import: register existing run folders')
+    parser.add_argument('run_id', type=int, nargs='?', help='Run id (show)')
+    parser.add_argument('--metric', type=str, default=None,
+                        help='results.csv metric, short names work (default: accuracy_top1 / mAP50-95 by task)')
+    parser.add_argument('--min', type=float, default=None, dest='minimum',
+                        help='Keep runs whose best metric is at least this (at most, for losses)')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='Data folder / YAML (matched by content fingerprint), fingerprint prefix or data argument')
+    parser.add_argument('--task', type=str, default=None, choices=['classify', 'detect'], help='Only runs of this task')
+    parser.add_argument('--limit', type=int, default=10, help='Rows to show')
+    parser.add_argument('--root', type=str, default='runs', help='Folder searched for run folders (import)')
+    parser.add_argument('--archive', action='store_true', help='Also copy imported checkpoints into the registry')
+    parser.add_argument('--registry', type=str, default='runs/registry/runs.db', help='Registry database')
+    args = parser.parse_args()
+
+    from utils.run_registry import RunRegistry
+
+    registry = RunRegistry(args.registry)
+    if args.command == 'import':
+        start = time.perf_counter()
+        count = registry.import_runs(args.root, archive=args.archive)
+        print(f"🗂️ Зарегистрировано новых или измененных запусков: {count} за {time.perf_counter() - start:.1f} с ({args.registry})")
+        return
+    if registry.count() == 0:
+        print(f"❌ Реестр пуст: {args.registry}")
+        print(f"💡 Запуски регистрируются после обучения; старые: python scripts/17_runs.py import --root {args.root}")
+        return
+
+    if args.command == 'show':
+        run = registry.get(args.run_id) if args.run_id is not None else None
+        if run is None:
+            print(f"❌ Запуск не найден: {args.run_id}")
+            return
+        print_run(run, registry)
+        return
+
+    order = {'best': 'metric', 'fastest': 'latency', 'list': 'recent'}[args.command]
+    start = time.perf_counter()
+    try:
+        metric, runs = registry.query(args.metric, dataset=args.dataset, task=args.task, minimum=args.minimum,
+                                      order=order, limit=args.limit)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not runs:
+        print("❌ Подходящих запусков нет")
+        return
+    print_runs(metric, runs)
+    print(f"\n🔎 Запрос: {elapsed_ms:.1f} мс | всего запусков в реестре: {registry.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Единая точка входа `cxr`: analyze / train / evaluate / predict / bench / export / runs
+
+Модуль подкоманды импортируется только после выбора команды, а сами
+скрипты грузят torch/ultralytics после разбора своих аргументов -
+`cxr --help` и `cxr <команда> --help` отвечают без тяжелых библиотек.
+"""
+
+import sys
+import os
+import argparse
+import importlib
+
+# Добавляем пути
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+# команда -> (модуль в scripts/, описание)
+COMMANDS = {
+    'analyze': ('01_analyze_classification', 'Dataset structure, class balance and quality report'),
+    'train': ('02_classify', 'Train the classifier (also k-fold CV and incremental updates)'),
+    'analyze-detect': ('01_analyze_data', 'Detection dataset analysis and data config'),
+    'train-detect': ('02_train_model', 'Train the YOLOv8 clavicle detector'),
+    'evaluate': ('03_evaluate_model', 'Evaluate a trained model'),
+    'predict': ('04_predict', 'Predict on an image or a directory'),
+    'bench': ('11_benchmark', 'Inference and startup-time benchmarks'),
+    'export': ('16_export_weights', 'Export inference-only memory-mappable weights (.safetensors)'),
+    'runs': ('17_runs', 'Query the training run registry (best / fastest / list / show / import)'),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cxr', description='Chest X-ray classification toolkit')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for name, (_, help_text) in COMMANDS.items():
+        # Аргументы команды (включая --help) разбирает сам скрипт
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    module = importlib.import_module(f'scripts.{COMMANDS[args.command][0]}')
+    sys.argv = [f'cxr {args.command}', *rest]
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -46,12 +46,19 @@ setup(
     package_dir={"": "."},
     python_requires=">=3.8",
     install_requires=requirements,
+    extras_require={
+        # Необязательные источники и форматы: pip install -e ".[s3,dicom,parquet]"
+        "s3": ["aiobotocore"],
+        "dicom": ["pydicom"],
+        "parquet": ["pyarrow"],
+        # Локальный S3 для бенчмарка и тестов
+        "dev": ["pytest", "moto[server]", "boto3"],
+    },
     entry_points={
+        # Модули scripts/NN_*.py нельзя указать напрямую (имя начинается с цифры) -
+        # единая команда cxr импортирует нужный скрипт по подкоманде
         'console_scripts': [
-            'cxr-analyze=scripts.01_analyze_data:main',
-            'cxr-train=scripts.02_train_model:main',
-            'cxr-evaluate=scripts.03_evaluate_model:main',
-            'cxr-predict=scripts.04_predict:main',
+            'cxr=scripts.cli:main',
         ],
     },
     include_package_data=True,
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# Тесты импортируют utils.* из корня проекта
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    """Checkpoint shaped like an ultralytics best.pt (yaml model, no download needed)"""
+    import torch
+    from ultralytics.nn.tasks import ClassificationModel
+
+    torch.manual_seed(0)
+    model = ClassificationModel('yolov8n-cls.yaml', nc=3, verbose=False)
+    model.names = {0: 'normal', 1: 'foreign_body', 2: 'other'}
+    path = tmp_path / 'best.pt'
+    torch.save({'model': model, 'train_args': {'imgsz': [64, 48], 'task': 'classify', 'data': 'data'}}, path)
+    return str(path)
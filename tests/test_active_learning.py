@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+from utils.active_learning import UncertaintyRanker
+
+
+def make_pool(root, count):
+    paths = []
+    for i in range(count):
+        path = root / f'{i:03d}.png'
+        cv2.imwrite(str(path), np.full((40, 40, 3), i * 30, dtype=np.uint8))
+        paths.append(str(path))
+    return paths
+
+
+def test_resume_skips_scored_images(tmp_path, checkpoint):
+    paths = make_pool(tmp_path, 5)
+    state_dir = str(tmp_path / 'state')
+    ranker = UncertaintyRanker([checkpoint], top_k=3, state_dir=state_dir)
+    assert ranker.run(iter(paths), batch=2) == (5, 0)
+    assert len(ranker.ranked()) == 3
+
+    resumed = UncertaintyRanker([checkpoint], top_k=3, state_dir=state_dir)
+    assert resumed.heap == ranker.heap
+    assert resumed.run(iter(paths), batch=2) == (0, 5)
+
+
+def test_unreadable_image_is_retried(tmp_path, checkpoint):
+    paths = make_pool(tmp_path, 3)
+    # Файл еще копируется - cv2 его не читает
+    partial = tmp_path / 'partial.png'
+    partial.write_bytes(b'\x89PNG')
+    pool = paths + [str(partial)]
+    state_dir = str(tmp_path / 'state')
+    assert UncertaintyRanker([checkpoint], state_dir=state_dir).run(iter(pool), batch=4) == (3, 0)
+
+    cv2.imwrite(str(partial), np.zeros((40, 40, 3), dtype=np.uint8))
+    ranker = UncertaintyRanker([checkpoint], state_dir=state_dir)
+    assert ranker.run(iter(pool), batch=4) == (1, 3)
+    assert str(partial) in [item[1] for item in ranker.ranked()]
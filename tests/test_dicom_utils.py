@@ -0,0 +1,41 @@
+import importlib
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('pydicom')
+
+from utils.dicom_utils import convert_dicom, convert_dicoms, iter_converted
+
+write_synthetic_dicoms = importlib.import_module('scripts.11_benchmark').write_synthetic_dicoms
+
+
+@pytest.fixture
+def studies(tmp_path):
+    image = str(tmp_path / 'image.png')
+    cv2.imwrite(image, np.tile(np.arange(64, dtype=np.uint8), (48, 1)))
+    good = write_synthetic_dicoms([image], str(tmp_path / 'dicom'), 2, size=(96, 80))
+    corrupt = tmp_path / 'dicom' / 'corrupt.dcm'
+    corrupt.write_bytes(b'DICM' + b'\0' * 200)
+    return [good[0], str(corrupt), good[1]]
+
+
+def test_convert_dicom_returns_error_instead_of_raising(tmp_path, studies):
+    dst, computed, source_hash, error = convert_dicom((studies[1], 32, str(tmp_path / 'cache')))
+    assert (dst, computed, source_hash) == (None, False, None)
+    assert error
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_corrupt_study_is_skipped(tmp_path, studies, workers):
+    failed = []
+    converted = list(iter_converted(studies, 32, str(tmp_path / 'cache'), workers, failed))
+    assert [source for source, *_ in converted] == [studies[0], studies[2]]
+    assert [path for path, _ in failed] == [studies[1]]
+    for _, dst, computed, _ in converted:
+        assert computed and min(cv2.imread(dst).shape[:2]) == 32
+
+    # Повтор берется из кэша
+    again = convert_dicoms(studies, 32, str(tmp_path / 'cache'), workers)
+    assert again == {source: dst for source, dst, _, _ in converted}
@@ -0,0 +1,87 @@
+import multiprocessing as mp
+import os
+
+import cv2
+import numpy as np
+import torch
+from ultralytics.utils import torch_utils
+
+import utils.inference_utils as inference_utils
+from utils.inference_utils import (FolderWatcher, ProcessedCheckpoint, _init_worker, predict_paths, predict_sharded,
+                                   split_shards)
+
+
+def _threads_after_predict(paths):
+    predict_paths(inference_utils._worker_model, paths)
+    return torch.get_num_threads()
+
+
+def make_images(root, count):
+    paths = []
+    for i in range(count):
+        path = str(root / f'{i:03d}.png')
+        cv2.imwrite(path, np.full((80, 96, 3), i * 10 % 255, dtype=np.uint8))
+        paths.append(path)
+    return paths
+
+
+def test_split_shards():
+    assert split_shards(list(range(7)), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert split_shards([1, 2], 5) == [[1], [2]]
+
+
+def test_worker_thread_cap_survives_predict(tmp_path, checkpoint):
+    # Заведомо не то значение, которое select_device ultralytics выставляет на CPU
+    threads = torch_utils.NUM_THREADS + 1
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(1, initializer=_init_worker, initargs=(checkpoint, threads, None, None)) as pool:
+        assert pool.apply(_threads_after_predict, (make_images(tmp_path, 2),)) == threads
+
+
+def test_sharded_prediction_keeps_order(tmp_path, checkpoint):
+    paths = make_images(tmp_path, 6)
+    ready = []
+    records = predict_sharded(checkpoint, paths, 2, threads=1, shards_per_worker=2, batch=2,
+                              on_ready=lambda: ready.append(True))
+    assert ready == [True]
+    assert [record['path'] for record in records] == paths
+
+
+def _poll_twice(watcher):
+    # Первый опрос замечает файл, второй (settle=0) отдает его
+    watcher.poll()
+    return [path for path, _ in watcher.poll()]
+
+
+def test_watcher_picks_up_files_rewritten_in_place(tmp_path):
+    source = tmp_path / 'incoming'
+    source.mkdir()
+    image = source / 'a.png'
+    image.write_bytes(b'first version')
+    checkpoint = ProcessedCheckpoint(str(tmp_path / 'processed.txt'))
+    watcher = FolderWatcher(str(source), checkpoint, settle=0, rescan=0)
+
+    ready = watcher.poll() + watcher.poll()
+    assert [path for path, _ in ready] == [str(image)]
+    checkpoint.add([key for _, key in ready])
+    assert _poll_twice(watcher) == []
+
+    # Перезапись на месте не меняет mtime папки: без полного обхода файл не виден
+    directory_mtime = os.stat(source).st_mtime_ns
+    image.write_bytes(b'second, longer version')
+    assert os.stat(source).st_mtime_ns == directory_mtime
+    watcher.rescan = None
+    assert _poll_twice(watcher) == []
+    watcher.rescan = 0
+    assert _poll_twice(watcher) == [str(image)]
+
+def test_failed_file_is_retried_after_delay(tmp_path):
+    source = tmp_path / 'incoming'
+    source.mkdir()
+    (source / 'broken.png').write_bytes(b'not an image')
+    watcher = FolderWatcher(str(source), ProcessedCheckpoint(str(tmp_path / 'processed.txt')), settle=0,
+                            retry_delay=3600)
+    assert _poll_twice(watcher) == [str(source / 'broken.png')]
+    watcher.retry([], [str(source / 'broken.png')])
+    assert watcher.failures == {str(source / 'broken.png'): 1}
+    assert _poll_twice(watcher) == []
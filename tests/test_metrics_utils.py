@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from utils.metrics_utils import (EXPORT_EDGES_US, MAX_VALUE_US, SUB_COUNT, LogHistogram, PredictionMetrics,
+                                 bucket_bounds, bucket_index)
+
+
+def sample_values():
+    rng = random.Random(0)
+    values = list(range(0, 4096))
+    values += [rng.randrange(1 << k, 1 << (k + 1)) for k in range(12, 32) for _ in range(200)]
+    values += [(1 << k) - 1 for k in range(1, 33)] + [1 << k for k in range(33)] + [MAX_VALUE_US]
+    return values
+
+
+def test_value_lies_in_its_bucket():
+    for value in sample_values():
+        low, high = bucket_bounds(bucket_index(value))
+        assert low <= value < high
+
+
+def test_bucket_width_is_bounded():
+    for index in range(bucket_index(MAX_VALUE_US) + 1):
+        low, high = bucket_bounds(index)
+        assert high - low == 1 or (high - low) / low <= 1 / SUB_COUNT
+
+
+def test_buckets_are_contiguous():
+    previous_high = 0
+    for index in range(bucket_index(MAX_VALUE_US) + 1):
+        low, high = bucket_bounds(index)
+        assert low == previous_high
+        previous_high = high
+
+
+def test_export_edges_are_bucket_boundaries():
+    assert EXPORT_EDGES_US == sorted(set(EXPORT_EDGES_US))
+    for edge in EXPORT_EDGES_US:
+        assert bucket_bounds(bucket_index(edge))[0] == edge
+
+
+def test_cumulative_matches_exact_counts():
+    rng = random.Random(1)
+    values = [int(rng.lognormvariate(9, 2)) for _ in range(5000)]
+    histogram = LogHistogram()
+    for value in values:
+        histogram.record(value)
+    clipped = [min(value, MAX_VALUE_US) for value in values]
+    expected = [sum(value < edge for value in clipped) for edge in EXPORT_EDGES_US]
+    assert histogram.cumulative(EXPORT_EDGES_US) == expected
+
+
+def test_percentile_is_upper_edge_within_bucket_error():
+    histogram = LogHistogram()
+    for value in range(1, 10001):
+        histogram.record(value)
+    p50 = histogram.percentile(50)
+    assert 5000 <= p50 <= 5000 * (1 + 1 / SUB_COUNT)
+    assert histogram.percentile(100) == 10000
+
+
+def _record(stage_ms, top1=0):
+    return {'stage_ms': stage_ms, 'top1': top1, 'names': {0: 'normal', 1: 'foreign_body'}}
+
+
+def test_render_openmetrics():
+    metrics = PredictionMetrics(labels={'job': 'night"ly'})
+    metrics.observe([_record({'forward': 2.0, 'end_to_end': 5.0}), _record({'forward': 30.0, 'end_to_end': 50.0}, 1)])
+    metrics.count_errors('decode', 2)
+    text = metrics.render()
+    lines = text.splitlines()
+
+    assert lines[-1] == '# EOF'
+    assert 'cxr_predict_images_total{job="night\\"ly"} 2' in lines
+    assert 'cxr_predict_errors_total{job="night\\"ly",reason="decode"} 2' in lines
+    assert 'cxr_predict_predictions_total{job="night\\"ly",class="foreign_body"} 1' in lines
+
+    buckets = [line for line in lines
+               if line.startswith('cxr_predict_latency_seconds_bucket') and 'stage="forward"' in line]
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert len(buckets) == len(EXPORT_EDGES_US) + 1
+    assert counts == sorted(counts)
+    assert buckets[-1].split('{', 1)[1].startswith('job="night\\"ly",stage="forward",le="+Inf"')
+    assert counts[-1] == 2
+    # 2 мс попадает в корзину le=0.002048, 30 мс - только в le=0.032768
+    assert 'le="0.002048"} 1' in ' '.join(buckets)
+    assert 'le="0.032768"} 2' in ' '.join(buckets)
+    # Этапы без замеров не выводятся
+    assert 'stage="decode"' not in text
+
+
+def test_render_parses_with_prometheus_client():
+    parser = pytest.importorskip('prometheus_client.openmetrics.parser')
+    metrics = PredictionMetrics()
+    metrics.observe([_record({'forward': 1.5, 'end_to_end': 4.0})])
+    families = {family.name: family for family in parser.text_string_to_metric_families(metrics.render())}
+    assert families['cxr_predict_latency_seconds'].type == 'histogram'
+
+
+def test_export_writes_file_atomically(tmp_path):
+    path = tmp_path / 'textfile' / 'predict.prom'
+    metrics = PredictionMetrics(str(path), interval=3600)
+    metrics.observe([_record({'end_to_end': 1.0})])
+    assert not path.exists()  # интервал еще не прошел
+    metrics.close()
+    assert path.read_text(encoding='utf-8') == metrics.render()
+    assert [p.name for p in path.parent.iterdir()] == ['predict.prom']
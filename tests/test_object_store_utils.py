@@ -0,0 +1,59 @@
+import threading
+from itertools import islice
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('aiobotocore')
+pytest.importorskip('moto.server')
+
+from utils.object_store_utils import ObjectStoreSource, parse_object_uri, upload_directory
+
+
+@pytest.fixture
+def s3_uri(tmp_path, monkeypatch):
+    from moto.server import ThreadedMotoServer
+
+    for key, value in (('AWS_ACCESS_KEY_ID', 'test'), ('AWS_SECRET_ACCESS_KEY', 'test'),
+                       ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(key, value)
+    for i in range(6):
+        cv2.imwrite(str(tmp_path / f'{i}.png'), np.full((16, 16, 3), i * 40, dtype=np.uint8))
+    (tmp_path / 'notes.txt').write_text('not an image')
+    server = ThreadedMotoServer(port=5056, verbose=False)
+    server.start()
+    endpoint_url = 'http://127.0.0.1:5056'
+    try:
+        assert upload_directory(str(tmp_path), 's3://test-bucket/images', endpoint_url=endpoint_url, repeat=2) == 12
+        yield 's3://test-bucket/images', endpoint_url
+    finally:
+        server.stop()
+
+
+def test_parse_object_uri():
+    assert parse_object_uri('s3://bucket/a/b') == ('bucket', 'a/b')
+    assert parse_object_uri('s3://bucket') == ('bucket', '')
+
+
+def test_batch_larger_than_prefetch_does_not_hang(s3_uri):
+    uri, endpoint_url = s3_uri
+    consumed = []
+
+    def consume():
+        # Как iter_predictions: берет полный батч, и только после предсказания освобождает слоты
+        with ObjectStoreSource(uri, concurrency=2, prefetch=2, endpoint_url=endpoint_url, batch=5) as source:
+            iterator = iter(source)
+            while True:
+                chunk = list(islice(iterator, 5))
+                if not chunk:
+                    break
+                assert all(source.load(key) is not None for key in chunk)
+                source.finish([{'path': key} for key in chunk])
+                consumed.extend(chunk)
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive(), 'источник ждет свободный слот, а модель - полный батч'
+    assert len(consumed) == len(set(consumed)) == 12
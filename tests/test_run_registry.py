@@ -0,0 +1,133 @@
+import os
+import shutil
+
+import pytest
+
+from utils.run_registry import RunRegistry, summarize_results
+
+
+def make_run(root, name, accuracy, loss, data, task='classify', checkpoint=None, mtime=None):
+    """Run folder like ultralytics writes it: args.yaml, results.csv (3 epochs), weights/best.pt"""
+    run_dir = root / name
+    (run_dir / 'weights').mkdir(parents=True)
+    (run_dir / 'args.yaml').write_text(f'task: {task}\nmodel: yolov8n-cls.pt\ndata: {data}\nimgsz: 224\nbatch: 16\n')
+    rows = ['epoch,time,train/loss,metrics/accuracy_top1,val/loss,lr/pg0']
+    for epoch, factor in enumerate((0.8, 1.0, 0.9), 1):
+        rows.append(f'{epoch},{epoch * 60.0},{loss / factor},{accuracy * factor},{loss / factor},0.01')
+    (run_dir / 'results.csv').write_text('\n'.join(rows) + '\n')
+    best = run_dir / 'weights' / 'best.pt'
+    best.write_bytes(checkpoint or name.encode())
+    if mtime is not None:
+        os.utime(best, (mtime, mtime))
+    return run_dir
+
+
+def make_dataset(path, images=('a.png', 'b.png')):
+    for split in ('train', 'val'):
+        (path / split / 'normal').mkdir(parents=True)
+        for image in images:
+            (path / split / 'normal' / image).write_bytes(f'{split}/{image}'.encode())
+    return path
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return RunRegistry(str(tmp_path / 'registry' / 'runs.db'))
+
+
+def test_summarize_results_picks_best_epoch():
+    rows = [{'epoch': 1, 'metrics/accuracy_top1': 0.5, 'val/loss': 1.0, 'lr/pg0': 0.1},
+            {'epoch': 2, 'metrics/accuracy_top1': 0.7, 'val/loss': 0.4, 'lr/pg0': 0.1},
+            {'epoch': 3, 'metrics/accuracy_top1': 0.6, 'val/loss': 0.5, 'lr/pg0': 0.1}]
+    assert summarize_results(rows) == {'metrics/accuracy_top1': (0.6, 0.7, 2), 'val/loss': (0.5, 0.4, 2)}
+
+
+def test_query_orders_and_filters(tmp_path, registry):
+    data = str(make_dataset(tmp_path / 'data'))
+    speeds = {'slow': 9.0, 'fast': 1.0, 'mid': 4.0}
+    for name, accuracy, mtime in (('slow', 0.9, 1000), ('fast', 0.7, 3000), ('mid', 0.8, 2000)):
+        run_dir = make_run(tmp_path / 'runs', name, accuracy, loss=1 - accuracy, data=data, mtime=mtime)
+        assert registry.register(str(run_dir), speed={'inference': speeds[name]}) is not None
+    assert registry.count() == 3
+
+    metric, runs = registry.query(task='classify')
+    assert metric == 'metrics/accuracy_top1'
+    assert [os.path.basename(run['run_dir']) for run in runs] == ['slow', 'mid', 'fast']
+    assert runs[0]['value'] == pytest.approx(0.9) and runs[0]['best_epoch'] == 2
+
+    _, runs = registry.query('accuracy_top1', minimum=0.75, order='latency')
+    assert [os.path.basename(run['run_dir']) for run in runs] == ['mid', 'slow']
+    assert runs[0]['latency_ms'] == pytest.approx(4.0)
+
+    _, runs = registry.query(order='recent', limit=2)
+    assert [os.path.basename(run['run_dir']) for run in runs] == ['fast', 'mid']
+
+    # Для потерь лучше меньшее значение, а --min означает "не больше"
+    metric, runs = registry.query('val/loss', minimum=0.25)
+    assert metric == 'val/loss'
+    assert [round(run['value'], 2) for run in runs] == [0.1, 0.2]
+
+
+def test_query_by_dataset_content(tmp_path, registry):
+    data = make_dataset(tmp_path / 'data')
+    other = make_dataset(tmp_path / 'other', images=('c.png',))
+    make_run(tmp_path / 'runs', 'on_data', 0.8, 0.2, data=str(data))
+    make_run(tmp_path / 'runs', 'on_other', 0.9, 0.1, data=str(other))
+    assert registry.import_runs(str(tmp_path / 'runs')) == 2
+
+    # Копия тех же данных в другом месте находит запуски по отпечатку содержимого
+    copy = shutil.copytree(data, tmp_path / 'copy')
+    _, runs = registry.query(dataset=str(copy))
+    assert [os.path.basename(run['run_dir']) for run in runs] == ['on_data']
+
+    fingerprint = runs[0]['dataset_fingerprint']
+    _, runs = registry.query(dataset=fingerprint[:6])
+    assert [os.path.basename(run['run_dir']) for run in runs] == ['on_data']
+
+    # Измененный файл меняет отпечаток, хотя пути те же
+    (copy / 'train' / 'normal' / 'a.png').write_bytes(b'changed')
+    assert registry.dataset_fingerprint(str(copy)) != fingerprint
+
+
+def test_resolve_metric(tmp_path, registry):
+    make_run(tmp_path / 'runs', 'run', 0.8, 0.2, data='missing')
+    registry.import_runs(str(tmp_path / 'runs'))
+    assert registry.resolve_metric('accuracy_top1') == 'metrics/accuracy_top1'
+    with pytest.raises(ValueError, match='неоднозначна'):
+        registry.resolve_metric('loss')
+    with pytest.raises(ValueError, match='не найдена'):
+        registry.resolve_metric('mAP50-95')
+
+
+def test_register_is_keyed_by_checkpoint_hash(tmp_path, registry):
+    run_dir = make_run(tmp_path / 'runs', 'run', 0.8, 0.2, data='missing')
+    run_id = registry.register(str(run_dir), speed={'inference': 2.0})
+    # Повторная регистрация без замера скорости не стирает задержку
+    assert registry.register(str(run_dir)) == run_id
+    run = registry.get(run_id)
+    assert run['latency_ms'] == pytest.approx(2.0)
+    assert run['metrics']['metrics/accuracy_top1'] == pytest.approx((0.72, 0.8, 2))
+    assert run['epochs'] == 3 and run['train_seconds'] == pytest.approx(180.0)
+
+    # Перезапись папки новым обучением - новая строка, старый чекпоинт доступен из архива
+    (run_dir / 'weights' / 'best.pt').write_bytes(b'retrained')
+    new_id = registry.register(str(run_dir))
+    assert new_id != run_id and registry.count() == 2
+    assert registry.checkpoint_path(registry.get(run_id)) == run['archived']
+    assert registry.checkpoint_path(registry.get(new_id)) == str(run_dir / 'weights' / 'best.pt')
+    assert registry.get(12345) is None
+
+
+def test_import_runs_skips_registered(tmp_path, registry):
+    runs = tmp_path / 'runs'
+    make_run(runs / 'classify', 'a', 0.8, 0.2, data='missing', mtime=1000)
+    make_run(runs / 'classify', 'b', 0.7, 0.3, data='missing', mtime=1000)
+    (runs / 'classify' / 'incomplete').mkdir()
+    assert registry.import_runs(str(runs)) == 2
+    assert registry.import_runs(str(runs)) == 0
+
+    make_run(runs / 'detect', 'c', 0.6, 0.4, data='missing', task='detect')
+    os.utime(runs / 'classify' / 'a' / 'weights' / 'best.pt', (2000, 2000))
+    assert registry.import_runs(str(runs)) == 2
+    assert registry.count() == 3
+    assert registry.checkpoints(task='detect') == [str(runs / 'detect' / 'c' / 'weights' / 'best.pt')]
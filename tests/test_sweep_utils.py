@@ -0,0 +1,42 @@
+import pytest
+import torch
+import ultralytics.utils
+from ultralytics.utils import torch_utils
+
+from utils.sweep_utils import AshaScheduler, rung_epochs, set_worker_threads
+
+
+@pytest.fixture
+def restore_threads(monkeypatch):
+    monkeypatch.setattr(ultralytics.utils, 'NUM_THREADS', ultralytics.utils.NUM_THREADS)
+    monkeypatch.setattr(torch_utils, 'NUM_THREADS', torch_utils.NUM_THREADS)
+    threads = torch.get_num_threads()
+    yield torch_utils.NUM_THREADS + 1  # заведомо не то значение, которое выставит ultralytics
+    torch.set_num_threads(threads)
+
+
+def test_worker_threads_survive_select_device(restore_threads):
+    set_worker_threads(restore_threads)
+    # Обучение и предсказание на CPU вызывают select_device, который сбрасывает число потоков torch
+    torch_utils.select_device('cpu', verbose=False)
+    assert torch.get_num_threads() == restore_threads
+
+
+def test_rung_epochs():
+    assert rung_epochs(1, 9, 3) == [1, 3, 9]
+    assert rung_epochs(1, 10, 3) == [1, 3, 9, 10]
+
+
+def test_failed_trial_is_never_promoted():
+    scheduler = AshaScheduler(n_trials=3, rungs=[1, 3], eta=3)
+    assert [scheduler.next_job() for _ in range(3)] == [(0, 0), (1, 0), (2, 0)]
+    scheduler.report(0, 0, 0.9, failed=True)
+    scheduler.report(1, 0, 0.5)
+    scheduler.report(2, 0, 0.4)
+    assert scheduler.next_job() is None
+
+    scheduler = AshaScheduler(n_trials=3, rungs=[1, 3], eta=3)
+    for trial in range(3):
+        scheduler.next_job()
+        scheduler.report(trial, 0, 0.5 + trial / 10)
+    assert scheduler.next_job() == (2, 1)
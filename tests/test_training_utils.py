@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import torch
+from ultralytics.nn.tasks import ClassificationModel, DetectionModel
+
+from utils.training_utils import _tensors, auto_configure, load_training_config, pick_config, probe_train_step
+
+
+def test_tensors_flattens_nested_outputs():
+    a, b, c = torch.zeros(1), torch.ones(2), torch.ones(3)
+    assert _tensors({'boxes': a, 'scores': b, 'feats': [c]}) == [a, b, c]
+    assert _tensors((a, [b, None])) == [a, b]
+    assert _tensors(3) == []
+
+
+def test_probe_train_step_detection():
+    # В ultralytics 8.4 детектор в режиме train возвращает dict, а не список тензоров
+    model = DetectionModel('yolov8n.yaml', verbose=False)
+    step = probe_train_step(model, imgsz=64, batch=2, device='cpu', steps=1)
+    assert step['images_per_sec'] > 0
+    assert step['peak_rss_gb'] > 0
+
+
+def test_probe_train_step_classification():
+    model = ClassificationModel('yolov8n-cls.yaml', nc=2, verbose=False)
+    step = probe_train_step(model, imgsz=64, batch=2, device='cpu', steps=1)
+    assert step['images_per_sec'] > 0
+
+
+def test_pick_config_prefers_larger_imgsz_within_tolerance():
+    results = [{'imgsz': 160, 'throughput': 100.0}, {'imgsz': 224, 'throughput': 85.0},
+               {'imgsz': 320, 'throughput': 50.0}]
+    assert pick_config(results, imgsz_tolerance=0.2)['imgsz'] == 224
+    assert pick_config(results, imgsz_tolerance=0.0)['imgsz'] == 160
+    assert pick_config(results, imgsz_tolerance=0.6)['imgsz'] == 320
+
+
+def test_auto_configure_probes_every_imgsz(tmp_path):
+    for class_name in ('normal', 'foreign_body'):
+        class_dir = tmp_path / 'data' / 'train' / class_name
+        class_dir.mkdir(parents=True)
+        for i in range(4):
+            cv2.imwrite(str(class_dir / f'{i}.png'), np.full((48, 48, 3), i * 50, dtype=np.uint8))
+    output = tmp_path / 'auto_config.yaml'
+    config = auto_configure(str(tmp_path / 'data'), 'yolov8n-cls.yaml', str(output), imgsz_candidates=(32, 64),
+                            batch_candidates=(2,), worker_candidates=(0,))
+    assert config['probe']['imgsz_tested'] == [32, 64]
+    assert config['imgsz'] in (32, 64) and config['batch'] == 2 and config['workers'] == 0
+    assert load_training_config(str(output)) == {key: config[key] for key in ('device', 'imgsz', 'batch', 'workers')}
@@ -0,0 +1,91 @@
+import gc
+import json
+import struct
+
+import pytest
+import torch
+from ultralytics.nn.tasks import load_checkpoint
+
+from utils.weights_utils import (build_mapped_model, export_inference_weights, load_model, model_imgsz, read_tensors,
+                                 write_tensors)
+
+
+def test_tensors_round_trip(tmp_path):
+    path = tmp_path / 'tensors.safetensors'
+    tensors = {'weight': torch.randn(3, 5), 'half': torch.randn(7).half(), 'steps': torch.arange(4),
+               'mask': torch.tensor([True, False]), 'scalar': torch.tensor(2.5), 'empty': torch.zeros(0, 4),
+               'view': torch.randn(4, 6).t()}
+    write_tensors(str(path), tensors, {'task': 'classify', 'names': {'0': 'normal'}})
+
+    loaded, metadata = read_tensors(str(path))
+    assert set(loaded) == set(tensors)
+    for name, tensor in tensors.items():
+        assert loaded[name].dtype == tensor.dtype
+        assert torch.equal(loaded[name], tensor)
+    # Значения метаданных - строки, вложенные хранятся как JSON
+    assert metadata == {'task': 'classify', 'names': '{"0": "normal"}'}
+
+    # Данные начинаются с границы 8 байт
+    with open(path, 'rb') as f:
+        assert (8 + struct.unpack('<Q', f.read(8))[0]) % 8 == 0
+
+
+def test_mapped_tensors_are_copy_on_write(tmp_path):
+    path = tmp_path / 'tensors.safetensors'
+    write_tensors(str(path), {'weight': torch.ones(4)})
+    loaded, _ = read_tensors(str(path))
+    loaded['weight'] += 1
+    assert torch.equal(read_tensors(str(path))[0]['weight'], torch.ones(4))
+
+
+def test_loads_with_safetensors_package(tmp_path):
+    safetensors_torch = pytest.importorskip('safetensors.torch')
+    path = tmp_path / 'tensors.safetensors'
+    tensors = {'a': torch.randn(2, 3), 'b': torch.arange(5, dtype=torch.int32)}
+    write_tensors(str(path), tensors, {'task': 'detect'})
+    loaded = safetensors_torch.load_file(str(path))
+    assert all(torch.equal(loaded[name], tensor) for name, tensor in tensors.items())
+
+
+def test_inference_weights_match_checkpoint(checkpoint):
+    output = export_inference_weights(checkpoint)
+    assert output.endswith('best.safetensors')
+
+    mapped = build_mapped_model(output)
+    assert gc.isenabled()
+    reference = load_checkpoint(checkpoint)[0].fuse(verbose=False).eval().float()
+    assert mapped.names == {0: 'normal', 1: 'foreign_body', 2: 'other'}
+    assert mapped.task == 'classify'
+    assert not any(p.requires_grad for p in mapped.parameters())
+
+    images = torch.rand(2, 3, 64, 64)
+    with torch.no_grad():
+        expected, actual = reference(images), mapped(images)
+    # Классификатор в режиме eval возвращает (вероятности, логиты)
+    expected, actual = (out[0] if isinstance(out, (list, tuple)) else out for out in (expected, actual))
+    assert torch.allclose(actual, expected, atol=1e-5)
+
+    assert model_imgsz(checkpoint) == 64
+    assert model_imgsz(output) == 64
+    yolo = load_model(output)
+    assert yolo.task == 'classify'
+    assert model_imgsz(yolo) == 64
+
+
+def test_build_mapped_model_rejects_foreign_files(tmp_path, checkpoint):
+    path = tmp_path / 'plain.safetensors'
+    write_tensors(str(path), {'weight': torch.ones(1)})
+    with pytest.raises(ValueError, match='Не файл весов'):
+        build_mapped_model(str(path))
+
+    # Веса от другой архитектуры
+    tensors, metadata = read_tensors(export_inference_weights(checkpoint))
+    tensors.pop(next(iter(tensors)))
+    metadata = {key: value if key in ('format', 'format_version', 'task') else json.loads(value)
+                for key, value in metadata.items() if key not in ('source', 'source_hash')}
+    broken = tmp_path / 'broken.safetensors'
+    write_tensors(str(broken), tensors, metadata)
+    with pytest.raises(ValueError, match='не совпадают'):
+        build_mapped_model(str(broken))
+    # Сборка мусора включается обратно и после ошибки
+    assert gc.isenabled()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Streaming uncertainty ranking of an unlabeled pool for active learning
+"""
+
+import os
+import csv
+import json
+import heapq
+import hashlib
+import shutil
+
+import cv2
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.inference_utils import is_image_file
+from utils.kfold_utils import link_file
+
+SCORES = ('entropy', 'margin', 'disagreement', 'combined')
+
+
+def iter_pool(source, image_root=None):
+    """Stream image paths from a directory tree or a list file (one path or file name per line)
+
+    Nothing is materialized: directories are walked lazily (sorted per
+    directory, so the order is stable between runs), list files are read
+    line by line with names resolved against image_root.
+    """
+    if os.path.isfile(source) and not is_image_file(source):
+        root = image_root or os.path.dirname(source)
+        with open(source, 'r', encoding='utf-8') as f:
+            for line in f:
+                name = line.strip()
+                if name:
+                    yield name if os.path.isabs(name) else os.path.join(root, name)
+        return
+    if os.path.isfile(source):
+        yield source
+        return
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if is_image_file(name) and not name.startswith('.'):
+                yield os.path.join(dirpath, name)
+
+
+def uncertainty_scores(probs):
+    """Per-image entropy, margin and checkpoint disagreement from probs of shape (models, images, classes)
+
+    All three are scaled to [0, 1], higher = more informative:
+    entropy of the mean prediction / log(C), 1 - (top1 - top2) of the mean
+    prediction, and the Jensen-Shannon disagreement between checkpoints
+    (entropy of the mean minus mean entropy, / log(C); 0 with one model).
+    """
+    eps = 1e-12
+    n_classes = probs.shape[-1]
+    mean = probs.mean(axis=0)
+    entropy = -(mean * np.log(mean + eps)).sum(axis=1) / np.log(n_classes)
+    top2 = np.sort(mean, axis=1)[:, -2:]
+    margin = 1.0 - (top2[:, 1] - top2[:, 0])
+    member_entropy = -(probs * np.log(probs + eps)).sum(axis=2).mean(axis=0) / np.log(n_classes)
+    disagreement = np.clip(entropy - member_entropy, 0.0, 1.0)
+    combined = (entropy + margin + disagreement) / 3
+    return {'entropy': entropy, 'margin': margin, 'disagreement': disagreement, 'combined': combined}
+
+
+def _path_key(path):
+    return int.from_bytes(hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=8).digest(),
+                          'little', signed=True)
+
+
+class UncertaintyRanker:
+    """Bounded top-K heap over a streamed pool, checkpointed for resume
+
+    State lives in state_dir/<models key>_<score>/: heap.json (current top-K) and
+    scored.bin (8-byte path hashes of every scored image). A rerun with the
+    same checkpoints skips scored images; the heap is O(K), the resume set
+    costs 8 bytes per image. heap.json also records how many keys of
+    scored.bin belong to it, so keys appended by a checkpoint that crashed
+    before its heap was written are dropped on load and rescored.
+    """
+
+    def __init__(self, model_paths, top_k=500, score='combined', state_dir='runs/active'):
+        from ultralytics import YOLO
+
+        self.models = [YOLO(path) for path in model_paths]
+        self.names = dict(self.models[0].names)
+        self.top_k = top_k
+        self.score = score
+        models_key = '_'.join(file_hash(path, length=8) for path in model_paths)
+        self.state_dir = os.path.join(state_dir, f'{models_key}_{score}')
+        self.heap_path = os.path.join(self.state_dir, 'heap.json')
+        self.scored_path = os.path.join(self.state_dir, 'scored.bin')
+        self.heap = []
+        self.scored = np.zeros(0, dtype=np.int64)
+        self._new_keys = []
+        self.load()
+
+    def load(self):
+        committed = 0  # нет heap.json - ни один ключ не подтвержден
+        if os.path.exists(self.heap_path):
+            with open(self.heap_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.heap = [tuple(item) for item in state['heap']]
+            heapq.heapify(self.heap)
+            while len(self.heap) > self.top_k:
+                heapq.heappop(self.heap)
+            # Состояние без счетчика (старый формат) - доверяем всем целым ключам
+            committed = state.get('scored', os.path.getsize(self.scored_path) // 8
+                                  if os.path.exists(self.scored_path) else 0)
+        if os.path.exists(self.scored_path):
+            if os.path.getsize(self.scored_path) != committed * 8:
+                # Хвост от прерванного checkpoint(): эти изображения оценим заново
+                os.truncate(self.scored_path, committed * 8)
+            self.scored = np.sort(np.fromfile(self.scored_path, dtype=np.int64))
+
+    def is_scored(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self.scored):
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.clip(np.searchsorted(self.scored, keys), 0, len(self.scored) - 1)
+        return self.scored[pos] == keys
+
+    def checkpoint(self):
+        """Persist newly scored keys, then the heap with the key count (atomic commit of both)"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        if self._new_keys:
+            with open(self.scored_path, 'ab') as f:
+                np.asarray(self._new_keys, dtype=np.int64).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+            self.scored = np.sort(np.concatenate([self.scored, np.asarray(self._new_keys, dtype=np.int64)]))
+            self._new_keys = []
+        tmp_path = self.heap_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # score - для справки; scored - сколько ключей scored.bin учтено в этой куче
+            json.dump({'score': self.score, 'heap': self.heap, 'scored': len(self.scored)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.heap_path)
+
+    def score_batch(self, paths):
+        """Decode once, run every checkpoint on the same arrays, push into the heap; returns the paths scored"""
+        images, kept = [], []
+        for path in paths:
+            image = cv2.imread(path)
+            if image is not None:
+                images.append(image)
+                kept.append(path)
+        if not kept:
+            return []
+        probs = np.stack([np.stack([r.probs.data.cpu().numpy() for r in
+                                    model.predict(source=images, batch=len(images), verbose=False)])
+                          for model in self.models])
+        scores = uncertainty_scores(probs)
+        top1 = probs.mean(axis=0).argmax(axis=1)
+        for i, path in enumerate(kept):
+            item = (float(scores[self.score][i]), path, self.names[int(top1[i])],
+                    *(round(float(scores[name][i]), 4) for name in SCORES[:3]))
+            if len(self.heap) < self.top_k:
+                heapq.heappush(self.heap, item)
+            elif item > self.heap[0]:
+                heapq.heapreplace(self.heap, item)
+        return kept
+
+    def run(self, pool, batch=32, checkpoint_every=20):
+        """Score every not-yet-scored image of the pool iterator"""
+        scored, skipped, pending, since_checkpoint = 0, 0, [], 0
+
+        def flush():
+            nonlocal scored, since_checkpoint
+            done = self.is_scored([_path_key(path) for path in pending])
+            fresh = [path for path, is_done in zip(pending, done) if not is_done]
+            # Только реально оцененные: нечитаемый сейчас файл (еще копируется) попробуем в следующий раз
+            kept = self.score_batch(fresh) if fresh else []
+            scored += len(kept)
+            self._new_keys.extend(_path_key(path) for path in kept)
+            since_checkpoint += 1
+            if since_checkpoint >= checkpoint_every:
+                self.checkpoint()
+                since_checkpoint = 0
+                print(f"   ⏳ оценено {scored}, пропущено {skipped}")
+            return len(pending) - len(fresh)
+
+        for path in pool:
+            pending.append(path)
+            if len(pending) == batch:
+                skipped += flush()
+                pending = []
+        if pending:
+            skipped += flush()
+        self.checkpoint()
+        return scored, skipped
+
+    def ranked(self):
+        return sorted(self.heap, reverse=True)
+
+    def write_queue(self, queue_dir='data/labeling_queue'):
+        """Labeling queue in the data/images/train/<class> layout (grouped by predicted class) + ranking.csv"""
+        if os.path.isdir(queue_dir):
+            shutil.rmtree(queue_dir)
+        for name in self.names.values():
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+        ranked = self.ranked()
+        with open(os.path.join(queue_dir, 'ranking.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['rank', 'score', 'path', 'predicted', *SCORES[:3]])
+            for rank, (score, path, predicted, *parts) in enumerate(ranked, 1):
+                writer.writerow([rank, round(score, 4), path, predicted, *parts])
+                # Префикс ранга - разметчик видит порядок прямо в файловом менеджере
+                link_file(path, os.path.join(queue_dir, predicted, f'{rank:05d}_{os.path.basename(path)}'))
+        return ranked
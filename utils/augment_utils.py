@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Deterministic minority-class augmentation with a content-addressed cache
+"""
+
+import os
+import json
+import random
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.inference_utils import list_images
+from utils.kfold_utils import link_file
+
+AUG_CACHE_DIR = 'data/aug_cache'
+# Папка, на которой обучается классификатор (02_classify: data='./data' -> ./data/train)
+TRAIN_DIR = 'data/train'
+AUG_PREFIX = 'aug_'
+
+# Аугментации, безопасные для рентгена грудной клетки: небольшая геометрия и контраст
+DEFAULT_SPEC = [
+    {'name': 'Affine', 'params': {'scale': [0.9, 1.1], 'translate_percent': [-0.05, 0.05],
+                                  'rotate': [-10, 10], 'p': 0.9}},
+    {'name': 'RandomBrightnessContrast', 'params': {'brightness_limit': 0.15, 'contrast_limit': 0.15, 'p': 0.7}},
+    {'name': 'RandomGamma', 'params': {'gamma_limit': [85, 115], 'p': 0.3}},
+    {'name': 'CLAHE', 'params': {'clip_limit': 2.0, 'p': 0.3}},
+]
+
+
+def spec_hash(spec):
+    """Stable hash of a transform spec (list of {'name', 'params'})"""
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def build_transform(spec, seed):
+    """albumentations.Compose from a spec, seeded for reproducible output"""
+    try:
+        import albumentations as A
+    except ImportError:
+        raise ImportError("Для аугментации нужен albumentations: pip install albumentations")
+
+    transforms = [getattr(A, item['name'])(**item['params']) for item in spec]
+    # Старые версии albumentations берут случайность из random/np.random
+    random.seed(seed)
+    np.random.seed(seed % (2 ** 32))
+    try:
+        return A.Compose(transforms, seed=seed)
+    except TypeError:
+        return A.Compose(transforms)
+
+
+def cache_key(source_hash, spec_digest, seed):
+    """Content address of one augmented image: (source hash, transform spec, seed)"""
+    return hashlib.sha1(f'{source_hash}|{spec_digest}|{seed}'.encode('utf-8')).hexdigest()[:20]
+
+
+def _generate(job):
+    """Write one augmented image into the cache (worker process); returns True if it was computed"""
+    import cv2
+
+    source, dst, spec, seed = job
+    if os.path.exists(dst):
+        return False
+    image = cv2.imread(source)
+    if image is None:
+        raise ValueError(f"Не удалось прочитать изображение: {source}")
+    augmented = build_transform(spec, seed)(image=image)['image']
+    tmp_path = f"{dst}.{os.getpid()}.tmp{os.path.splitext(dst)[1]}"
+    cv2.imwrite(tmp_path, augmented)
+    os.replace(tmp_path, dst)
+    return True
+
+
+def class_sources(train_dir):
+    """{class: [original image paths]} - previously linked augmentations are excluded"""
+    sources = {}
+    for class_name in sorted(os.listdir(train_dir)):
+        class_dir = os.path.join(train_dir, class_name)
+        if os.path.isdir(class_dir):
+            sources[class_name] = [p for p in list_images(class_dir)
+                                   if not os.path.basename(p).startswith(AUG_PREFIX)]
+    return sources
+
+
+def plan_augmentations(sources, target, spec=None, seed=0, cache_dir=AUG_CACHE_DIR):
+    """Jobs bringing each class up to `target` images
+
+    The j-th extra image of a class comes from source j % n with variant
+    j // n, and its seed is derived from (seed, variant), so raising the
+    target only appends jobs and every existing cache entry stays valid.
+    """
+    spec = spec or DEFAULT_SPEC
+    digest = spec_hash(spec)
+    plan = {}
+    for class_name, paths in sources.items():
+        needed = target - len(paths)
+        if needed <= 0 or not paths:
+            plan[class_name] = []
+            continue
+        hashes = [file_hash(path) for path in paths]
+        jobs = []
+        for j in range(needed):
+            i, variant = j % len(paths), j // len(paths)
+            job_seed = seed * 1000003 + variant
+            ext = os.path.splitext(paths[i])[1].lower()
+            dst = os.path.join(cache_dir, cache_key(hashes[i], digest, job_seed) + ext)
+            jobs.append((paths[i], dst, spec, job_seed))
+        plan[class_name] = jobs
+    return plan
+
+
+def augment_minority_classes(train_dir=TRAIN_DIR, target=None, spec=None, seed=0,
+                             cache_dir=AUG_CACHE_DIR, workers=None):
+    """Generate missing augmentations in a process pool and link them into train_dir/<class>/
+
+    target defaults to the size of the largest class. Links are named
+    aug_<cache key>; stale aug_ links (e.g. after lowering the target) are
+    removed. Returns {class: (originals, augmented)}.
+    """
+    sources = class_sources(train_dir)
+    target = target or max(len(paths) for paths in sources.values())
+    plan = plan_augmentations(sources, target, spec, seed, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    jobs = [job for class_jobs in plan.values() for job in class_jobs if not os.path.exists(job[1])]
+    computed = 0
+    if jobs:
+        workers = workers or min(len(jobs), os.cpu_count() or 1)
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            computed = sum(pool.map(_generate, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+    summary = {}
+    for class_name, class_jobs in plan.items():
+        class_dir = os.path.join(train_dir, class_name)
+        wanted = {AUG_PREFIX + os.path.basename(dst): dst for _, dst, _, _ in class_jobs}
+        for name in os.listdir(class_dir):
+            if name.startswith(AUG_PREFIX) and name not in wanted:
+                os.remove(os.path.join(class_dir, name))
+        for name, dst in wanted.items():
+            link_path = os.path.join(class_dir, name)
+            if not os.path.lexists(link_path):
+                link_file(dst, link_path)
+        summary[class_name] = (len(sources[class_name]), len(class_jobs))
+
+    print(f"🎨 Аугментации: цель {target} на класс | вычислено {computed}, "
+          f"из кэша {sum(len(j) for j in plan.values()) - computed}")
+    return summary
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Reader for ultralytics classification *.cache files as NumPy arrays (regenerated in parallel when stale)
+"""
+
+import os
+import gc
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from utils.trace_utils import traced
+
+# Расширения torchvision ImageFolder - тот же список файлов, что видит ultralytics
+FOLDER_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+STATUS_OK, STATUS_CORRUPT, STATUS_MISSING = 0, 1, 2
+STATUS_NAMES = {STATUS_OK: 'ok', STATUS_CORRUPT: 'corrupt', STATUS_MISSING: 'missing'}
+
+
+def cache_path_for(split_dir):
+    """data/train -> data/train.cache (same rule as ultralytics)"""
+    return os.path.normpath(os.path.abspath(split_dir)) + '.cache'
+
+
+def scan_split(split_dir):
+    """(absolute paths, class indices, class names) in ImageFolder order"""
+    root = os.path.abspath(split_dir)
+    class_names = sorted(d.name for d in os.scandir(root) if d.is_dir())
+    files, labels = [], []
+    for class_id, class_name in enumerate(class_names):
+        for dirpath, dirnames, filenames in sorted(os.walk(os.path.join(root, class_name), followlinks=True)):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(FOLDER_EXTENSIONS):
+                    files.append(os.path.join(dirpath, name))
+                    labels.append(class_id)
+    return files, labels, class_names
+
+
+def load_cache_file(path):
+    """Raw cache dict (gc disabled while unpickling, as ultralytics does)"""
+    gc.disable()
+    try:
+        return np.load(path, allow_pickle=True).item()
+    finally:
+        gc.enable()
+
+
+def listing_digest(dirs):
+    """Directory paths + mtimes: adding, removing or renaming an image changes its folder mtime
+
+    O(number of folders) - a cheap first check. An image overwritten in
+    place keeps its folder mtime; file_stats_digest catches that.
+    """
+    h = hashlib.sha256()
+    for path in dirs:
+        h.update(path.encode('utf-8', 'surrogateescape'))
+        try:
+            h.update(str(os.stat(path).st_mtime_ns).encode())
+        except OSError:
+            h.update(b'-')
+    return h.hexdigest()
+
+
+def file_stats_digest(files):
+    """File paths + sizes + mtime_ns (as ultralytics get_hash uses sizes): catches images rewritten in place"""
+    h = hashlib.sha256()
+    for path in files:
+        h.update(str(path).encode('utf-8', 'surrogateescape'))
+        try:
+            st = os.stat(path)
+            h.update(f'\t{st.st_size}\t{st.st_mtime_ns}\n'.encode())
+        except OSError:
+            h.update(b'\t-\n')
+    return h.hexdigest()
+
+
+def _split_dirs(split_dir, files=()):
+    """The split folder, its class folders and every folder that holds an image"""
+    root = os.path.abspath(split_dir)
+    dirs = {root} | {d.path for d in os.scandir(root) if d.is_dir()}
+    dirs |= {os.path.dirname(f) for f in files}
+    return sorted(dirs)
+
+
+def verify_image(path):
+    """(status, height, width) via PIL header + verify, without a full decode"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as im:
+            im.verify()
+        with Image.open(path) as im:
+            # Размер с учетом EXIF-поворота, как у ultralytics
+            w, h = ImageOps.exif_transpose(im).size if im.getexif().get(0x0112, 1) in (5, 6, 7, 8) else im.size
+        if h < 10 or w < 10:
+            return STATUS_CORRUPT, h, w
+        return STATUS_OK, h, w
+    except FileNotFoundError:
+        return STATUS_MISSING, -1, -1
+    except Exception:
+        return STATUS_CORRUPT, -1, -1
+
+
+def _verify_chunk(paths):
+    return [verify_image(path) for path in paths]
+
+
+@traced('cache_regenerate', cat='scan')
+def regenerate_cache(split_dir, workers=None, process_threshold=2000):
+    """Re-verify every image of a split in parallel and rewrite its .cache file
+
+    The file stays loadable by ultralytics (hash/results/msgs/version as in
+    the installed version); per-image arrays are stored under the extra
+    'cxr' key, which ultralytics ignores.
+    """
+    files, labels, class_names = scan_split(split_dir)
+    # Снимок размеров/mtime до проверки: файл, измененный во время нее, будет перепроверен
+    stats = file_stats_digest(files)
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, len(files) // (workers * 8) or 1)
+    chunks = [files[i:i + chunk] for i in range(0, len(files), chunk)]
+    # Процессы окупаются только на больших датасетах; PIL частично отпускает GIL
+    executor = ProcessPoolExecutor if len(files) >= process_threshold else ThreadPoolExecutor
+    with executor(max_workers=workers) as pool:
+        checked = [result for part in pool.map(_verify_chunk, chunks) for result in part]
+
+    status = np.array([c[0] for c in checked], dtype=np.uint8)
+    shapes = np.array([c[1:] for c in checked], dtype=np.int32).reshape(-1, 2)
+    samples = [(f, l) for f, l, s in zip(files, labels, status) if s == STATUS_OK]
+    msgs = [f"WARNING ⚠️ {f}: {STATUS_NAMES[s]}" for f, s in zip(files, status) if s != STATUS_OK]
+
+    cache = {
+        'results': (len(samples), int((status != STATUS_OK).sum()), len(samples), samples),
+        'msgs': msgs,
+        'cxr': {'dirs': _split_dirs(split_dir, files), 'files': np.array(files),
+                'labels': np.array(labels, dtype=np.int16), 'shapes': shapes, 'status': status,
+                'class_names': class_names},
+    }
+    cache['cxr']['digest'] = listing_digest(cache['cxr']['dirs'])
+    cache['cxr']['stats'] = stats
+    try:
+        # Хэш и версия ultralytics, чтобы обучение тоже использовало этот кэш
+        from ultralytics.data.dataset import DATASET_CACHE_VERSION
+        from ultralytics.data.utils import get_hash
+        cache['hash'] = get_hash(files + class_names)
+        cache['version'] = DATASET_CACHE_VERSION
+    except ImportError:
+        cache['hash'], cache['version'] = '', 'cxr'
+
+    path = cache_path_for(split_dir)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, cache, allow_pickle=True)
+    os.replace(tmp_path, path)
+    return cache['cxr']
+
+
+@traced('dataset_scan', cat='scan')
+def read_dataset_cache(split_dir, regenerate=True, workers=None):
+    """Per-image arrays of a class-folder split from its .cache file
+
+    Returns a dict: files (str array), labels (int16), shapes (int32 N x 2,
+    height/width), status (uint8, see STATUS_NAMES), class_names. A cache
+    written by ultralytics itself has no shapes; it, and any cache whose
+    file listing changed, is regenerated (unless regenerate=False, which
+    returns None for a stale cache). Freshness: folder mtimes first, then
+    the size and mtime of every listed image.
+    """
+    path = cache_path_for(split_dir)
+    if os.path.exists(path):
+        try:
+            section = load_cache_file(path).get('cxr')
+        except Exception:
+            section = None
+        if section is not None and listing_digest(section['dirs']) == section['digest'] \
+                and set(section['dirs']) >= set(_split_dirs(split_dir)) \
+                and file_stats_digest(section['files']) == section.get('stats'):
+            return section
+    if not regenerate:
+        return None
+    return regenerate_cache(split_dir, workers)
+
+
+def class_counts(arrays, exclude_prefix=None, ok_only=True):
+    """{class name: image count} from cache arrays, optionally skipping files with a name prefix"""
+    mask = np.ones(len(arrays['labels']), dtype=bool)
+    if ok_only:
+        mask &= arrays['status'] == STATUS_OK
+    if exclude_prefix and len(arrays['files']):
+        names = np.array([os.path.basename(f) for f in arrays['files']])
+        mask &= ~np.char.startswith(names, exclude_prefix)
+    counts = np.bincount(arrays['labels'][mask].astype(np.int64), minlength=len(arrays['class_names']))
+    return {name: int(count) for name, count in zip(arrays['class_names'], counts)}
@@ -7,38 +7,38 @@ import os
 import numpy as np
 from collections import Counter
 
+from utils.augment_utils import AUG_PREFIX
+from utils.cache_utils import STATUS_NAMES, STATUS_OK, class_counts, read_dataset_cache
+
 class DataBalancer:
     def __init__(self, data_path):
         self.data_path = data_path
         
-    def analyze_current_balance(self):
-        """Analyze current class distribution"""
+    def analyze_current_balance(self, split='train', split_dir=None):
+        """Analyze current class distribution (original images in <data>/<split>/<class>, the folder trained on)"""
         print("📊 Анализ текущего баланса классов...")
         
-        # Пример структуры (замените на реальный анализ)
-        sample_balance = {
-            'normal': 150,
-            'clavicle_fracture': 80, 
-            'foreign_body': 50
-        }
+        split_dir = split_dir or os.path.join(self.data_path, split)
+        if not os.path.isdir(split_dir):
+            print(f"❌ Папка не найдена: {split_dir}")
+            return {}
+        # Счетчики из .cache (без обхода диска), без aug_* копий из 05_enhance_dataset.py
+        counts = class_counts(read_dataset_cache(split_dir), exclude_prefix=AUG_PREFIX)
         
-        for class_name, count in sample_balance.items():
+        for class_name, count in counts.items():
             print(f"   {class_name}: {count} изображений")
             
-        return sample_balance
+        return counts
     
-    def recommend_actions(self, current_counts):
-        """Recommend actions for balancing"""
+    def recommend_actions(self, current_counts, target=None):
+        """Recommend actions for balancing (target: largest class by default)"""
         print("\n💡 РЕКОМЕНДАЦИИ ПО БАЛАНСИРОВКЕ:")
+        if not current_counts:
+            return
         
-        targets = {
-            'normal': 200,
-            'clavicle_fracture': 100,
-            'foreign_body': 70
-        }
+        target = target or max(current_counts.values())
         
         for class_name, current in current_counts.items():
-            target = targets.get(class_name, 0)
             needed = target - current
             if needed > 0:
                 print(f"   ➕ {class_name}: нужно добавить {needed} изображений")
@@ -49,6 +49,27 @@ def check_dataset_quality(data_path):
     """Basic dataset quality check"""
     print("🔍 Проверка качества датасета...")
     
+    splits = [s for s in ('train', 'val', 'test') if os.path.isdir(os.path.join(data_path, s))]
+    if splits:
+        # Классификация (<split>/<class>, как обучает ultralytics): статусы изображений из <split>.cache
+        is_ok = True
+        for split in splits:
+            arrays = read_dataset_cache(os.path.join(data_path, split))
+            status = arrays['status']
+            bad = np.flatnonzero(status != STATUS_OK)
+            valid = arrays['shapes'][status == STATUS_OK]
+            size = f", медиана {int(np.median(valid[:, 1]))}x{int(np.median(valid[:, 0]))}" if len(valid) else ""
+            print(f"   {split}: {len(status)} изображений, проблемных {len(bad)}{size}")
+            for i in bad[:10]:
+                print(f"      ⚠️ {STATUS_NAMES[int(status[i])]}: {arrays['files'][i]}")
+            empty = [name for name, count in class_counts(arrays).items() if count == 0]
+            if empty:
+                print(f"      ❌ Пустые классы: {', '.join(empty)}")
+            is_ok = is_ok and not len(bad) and not empty
+        if is_ok:
+            print("✅ Базовая структура датасета в порядке")
+        return is_ok
+    
     # Проверяем существование основных папок
     required_folders = ['images/train', 'labels/train']
     for folder in required_folders:
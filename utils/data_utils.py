@@ -4,11 +4,18 @@ Utilities for data handling and dataset analysis
 """
 
 import os
+import hashlib
 import yaml
-import cv2
-import numpy as np
 from pathlib import Path
 
+def file_hash(path, length=16, chunk_size=1 << 20):
+    """Content hash of a file (sha1 hex, truncated to `length` chars)"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()[:length]
+
 def setup_dataset_structure(base_path="./data"):
     """Create basic dataset structure"""
     folders = [
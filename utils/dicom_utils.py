@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+DICOM ingestion: VOI LUT / windowing, MONOCHROME1 inversion and downsampling into a PNG cache
+"""
+
+import os
+import hashlib
+import multiprocessing as mp
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.trace_utils import traced
+
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+DICOM_CACHE_DIR = 'data/dicom_cache'
+DICOM_PREFIX = 'dcm_'
+# Меняется вместе с алгоритмом конвертации - старые записи кэша перестают совпадать
+CONVERSION_VERSION = 1
+
+
+def _has_dicom_preamble(path):
+    """Part 10 file: 128-byte preamble followed by b'DICM' (files from PACS often have no extension)"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    except OSError:
+        return False
+
+
+def is_dicom_file(path):
+    """.dcm/.dicom, or an extension-less file with the DICM magic"""
+    name = os.path.basename(path)
+    if name.lower().endswith(DICOM_EXTENSIONS):
+        return True
+    return '.' not in name and _has_dicom_preamble(path)
+
+
+def list_dicoms(source):
+    """Return sorted list of DICOM files for a file or a directory (recursive)"""
+    if os.path.isfile(source):
+        return [source] if is_dicom_file(source) else []
+
+    dicoms = []
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.startswith('.') and is_dicom_file(path):
+                dicoms.append(path)
+    return sorted(dicoms)
+
+
+def _import_pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise ImportError("Для чтения DICOM установите pydicom (pip install pydicom)")
+    return pydicom
+
+
+def target_shape(height, width, size):
+    """(h, w) with the shorter side brought down to `size`; never upscales
+
+    Shorter side, because classification transforms resize it to imgsz;
+    letterboxing for detection then only needs a smaller image.
+    """
+    if not size or min(height, width) <= size:
+        return height, width
+    scale = size / min(height, width)
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def _first(value):
+    """Многозначные WindowCenter/WindowWidth: первое из альтернативных окон"""
+    return float(value[0] if isinstance(value, Sequence) and not isinstance(value, str) else value)
+
+
+def window(values, center, width, function='LINEAR'):
+    """DICOM window (PS3.3 C.11.2.1.2) mapped to [0, 1]"""
+    if function == 'SIGMOID':
+        return 1.0 / (1.0 + np.exp(-4.0 * (values - center) / width))
+    if function == 'LINEAR_EXACT':
+        return np.clip((values - center) / width + 0.5, 0.0, 1.0)
+    return np.clip((values - (center - 0.5)) / max(width - 1.0, 1e-6) + 0.5, 0.0, 1.0)
+
+
+def to_display(pixels, ds):
+    """Stored pixel values -> uint8 display image
+
+    Modality LUT (rescale slope/intercept), then the VOI LUT Sequence if
+    present, else the first window, else a 0.5-99.5 percentile stretch;
+    MONOCHROME1 (bright = low values) is inverted last.
+    """
+    try:
+        from pydicom.pixels import apply_modality_lut, apply_voi
+    except ImportError:  # pydicom < 3
+        from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi
+
+    values = apply_modality_lut(pixels, ds)
+    if ds.get('VOILUTSequence'):
+        # Таблица индексируется целыми значениями
+        bits = int(ds.VOILUTSequence[0].LUTDescriptor[2])
+        display = apply_voi(np.rint(values).astype(np.int64), ds) / float(2 ** bits - 1)
+    elif ds.get('WindowCenter') is not None and ds.get('WindowWidth') is not None:
+        display = window(values.astype(np.float32), _first(ds.WindowCenter), _first(ds.WindowWidth),
+                         str(ds.get('VOILUTFunction', 'LINEAR')).upper())
+    else:
+        low, high = np.percentile(values, (0.5, 99.5))
+        display = np.clip((values - low) / max(high - low, 1e-6), 0.0, 1.0)
+
+    # PresentationLUTShape=INVERSE в DX описывает ту же инверсию - второй раз не применяем
+    if str(ds.get('PhotometricInterpretation', 'MONOCHROME2')) == 'MONOCHROME1':
+        display = 1.0 - display
+    return np.rint(np.clip(display, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+@traced('dicom_decode', cat='decode')
+def read_dicom(path, size=None):
+    """Decode one DICOM file into a uint8 image (grayscale, or BGR for color files)
+
+    With `size` the stored values are downsampled (INTER_AREA) before any
+    LUT: the LUT and window then touch ~100x fewer pixels for a typical
+    2-3k detector image. Multi-frame files give their first frame.
+    """
+    import cv2
+
+    pydicom = _import_pydicom()
+    ds = pydicom.dcmread(path)
+    pixels = ds.pixel_array
+    samples = int(ds.get('SamplesPerPixel', 1))
+    if int(ds.get('NumberOfFrames', 1) or 1) > 1:
+        pixels = pixels[0]
+
+    height, width = pixels.shape[:2]
+    new_height, new_width = target_shape(height, width, size)
+    if (new_height, new_width) != (height, width):
+        if pixels.dtype not in (np.uint8, np.uint16, np.int16):
+            pixels = pixels.astype(np.float32)
+        pixels = cv2.resize(pixels, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    if samples == 3:
+        # Цветные файлы pydicom уже отдает в RGB
+        bits = int(ds.get('BitsStored', 8))
+        if bits > 8:
+            pixels = np.rint(pixels / float(2 ** bits - 1) * 255)
+        return cv2.cvtColor(pixels.astype(np.uint8), cv2.COLOR_RGB2BGR)
+    return to_display(pixels, ds)
+
+
+def cache_key(source_hash, size):
+    """Content address of one conversion: (DICOM content hash, target size, algorithm version)"""
+    return hashlib.sha1(f'{source_hash}|{size}|{CONVERSION_VERSION}'.encode('utf-8')).hexdigest()[:20]
+
+
+def convert_dicom(job):
+    """Convert one DICOM file into the cache (worker process)
+
+    Returns (png path, computed, DICOM hash, error); a file that cannot be
+    read or decoded gives (None, False, None, message) instead of raising,
+    so one corrupt study does not stop the pool.
+    """
+    import cv2
+
+    source, size, cache_dir = job
+    try:
+        source_hash = file_hash(source)
+        dst = os.path.join(cache_dir, cache_key(source_hash, size or 0) + '.png')
+        if os.path.exists(dst):
+            return dst, False, source_hash, None
+        image = read_dicom(source, size)
+        tmp_path = f'{dst}.{os.getpid()}.tmp.png'
+        if not cv2.imwrite(tmp_path, image):
+            raise OSError(f"не удалось записать {tmp_path}")
+        os.replace(tmp_path, dst)
+    except Exception as e:
+        return None, False, None, f"{type(e).__name__}: {e}"
+    return dst, True, source_hash, None
+
+
+def iter_converted(paths, size=None, cache_dir=DICOM_CACHE_DIR, workers=None, failed=None):
+    """Yield (DICOM path, cached PNG path, computed, DICOM content hash) in input order as conversions finish
+
+    Conversions run in a spawn process pool (pydicom decoding and the LUT
+    math hold the GIL). A consumer such as the predictor can start on
+    the first images while the rest are still being converted. Files that
+    fail to convert are reported, skipped and appended to `failed` as
+    (path, error).
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    jobs = [(path, size, cache_dir) for path in paths]
+    workers = workers or min(len(paths), os.cpu_count() or 1)
+    if workers == 1:
+        yield from _report_failures(paths, map(convert_dicom, jobs), failed)
+        return
+
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        # Небольшие порции: первые результаты появляются сразу
+        chunksize = max(1, min(8, len(jobs) // (workers * 4)))
+        yield from _report_failures(paths, pool.map(convert_dicom, jobs, chunksize=chunksize), failed)
+
+
+def _report_failures(paths, results, failed):
+    for path, (dst, computed, source_hash, error) in zip(paths, results):
+        if error is not None:
+            # Один битый файл не останавливает весь прогон
+            print(f"⚠️ Пропускаем DICOM {path}: {error}")
+            if failed is not None:
+                failed.append((path, error))
+            continue
+        yield path, dst, computed, source_hash
+
+
+def convert_dicoms(paths, size=None, cache_dir=DICOM_CACHE_DIR, workers=None):
+    """{DICOM path: cached PNG path} for all paths (see iter_converted)"""
+    converted, computed, failed = {}, 0, []
+    for source, dst, was_computed, _ in iter_converted(paths, size, cache_dir, workers, failed):
+        converted[source] = dst
+        computed += was_computed
+    if converted or failed:
+        print(f"🩻 DICOM: {len(converted)} файлов | сконвертировано {computed}, из кэша {len(converted) - computed}"
+              f"{f' | пропущено битых: {len(failed)}' if failed else ''}")
+    return converted
+
+
+def dicom_link_name(path):
+    """PNG link placed next to a DICOM file in a class folder: dcm_<name>.png"""
+    return DICOM_PREFIX + os.path.splitext(os.path.basename(path))[0] + '.png'
+
+
+def link_dicom_tree(root, size=None, cache_dir=DICOM_CACHE_DIR, workers=None):
+    """Convert every DICOM under `root` and link the PNG next to it as dcm_<name>.png
+
+    Class-folder datasets (ultralytics, scan_split, list_images) then see
+    the converted image without knowing about DICOM. Links of deleted
+    DICOM files are removed. Returns the number of DICOM files.
+    """
+    from utils.kfold_utils import link_file
+
+    cache_root = os.path.abspath(cache_dir)
+    dicoms = list_dicoms(root)
+    wanted = {}
+    for source, dst in convert_dicoms(dicoms, size, cache_dir, workers).items():
+        link_path = os.path.join(os.path.dirname(source), dicom_link_name(source))
+        wanted[link_path] = dst
+        if not os.path.lexists(link_path) or os.path.realpath(link_path) != os.path.realpath(dst):
+            link_file(dst, link_path)
+
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            # Только наши ссылки на кэш: ROI-кропы и копии с тем же префиксом не трогаем
+            if name.startswith(DICOM_PREFIX) and path not in wanted and os.path.islink(path) \
+                    and os.path.dirname(os.readlink(path)) == cache_root:
+                os.remove(path)
+    return len(dicoms)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Frozen-backbone embeddings with a memory-mapped cache and fast linear heads on top
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from utils.data_utils import file_hash
+
+EMBEDDING_CACHE_DIR = 'data/embeddings'
+
+
+class EmbeddingCache:
+    """Append-only memory-mapped matrix of embeddings keyed by image hash
+
+    Layout of cache_dir: vectors.bin (raw rows, `dtype`), keys.txt (one key
+    per row) and meta.json (dim, dtype, count). meta.json is rewritten last,
+    so rows of an interrupted append are ignored on the next open.
+    """
+
+    def __init__(self, cache_dir, dim=None, dtype='float32'):
+        self.cache_dir = cache_dir
+        self.meta_path = os.path.join(cache_dir, 'meta.json')
+        self.vectors_path = os.path.join(cache_dir, 'vectors.bin')
+        self.keys_path = os.path.join(cache_dir, 'keys.txt')
+        self.dim, self.dtype, self.count = dim, np.dtype(dtype), 0
+        self.keys = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            self.dim, self.dtype, self.count = meta['dim'], np.dtype(meta['dtype']), meta['count']
+            with open(self.keys_path, 'r', encoding='utf-8') as f:
+                self.keys = f.read().splitlines()[:self.count]
+            self._truncate()
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self._matrix = None
+
+    def _truncate(self):
+        """Drop rows of an append that did not reach meta.json"""
+        size = self.count * self.dim * self.dtype.itemsize
+        if os.path.getsize(self.vectors_path) > size:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(size)
+        with open(self.keys_path, 'w', encoding='utf-8') as f:
+            f.writelines(key + '\n' for key in self.keys)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    @property
+    def matrix(self):
+        """(count, dim) read-only memmap; reopened after appends"""
+        if self._matrix is None or len(self._matrix) != self.count:
+            if self.count == 0:
+                return np.zeros((0, self.dim or 0), dtype=self.dtype)
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(self.count, self.dim))
+        return self._matrix
+
+    def add(self, keys, vectors):
+        """Append rows for keys not yet cached"""
+        vectors = np.asarray(vectors, dtype=self.dtype)
+        fresh = [i for i, key in enumerate(keys) if key not in self.rows]
+        if not fresh:
+            return 0
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors[fresh]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, 'a', encoding='utf-8') as f:
+            for i in fresh:
+                f.write(keys[i] + '\n')
+                self.rows[keys[i]] = len(self.keys)
+                self.keys.append(keys[i])
+
+        self.count = len(self.keys)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'dtype': self.dtype.name, 'count': self.count}, f)
+        os.replace(tmp_path, self.meta_path)
+        return len(fresh)
+
+    def get(self, keys):
+        """Rows for keys, in order (all keys must be cached)"""
+        return np.asarray(self.matrix[[self.rows[key] for key in keys]])
+
+
+class BackboneEmbedder:
+    """Pooled features of a YOLO classification model right before its linear layer
+
+    Preprocessing is the model's own inference transform (shortest-side resize,
+    center crop), so a linear head trained on these features can be written
+    back into Classify.linear unchanged.
+    """
+
+    def __init__(self, model_path, device='cpu', decode_threads=4):
+        from ultralytics import YOLO
+        from ultralytics.data.augment import classify_transforms
+
+        self.model_path = model_path
+        yolo = YOLO(model_path)
+        self.names = dict(yolo.names)
+        self.model = yolo.model.to(device).eval()
+        self.device = device
+        imgsz = yolo.overrides.get('imgsz') or self.model.args.get('imgsz', 224)
+        self.transform = classify_transforms(imgsz)
+        self.decode_threads = decode_threads
+        self.model_hash = file_hash(model_path)
+
+    def _load(self, path):
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Не удалось прочитать изображение: {path}")
+        return self.transform(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+
+    @torch.no_grad()
+    def embed_batch(self, paths):
+        with ThreadPoolExecutor(max_workers=self.decode_threads) as pool:
+            batch = torch.stack(list(pool.map(self._load, paths))).to(self.device)
+        layers = self.model.model
+        x = batch
+        for layer in layers[:-1]:
+            x = layer(x)
+        head = layers[-1]
+        return head.pool(head.conv(x)).flatten(1).cpu().numpy()
+
+
+def embed_images(model_path, paths, cache_dir=EMBEDDING_CACHE_DIR, batch=32, device='cpu'):
+    """Embeddings of `paths` (in order); only images missing from the cache hit the backbone
+
+    The cache lives in cache_dir/<model hash>, so retrained weights never
+    reuse stale features.
+    """
+    embedder = BackboneEmbedder(model_path, device)
+    cache = EmbeddingCache(os.path.join(cache_dir, embedder.model_hash))
+    hashes = [file_hash(path) for path in paths]
+
+    missing = []
+    seen = set()
+    for path, key in zip(paths, hashes):
+        if key not in cache and key not in seen:
+            missing.append((path, key))
+            seen.add(key)
+
+    for start in range(0, len(missing), batch):
+        chunk = missing[start:start + batch]
+        cache.add([key for _, key in chunk], embedder.embed_batch([path for path, _ in chunk]))
+
+    print(f"🧬 Эмбеддинги: {len(paths)} изображений, вычислено {len(missing)}, из кэша {len(paths) - len(missing)}")
+    return cache.get(hashes), embedder
+
+
+def oversample(features, labels, seed=0):
+    """Random oversampling of minority classes up to the majority count"""
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    classes, counts = np.unique(labels, return_counts=True)
+    index = np.concatenate([rng.choice(np.flatnonzero(labels == c), counts.max(), replace=True)
+                            if n < counts.max() else np.flatnonzero(labels == c)
+                            for c, n in zip(classes, counts)])
+    return features[index], labels[index]
+
+
+def train_linear_head(features, labels, class_weight=None, C=1.0, sampling=None, seed=0):
+    """Multinomial logistic regression on cached embeddings"""
+    from sklearn.linear_model import LogisticRegression
+
+    if sampling == 'oversample':
+        features, labels = oversample(features, labels, seed)
+    clf = LogisticRegression(C=C, class_weight=class_weight, max_iter=5000, random_state=seed)
+    clf.fit(features, labels)
+    return clf
+
+
+def evaluate_head(clf, features, labels, class_names):
+    """Accuracy, per-class recall and confusion matrix of a linear head"""
+    labels = np.asarray(labels)
+    predicted = clf.predict(features)
+    n = len(class_names)
+    confusion = np.zeros((n, n), dtype=np.int64)
+    for t, p in zip(labels, predicted):
+        confusion[t, p] += 1
+    recall = {class_names[i]: float(confusion[i, i] / confusion[i].sum()) if confusion[i].sum() else float('nan')
+              for i in range(n)}
+    return {'accuracy': float((predicted == labels).mean()) if len(labels) else float('nan'),
+            'recall': recall, 'confusion': confusion}
+
+
+def export_head(model_path, clf, output_path):
+    """Write the logistic-regression weights into Classify.linear and save a deployable checkpoint
+
+    Class indices of the head must be the model's own class indices; the
+    classes sklearn never saw keep a large negative bias.
+    """
+    from ultralytics import YOLO
+
+    yolo = YOLO(model_path)
+    linear = yolo.model.model[-1].linear
+    weight = torch.zeros_like(linear.weight)
+    bias = torch.full_like(linear.bias, -1e4)
+    coef, intercept = clf.coef_, clf.intercept_
+    if coef.shape[0] == 1:
+        # Бинарный случай sklearn хранит одну строку: logit(класс 1) - logit(класс 0)
+        coef, intercept = np.vstack([-coef / 2, coef / 2]), np.array([-intercept[0] / 2, intercept[0] / 2])
+    for row, class_id in enumerate(clf.classes_):
+        weight[int(class_id)] = torch.as_tensor(coef[row], dtype=weight.dtype)
+        bias[int(class_id)] = float(intercept[row])
+    with torch.no_grad():
+        linear.weight.copy_(weight)
+        linear.bias.copy_(bias)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    yolo.save(output_path)
+    return output_path
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Incremental fine-tuning: warm-start from best.pt on new images plus a class-balanced replay sample
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import random
+
+from utils.data_utils import file_hash
+from utils.inference_utils import list_images
+from utils.kfold_utils import link_file
+
+MANIFEST_NAME = 'train_manifest.json'
+
+
+def dataset_manifest(data_root='./data', split='train'):
+    """{relative path: content hash} of every image in data_root/split/<class>/"""
+    split_dir = os.path.join(data_root, split)
+    return {os.path.relpath(path, split_dir): file_hash(path) for path in list_images(split_dir)}
+
+
+def save_manifest(run_dir, data_root='./data', split='train', manifest=None):
+    """Record which images the checkpoint in run_dir was trained on"""
+    manifest = manifest if manifest is not None else dataset_manifest(data_root, split)
+    with open(os.path.join(run_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+def load_manifest(run_dir):
+    path = os.path.join(run_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    # Старый формат {хэш: путь}: ключи - 16 hex-символов file_hash
+    if manifest and all(re.fullmatch(r'[0-9a-f]{16}', key) for key in manifest):
+        manifest = {rel: h for h, rel in manifest.items()}
+    return manifest
+
+
+def find_new_images(run_dir, data_root='./data', split='train'):
+    """Split current training images into (new, old) lists of (hash, relative path)
+
+    An image is old if the manifest has its path with the same content, or
+    its content under another name in the same class folder (a rename).
+    Rewritten files and files moved to another class (relabeled) are new;
+    identical images in several classes are all tracked. Runs trained
+    before manifests existed fall back to "modified after best.pt".
+    """
+    current = dataset_manifest(data_root, split)
+    manifest = load_manifest(run_dir)
+    if manifest is None:
+        best_mtime = os.path.getmtime(os.path.join(run_dir, 'weights', 'best.pt'))
+        split_dir = os.path.join(data_root, split)
+        manifest = {rel: h for rel, h in current.items()
+                    if os.path.getmtime(os.path.join(split_dir, rel)) <= best_mtime}
+    trained = {(os.path.dirname(rel), h) for rel, h in manifest.items()}
+    new, old = [], []
+    for rel, h in current.items():
+        known = manifest.get(rel) == h or (os.path.dirname(rel), h) in trained
+        (old if known else new).append((h, rel))
+    return new, old
+
+
+def replay_sample(old, per_class=10, seed=0):
+    """Class-balanced sample of already-trained images (at most per_class of each class)"""
+    by_class = {}
+    for h, rel in old:
+        by_class.setdefault(os.path.dirname(rel), []).append((h, rel))
+    rng = random.Random(seed)
+    sample = []
+    for class_name in sorted(by_class):
+        items = sorted(by_class[class_name], key=lambda item: item[1])
+        rng.shuffle(items)
+        sample.extend(items[:per_class])
+    return sample
+
+
+def build_update_dataset(new, replay, data_root='./data', dst_root='data/incremental'):
+    """dst_root/train from links to new + replay images; dst_root/val links the full validation set"""
+    if os.path.isdir(dst_root):
+        shutil.rmtree(dst_root)
+    for _, rel in new + replay:
+        dst = os.path.join(dst_root, 'train', rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        link_file(os.path.join(data_root, 'train', rel), dst)
+    val_dir = os.path.join(data_root, 'val')
+    for path in list_images(val_dir):
+        dst = os.path.join(dst_root, 'val', os.path.relpath(path, val_dir))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        link_file(path, dst)
+    # Классы без новых и старых картинок должны существовать, иначе ultralytics их потеряет
+    for class_name in os.listdir(os.path.join(data_root, 'train')):
+        if os.path.isdir(os.path.join(data_root, 'train', class_name)):
+            os.makedirs(os.path.join(dst_root, 'train', class_name), exist_ok=True)
+    return os.path.abspath(dst_root)
+
+
+def validate_top1(weights, data_root='./data', batch=16):
+    """Top-1 accuracy of a checkpoint on data_root/val"""
+    from ultralytics import YOLO
+
+    metrics = YOLO(weights).val(data=data_root, split='val', batch=batch, plots=False, verbose=False,
+                                project=os.path.join('runs', 'classify'), name='val_incremental', exist_ok=True)
+    return float(metrics.top1)
+
+
+def incremental_update(run_dir='runs/classify/train', data_root='./data', epochs=3, replay_per_class=10,
+                       lr0=1e-4, tolerance=0.0, train_args=None, seed=0):
+    """Fine-tune run_dir/weights/best.pt on new images and promote it only if val top-1 holds
+
+    Returns True if the checkpoint was replaced. The previous weights are
+    kept as best_prev.pt next to best.pt.
+    """
+    from ultralytics import YOLO
+    from utils.run_registry import RunRegistry
+
+    best_path = os.path.join(run_dir, 'weights', 'best.pt')
+    if not os.path.exists(best_path):
+        print(f"❌ Нет обученной модели: {best_path}")
+        return False
+
+    new, old = find_new_images(run_dir, data_root)
+    if not new:
+        print("✅ Новых изображений нет - модель актуальна")
+        return False
+    replay = replay_sample(old, replay_per_class, seed)
+    print(f"🆕 Новых изображений: {len(new)} | replay: {len(replay)} (до {replay_per_class} на класс)")
+
+    start = time.perf_counter()
+    update_data = build_update_dataset(new, replay, data_root)
+    baseline = validate_top1(best_path, data_root)
+
+    args = {'epochs': epochs, 'lr0': lr0, 'optimizer': 'AdamW', 'warmup_epochs': 0, 'workers': 0,
+            'plots': False, 'seed': seed, **(train_args or {})}
+    update_name = os.path.basename(os.path.normpath(run_dir)) + '_update'
+    model = YOLO(best_path)
+    RunRegistry().track(model)
+    model.train(data=update_data, project=os.path.dirname(os.path.abspath(run_dir)),
+                name=update_name, exist_ok=True, **args)
+    candidate_path = os.path.join(os.path.dirname(os.path.abspath(run_dir)), update_name, 'weights', 'best.pt')
+    candidate = validate_top1(candidate_path, data_root)
+    elapsed = time.perf_counter() - start
+
+    print(f"\n📊 Val top-1: текущая {baseline:.3f} → дообученная {candidate:.3f} ({elapsed / 60:.1f} мин)")
+    if candidate + 1e-9 < baseline - tolerance:
+        print(f"⛔ Модель не обновлена: качество упало. Кандидат: {candidate_path}")
+        return False
+
+    shutil.copy2(best_path, os.path.join(run_dir, 'weights', 'best_prev.pt'))
+    shutil.copy2(candidate_path, best_path)
+    # Обновленная модель видела весь текущий train: старые картинки - через исходную, новые - напрямую
+    save_manifest(run_dir, manifest={rel: h for h, rel in old + new})
+    print(f"✅ Модель обновлена: {best_path} (предыдущая: best_prev.pt)")
+    return True
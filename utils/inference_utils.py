@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Inference utilities: image discovery, batched prediction and watch-folder mode
+"""
+
+import os
+import time
+import queue
+import threading
+import multiprocessing as mp
+from itertools import islice
+
+from utils.memory_utils import AdaptiveBatchController
+from utils.trace_utils import add_span, flush_trace, span, traced, tracing_enabled
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def is_image_file(path):
+    """Check image extension (case-insensitive)"""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+@traced('list_images', cat='scan')
+def list_images(source):
+    """Return sorted list of images for a file or a directory (recursive)"""
+    if os.path.isfile(source):
+        return [source]
+
+    images = []
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in files:
+            if is_image_file(name) and not name.startswith('.'):
+                images.append(os.path.join(root, name))
+    return sorted(images)
+
+
+def result_to_record(result):
+    """Convert ultralytics Results into a plain, picklable dict"""
+    record = {
+        'path': result.path,
+        'names': dict(result.names),
+        'latency_ms': float(sum(v for v in result.speed.values() if v is not None))
+    }
+
+    if getattr(result, 'probs', None) is not None:
+        # Классификация
+        record['probs'] = [float(p) for p in result.probs.data.tolist()]
+        record['top1'] = int(result.probs.top1)
+        record['top1conf'] = float(result.probs.top1conf)
+    elif getattr(result, 'boxes', None) is not None:
+        # Детекция
+        record['boxes'] = [
+            (int(box.cls[0]), float(box.conf[0]), [float(v) for v in box.xyxy[0].tolist()])
+            for box in result.boxes
+        ]
+    return record
+
+
+def print_record(record, index=None):
+    """Print one prediction record"""
+    title = f"Результат {index}" if index is not None else os.path.basename(record['path'])
+    print(f"\n📊 {title}:")
+
+    if 'probs' in record:
+        print("Вероятности классов:")
+        for class_id, prob in enumerate(record['probs']):
+            print(f"   {record['names'][class_id]}: {prob:.2%}")
+    elif record.get('boxes'):
+        print("Обнаруженные объекты:")
+        for class_id, confidence, _ in record['boxes']:
+            print(f"   {record['names'][class_id]}: {confidence:.2%}")
+    else:
+        print("   Объекты не обнаружены")
+
+
+def list_labeled_images(root, class_names):
+    """Images from root/<class_name>/ folders with their class indices"""
+    paths, labels = [], []
+    for class_id, class_name in enumerate(class_names):
+        class_dir = os.path.join(root, class_name)
+        if os.path.isdir(class_dir):
+            class_images = list_images(class_dir)
+            paths.extend(class_images)
+            labels.extend([class_id] * len(class_images))
+    return paths, labels
+
+
+def iter_predictions(model, paths, conf=0.5, batch=16, save=False, tta_band=None, roi_cache=None, loader=None):
+    """Yield prediction records batch by batch (constant memory for large sources)
+
+    With `tta_band=(low, high)` images whose first-pass confidence falls in
+    the band are re-scored with test-time augmentation. With `roi_cache`
+    (utils.roi_utils.RoiCache) the model sees only the thoracic ROI crop;
+    otherwise `loader(path)` may supply the BGR image for a path that is
+    not a local file (e.g. utils.object_store_utils.ObjectStoreSource.load).
+    `batch` may be a utils.memory_utils.AdaptiveBatchController, which then
+    picks the size of every batch from measured throughput and memory.
+    `paths` may be any iterable (e.g. images still being converted from DICOM).
+    Every record gets `stage_ms`: per-image decode/preprocess/forward/postprocess
+    times and end_to_end, the wall time of its batch (see utils.metrics_utils).
+    """
+    loader = roi_cache.crop if roi_cache is not None else loader
+    controller = batch if isinstance(batch, AdaptiveBatchController) else None
+
+    paths = iter(paths)
+    while True:
+        chunk = list(islice(paths, controller.batch if controller else batch))
+        if not chunk:
+            break
+        started = time.perf_counter()
+        start_ns = time.perf_counter_ns()
+        results = model.predict(
+            source=[loader(p) for p in chunk] if loader else chunk,
+            conf=conf,
+            batch=len(chunk),
+            save=save,
+            exist_ok=True,
+            verbose=False
+        )
+        stages = stage_times_ns(results, time.perf_counter_ns() - start_ns)
+        if tracing_enabled():
+            trace_predict_batch(results, start_ns, stages)
+        records = [result_to_record(r) for r in results]
+        if loader:
+            # Для массивов ultralytics не знает исходный путь
+            for record, path in zip(records, chunk):
+                record['path'] = path
+        if tta_band is not None:
+            from utils.tta_utils import apply_tta
+            with span('tta', cat='model', images=len(records)):
+                apply_tta(model, records, tta_band, loader=loader)
+        elapsed = time.perf_counter() - started
+        if records:
+            # Один словарь на батч: ultralytics и так сообщает средние по батчу времена
+            timings = {name: ns / 1e6 / len(records) for name, ns in stages}
+            timings['end_to_end'] = elapsed * 1000
+            for record in records:
+                record['stage_ms'] = timings
+        if controller is not None:
+            controller.report(len(chunk), elapsed)
+        yield records
+
+
+def stage_times_ns(results, duration_ns):
+    """[(stage, ns)] of one model.predict call: decode, preprocess, forward, postprocess
+
+    ultralytics reports per-image preprocess/inference/postprocess times;
+    the rest of the call is reading and decoding the images, which happens
+    first, so decode is the remainder.
+    """
+    stages = [(name, sum((r.speed.get(key) or 0.0) for r in results) * 1e6)
+              for name, key in (('preprocess', 'preprocess'), ('forward', 'inference'), ('postprocess', 'postprocess'))]
+    return [('decode', max(0.0, duration_ns - sum(ns for _, ns in stages)))] + stages
+
+
+def trace_predict_batch(results, start_ns, stages):
+    """Span of one model.predict call split into its stages (see stage_times_ns), laid out in order"""
+    add_span('predict', start_ns, int(sum(ns for _, ns in stages)), cat='model', images=len(results))
+    if not results:
+        return
+    offset = 0.0
+    for name, ns in stages:
+        add_span(name, start_ns + int(offset), int(ns), cat='model')
+        offset += ns
+
+
+def predict_paths(model, paths, **kwargs):
+    """Run batched prediction over a list of image paths (kwargs as in iter_predictions)"""
+    return [record for records in iter_predictions(model, paths, **kwargs) for record in records]
+
+
+# Модель, ROI-кэш и барьер прогрева процесса-воркера (см. iter_sharded)
+_worker_model = None
+_worker_roi_cache = None
+_worker_barrier = None
+
+
+def split_shards(items, n_shards):
+    """Split a list into n contiguous shards of near-equal size"""
+    n_shards = max(1, min(n_shards, len(items)))
+    size, extra = divmod(len(items), n_shards)
+    shards, start = [], 0
+    for i in range(n_shards):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+
+def _init_worker(model_path, threads, cpu_groups, roi_cache_path, barrier=None):
+    """Pool initializer: pin threads/affinity and load one model per process"""
+    global _worker_model, _worker_roi_cache, _worker_barrier
+    import torch
+    from utils.sweep_utils import set_worker_threads
+    from utils.weights_utils import load_model
+
+    # Не только torch.set_num_threads: select_device в каждом predict иначе вернет число потоков ultralytics
+    set_worker_threads(threads)
+    torch.set_num_interop_threads(1)
+    _worker_barrier = barrier
+
+    if cpu_groups is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            # Группы рассчитаны на первые N воркеров; замене упавшего воркера группы может не хватить
+            os.sched_setaffinity(0, cpu_groups.get(timeout=5))
+        except queue.Empty:
+            print(f"⚠️ Воркер {os.getpid()}: свободной группы ядер нет, работаем без привязки")
+
+    # Веса .safetensors отображаются в память: воркеры делят одни и те же страницы
+    _worker_model = load_model(model_path)
+    if roi_cache_path is not None:
+        from utils.roi_utils import RoiCache
+        _worker_roi_cache = RoiCache(roi_cache_path)
+
+
+def _warm_up_worker(_):
+    """First predict sets up the predictor; the barrier makes every worker take exactly one of these"""
+    import numpy as np
+
+    _worker_model.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+    try:
+        _worker_barrier.wait(timeout=300)
+    except threading.BrokenBarrierError:
+        pass
+
+
+def _predict_shard(task):
+    shard_id, paths, kwargs = task
+    with span('shard', cat='worker', shard=shard_id, images=len(paths)):
+        records = predict_paths(_worker_model, paths, roi_cache=_worker_roi_cache, **kwargs)
+    if _worker_roi_cache is not None:
+        _worker_roi_cache.save()
+    # Pool.terminate() не дает воркеру выполнить atexit - спаны сбрасываем после каждого шарда
+    flush_trace()
+    return shard_id, records
+
+
+def iter_sharded(model_path, paths, workers, threads=None, affinity=False, shards_per_worker=4,
+                 roi_cache=None, on_ready=None, **kwargs):
+    """Predict paths in N worker processes, each holding its own model
+
+    The list is split into `workers * shards_per_worker` contiguous shards so
+    that fast workers pick up more work. Shards are yielded in the original
+    path order as soon as all preceding shards are done. Extra kwargs are
+    passed to iter_predictions in the workers. With `on_ready` every worker
+    first loads its model and runs a warm-up predict, then on_ready() is
+    called before the first shard is sent (benchmarks time from there).
+    """
+    cpu_ids = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    if threads is None:
+        threads = max(1, len(cpu_ids) // workers)
+
+    # spawn: fork после инициализации потоков torch может зависнуть
+    ctx = mp.get_context('spawn')
+    cpu_groups = None
+    if affinity:
+        cpu_groups = ctx.Queue()
+        groups = split_shards(cpu_ids, workers)
+        for i in range(workers):
+            # Воркеров больше, чем ядер - группы используются по кругу
+            cpu_groups.put(set(groups[i % len(groups)]))
+
+    roi_cache_path = roi_cache.cache_path if roi_cache is not None else None
+    shards = split_shards(paths, workers * shards_per_worker)
+    tasks = [(i, shard, kwargs) for i, shard in enumerate(shards)]
+
+    finished = {}
+    next_shard = 0
+    barrier = ctx.Barrier(workers) if on_ready is not None else None
+    initargs = (model_path, threads, cpu_groups, roi_cache_path, barrier)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        if on_ready is not None:
+            pool.map(_warm_up_worker, range(workers), chunksize=1)
+            on_ready()
+        for shard_id, records in pool.imap_unordered(_predict_shard, tasks):
+            finished[shard_id] = records
+            while next_shard in finished:
+                yield finished.pop(next_shard)
+                next_shard += 1
+
+
+def predict_sharded(model_path, paths, workers, **kwargs):
+    """Sharded prediction merged into one list in source order"""
+    return [record for records in iter_sharded(model_path, paths, workers, **kwargs) for record in records]
+
+
+class ProcessedCheckpoint:
+    """Append-only log of processed files, used to resume interrupted runs"""
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.done = set()
+
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+
+    @staticmethod
+    def file_key(path, stat_result):
+        """Key = absolute path + size + mtime: a rewritten file gets a new key (FolderWatcher finds it on a full rescan)"""
+        return f"{os.path.abspath(path)}\t{stat_result.st_size}\t{stat_result.st_mtime_ns}"
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def add(self, keys):
+        """Persist keys before returning so a crash never repeats finished work"""
+        keys = [k for k in keys if k not in self.done]
+        if not keys:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(k + '\n' for k in keys))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(keys)
+
+
+class FolderWatcher:
+    """Polling watcher that yields batches of new, fully written images
+
+    A directory is rescanned only when its mtime changes (a file was created,
+    renamed or deleted), so idle polls cost one stat() per directory. A file
+    is considered complete once its size and mtime stayed the same for
+    `settle` seconds. An image overwritten in place (same name, e.g. by
+    `cp` over it) does not change its directory's mtime; every `rescan`
+    seconds all directories are listed anyway and files whose size or
+    mtime no longer match the checkpoint are processed again.
+    Files reported through `retry` come back after `retry_delay` seconds,
+    doubling per failed attempt up to `max_retry_delay`.
+    """
+
+    def __init__(self, source, checkpoint, interval=2.0, settle=2.0, batch=16, retry_delay=30.0,
+                 max_retry_delay=3600.0, rescan=60.0):
+        self.source = source
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.settle = settle
+        self.batch = batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.rescan = rescan
+        self.last_rescan = time.monotonic()
+        self.dir_mtimes = {}
+        self.subdirs = {}
+        self.pending = {}  # path -> (size, mtime_ns, время последнего изменения)
+        self.failures = {}  # path -> число неудачных попыток
+
+    def _scan_changed_dirs(self, full=False):
+        """Collect candidate files from directories whose mtime changed (every directory with full=True)"""
+        stack = [self.source]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                self.dir_mtimes.pop(directory, None)
+                self.subdirs.pop(directory, None)
+                continue
+
+            if not full and self.dir_mtimes.get(directory) == mtime:
+                # Содержимое папки не менялось - только спускаемся в подпапки
+                stack.extend(self.subdirs.get(directory, []))
+                continue
+
+            self.dir_mtimes[directory] = mtime
+            subdirs = []
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif is_image_file(entry.name) and entry.path not in self.pending:
+                    self.pending[entry.path] = None
+
+            self.subdirs[directory] = subdirs
+            stack.extend(subdirs)
+
+    def _collect_ready(self):
+        """Re-stat pending files and return those that settled"""
+        now = time.monotonic()
+        ready = []
+        for path, state in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+
+            key = ProcessedCheckpoint.file_key(path, st)
+            if key in self.checkpoint:
+                del self.pending[path]
+                continue
+
+            if state is None or state[:2] != (st.st_size, st.st_mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif st.st_size > 0 and now - state[2] >= self.settle:
+                ready.append((path, key))
+                del self.pending[path]
+        return sorted(ready)
+
+    def retry(self, done, failed):
+        """Forget the failures of processed files and put failed ones back with a growing delay"""
+        for path in done:
+            self.failures.pop(path, None)
+        now = time.monotonic()
+        for path in failed:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                self.failures.pop(path, None)
+                continue
+            attempts = self.failures.get(path, 0) + 1
+            self.failures[path] = attempts
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            # Момент "последнего изменения" в будущем: файл станет готов через delay + settle
+            self.pending[path] = (st.st_size, st.st_mtime_ns, now + delay)
+
+    def poll(self):
+        """One scan: [(path, checkpoint_key)] of files that are ready now"""
+        # Полный обход изредка: перезапись файла на месте не меняет mtime папки
+        full = self.rescan is not None and time.monotonic() - self.last_rescan >= self.rescan
+        if full:
+            self.last_rescan = time.monotonic()
+        self._scan_changed_dirs(full)
+        return self._collect_ready()
+
+    def batches(self):
+        """Infinite generator of [(path, checkpoint_key), ...] batches"""
+        while True:
+            ready = self.poll()
+            for start in range(0, len(ready), self.batch):
+                yield ready[start:start + self.batch]
+            time.sleep(self.interval)
+
+
+def watch_and_predict(model, source, checkpoint_path, batch=16, interval=2.0, settle=2.0, rescan=60.0,
+                      on_records=None, on_error=None, **kwargs):
+    """Watch a folder and predict new images as they arrive (Ctrl+C to stop)
+
+    `on_error(path, exception)` is called for every file that fails on its own.
+    Only files that produced a record are checkpointed; failed ones are
+    retried later (see FolderWatcher.retry). Extra kwargs (conf, save,
+    tta_band, roi_cache, ...) go to iter_predictions.
+    """
+    checkpoint = ProcessedCheckpoint(checkpoint_path)
+    watcher = FolderWatcher(source, checkpoint, interval=interval, settle=settle, batch=batch, rescan=rescan)
+
+    print(f"👀 Режим наблюдения: {source}")
+    print(f"💾 Чекпоинт: {checkpoint_path} (уже обработано: {len(checkpoint)})")
+
+    processed = 0
+    try:
+        for items in watcher.batches():
+            paths = [path for path, _ in items]
+            try:
+                records = predict_paths(model, paths, batch=batch, **kwargs)
+            except Exception as e:
+                # Один битый файл не должен блокировать весь батч
+                print(f"⚠️ Ошибка батча ({e}), обрабатываем по одному")
+                records = []
+                for path in paths:
+                    try:
+                        records.extend(predict_paths(model, [path], batch=1, **kwargs))
+                    except Exception as file_error:
+                        print(f"❌ Пропускаем {path}: {file_error}")
+                        if on_error is not None:
+                            on_error(path, file_error)
+
+            if on_records is not None:
+                on_records(records)
+            produced = {os.path.abspath(record['path']) for record in records}
+            done = [(path, key) for path, key in items if os.path.abspath(path) in produced]
+            failed = [path for path, _ in items if os.path.abspath(path) not in produced]
+            checkpoint.add([key for _, key in done])
+            watcher.retry([path for path, _ in done], failed)
+
+            processed += len(done)
+            print(f"✅ Обработано новых файлов: {len(done)} (всего за сессию: {processed})"
+                  + (f" | повторим позже: {len(failed)}" if failed else ""))
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Наблюдение остановлено. Обработано за сессию: {processed}")
+
+    return processed
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Stratified k-fold cross-validation of the classifier with concurrent fold training
+"""
+
+import os
+import csv
+import time
+import random
+
+import numpy as np
+import yaml
+
+from utils.inference_utils import list_images
+
+
+def collect_class_images(images_root='data/images'):
+    """All images from images_root/<split>/<class>/, pooled over splits
+
+    Returns (paths, labels, class_names); classes are sorted by name, the
+    same order ultralytics assigns to class folders.
+    """
+    splits = sorted(d for d in os.listdir(images_root) if os.path.isdir(os.path.join(images_root, d)))
+    class_names = sorted({c for split in splits for c in os.listdir(os.path.join(images_root, split))
+                          if os.path.isdir(os.path.join(images_root, split, c))})
+    paths, labels = [], []
+    for split in splits:
+        for class_id, class_name in enumerate(class_names):
+            class_dir = os.path.join(images_root, split, class_name)
+            if os.path.isdir(class_dir):
+                # Аугментированные копии (05_enhance_dataset.py) не берем: утечка между фолдами
+                class_images = [p for p in list_images(class_dir) if not os.path.basename(p).startswith('aug_')]
+                paths.extend(class_images)
+                labels.extend([class_id] * len(class_images))
+    return paths, labels, class_names
+
+
+def stratified_folds(labels, k=5, seed=0):
+    """Fold index per sample: each class is shuffled and dealt round-robin over the folds"""
+    rng = random.Random(seed)
+    folds = [0] * len(labels)
+    offset = 0
+    for class_id in sorted(set(labels)):
+        members = [i for i, label in enumerate(labels) if label == class_id]
+        rng.shuffle(members)
+        for j, i in enumerate(members):
+            # Сдвиг между классами, чтобы остатки не копились в первых фолдах
+            folds[i] = (j + offset) % k
+        offset += len(members)
+    return folds
+
+
+def link_file(src, dst):
+    """Symlink (hard link where symlinks are not allowed) - never copies the image"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.symlink(os.path.abspath(src), dst)
+    except OSError:
+        os.link(src, dst)
+
+
+def build_fold_dirs(paths, labels, class_names, folds, k, root='data/kfold'):
+    """data/kfold/fold_<i>/{train,val}/<class>/ made of links to the original images"""
+    fold_dirs = []
+    for fold in range(k):
+        fold_dir = os.path.join(root, f'fold_{fold}')
+        for split in ('train', 'val'):
+            for class_name in class_names:
+                class_dir = os.path.join(fold_dir, split, class_name)
+                os.makedirs(class_dir, exist_ok=True)
+                for name in os.listdir(class_dir):
+                    os.remove(os.path.join(class_dir, name))
+        for path, label, sample_fold in zip(paths, labels, folds):
+            split = 'val' if sample_fold == fold else 'train'
+            # Имя с префиксом исходного сплита: одинаковые имена файлов не конфликтуют
+            origin = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            link_file(path, os.path.join(fold_dir, split, class_names[label], f'{origin}_{os.path.basename(path)}'))
+        fold_dirs.append(os.path.abspath(fold_dir))
+    return fold_dirs
+
+
+def train_fold(job):
+    """Train one fold and predict its held-out images (out-of-fold predictions)"""
+    from ultralytics import YOLO
+    from utils.inference_utils import predict_paths
+    from utils.run_registry import RunRegistry
+    from utils.training_utils import best_metric
+
+    start = time.perf_counter()
+    name = f"fold_{job['fold']}"
+    model = YOLO(job['model'])
+    # Фолды - оценка, а не модели для развертывания: в реестр без копии весов
+    RunRegistry().track(model, archive=False)
+    model.train(data=job['data'], project=job['project'], name=name, exist_ok=True,
+                plots=False, verbose=False, **job['train_args'])
+
+    save_dir = os.path.join(job['project'], name)
+    best = YOLO(os.path.join(save_dir, 'weights', 'best.pt'))
+    records = predict_paths(best, job['val_paths'], batch=job['train_args'].get('batch', 16))
+    predicted = [record['names'][record['top1']] for record in records]
+    return {'fold': job['fold'], 'accuracy_top1': best_metric(save_dir), 'predicted': predicted,
+            'seconds': time.perf_counter() - start}
+
+
+def run_kfold(images_root='data/images', k=5, model_path='yolov8n-cls.pt', train_args=None, workers=None,
+              threads=None, project='runs/classify/kfold', folds_root='data/kfold', seed=0):
+    """Train k folds concurrently; print mean ± std and a pooled out-of-fold confusion matrix"""
+    from utils.sweep_utils import worker_pool
+
+    paths, labels, class_names = collect_class_images(images_root)
+    folds = stratified_folds(labels, k, seed)
+    fold_dirs = build_fold_dirs(paths, labels, class_names, folds, k, folds_root)
+    project = os.path.abspath(project)
+
+    cpus = os.cpu_count() or 1
+    workers = workers or min(k, cpus)
+    threads = threads or max(1, cpus // workers)
+    print(f"🔀 {k}-fold CV: {len(paths)} изображений, {len(class_names)} класса")
+    print(f"⚙️ Процессов: {workers} | потоков на фолд: {threads}")
+
+    jobs = [{'fold': fold, 'data': fold_dirs[fold], 'model': model_path, 'project': project,
+             'train_args': train_args or {},
+             'val_paths': [p for p, f in zip(paths, folds) if f == fold]} for fold in range(k)]
+
+    start = time.perf_counter()
+    with worker_pool(workers, threads) as pool:
+        results = sorted(pool.map(train_fold, jobs), key=lambda r: r['fold'])
+    elapsed = time.perf_counter() - start
+
+    # Объединенная out-of-fold матрица ошибок (строки - истина, столбцы - предсказание)
+    index = {name: i for i, name in enumerate(class_names)}
+    confusion = np.zeros((len(class_names), len(class_names)), dtype=np.int64)
+    label_of = dict(zip(paths, labels))
+    rows = []
+    for job, result in zip(jobs, results):
+        true = [label_of[p] for p in job['val_paths']]
+        for path, t, name in zip(job['val_paths'], true, result['predicted']):
+            confusion[t, index[name]] += 1
+            rows.append((result['fold'], path, class_names[t], name))
+        result['oof_accuracy'] = float(np.mean([class_names[t] == n for t, n in zip(true, result['predicted'])]))
+
+    summary = write_kfold_report(results, rows, confusion, class_names, project, elapsed)
+    print_kfold_summary(summary, confusion, class_names)
+    return summary
+
+
+def write_kfold_report(results, rows, confusion, class_names, project, elapsed):
+    """oof_predictions.csv + kfold_summary.yaml in the project directory"""
+    os.makedirs(project, exist_ok=True)
+    with open(os.path.join(project, 'oof_predictions.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['fold', 'path', 'true', 'predicted'])
+        writer.writerows(rows)
+
+    summary = {'folds': len(results), 'wall_seconds': round(elapsed, 1)}
+    for metric in ('accuracy_top1', 'oof_accuracy'):
+        values = np.array([r[metric] for r in results], dtype=float)
+        summary[metric] = {'mean': round(float(np.nanmean(values)), 4), 'std': round(float(np.nanstd(values)), 4),
+                           'per_fold': [round(float(v), 4) for v in values]}
+    summary['pooled_oof_accuracy'] = round(float(np.trace(confusion) / max(1, confusion.sum())), 4)
+    summary['class_names'] = class_names
+    summary['confusion_matrix'] = confusion.tolist()
+    with open(os.path.join(project, 'kfold_summary.yaml'), 'w') as f:
+        yaml.dump(summary, f, default_flow_style=None, sort_keys=False)
+    return summary
+
+
+def print_kfold_summary(summary, confusion, class_names):
+    print("\n📊 РЕЗУЛЬТАТЫ K-FOLD:")
+    for metric in ('accuracy_top1', 'oof_accuracy'):
+        print(f"   {metric}: {summary[metric]['mean']:.3f} ± {summary[metric]['std']:.3f} "
+              f"(по фолдам: {summary[metric]['per_fold']})")
+    print(f"   Объединенная OOF точность: {summary['pooled_oof_accuracy']:.3f}")
+    print(f"   ⏱️ Время: {summary['wall_seconds']} с")
+
+    width = max(len(name) for name in class_names)
+    print("\n🧮 OOF матрица ошибок (строки - истина):")
+    print(" " * (width + 4) + " ".join(f"{name[:8]:>8}" for name in class_names))
+    for name, row in zip(class_names, confusion):
+        print(f"   {name:>{width}} " + " ".join(f"{v:>8}" for v in row))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Process memory helpers and a memory-aware adaptive batch size controller
+"""
+
+import os
+import csv
+import time
+
+import psutil
+
+
+def process_rss_gb():
+    """RSS процесса и его дочерних процессов (воркеры dataloader), GB"""
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss / (1024**3)
+
+
+def available_memory_gb():
+    """Память, доступная системе без свопа, GB"""
+    return psutil.virtual_memory().available / (1024**3)
+
+
+class AdaptiveBatchController:
+    """Chooses the inference batch size while a job runs
+
+    Each size is measured over `probe_batches` batches. The batch grows by
+    `growth` while throughput improves by more than `tolerance` and the
+    projected memory (RSS + per-image cost x extra images) stays under the
+    budget with `headroom_gb` of system memory left free. If throughput
+    stops improving, the controller settles on the best size seen. If RSS
+    nears the budget or available memory drops below the headroom (e.g.
+    another tenant started), the batch is halved and the size that hit the
+    limit becomes a ceiling.
+
+    The budget defaults to current RSS + 80% of the memory available at start.
+    """
+
+    def __init__(self, initial=8, min_batch=1, max_batch=256, memory_budget_gb=None, headroom_gb=1.0,
+                 growth=2, tolerance=0.05, probe_batches=2, log_path=None, verbose=True):
+        self.batch = initial
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.baseline_rss = process_rss_gb()
+        self.budget = memory_budget_gb or self.baseline_rss + 0.8 * available_memory_gb()
+        self.headroom = headroom_gb
+        self.growth = growth
+        self.tolerance = tolerance
+        self.probe_batches = probe_batches
+        self.verbose = verbose
+        self.settled = False
+        self.ceiling = max_batch
+        self.best = (0.0, initial)  # (изобр/с, batch)
+        self.per_image_gb = 0.0
+        self.history = []
+        self._images, self._seconds, self._reports = 0, 0.0, 0
+        self._log = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._log = open(log_path, 'w', newline='')
+            self._writer = csv.writer(self._log)
+            self._writer.writerow(['time', 'batch', 'images_per_sec', 'rss_gb', 'available_gb', 'next_batch', 'reason'])
+
+    def _change(self, new_batch, reason, throughput, rss, available):
+        new_batch = int(max(self.min_batch, min(self.max_batch, self.ceiling, new_batch)))
+        self.history.append((self.batch, throughput, rss, available, new_batch, reason))
+        if self._log is not None:
+            self._writer.writerow([round(time.time(), 3), self.batch, round(throughput, 2), round(rss, 3),
+                                   round(available, 3), new_batch, reason])
+            self._log.flush()
+        if self.verbose and new_batch != self.batch:
+            print(f"📐 batch {self.batch} → {new_batch} ({reason}: {throughput:.1f} изобр/с, "
+                  f"RSS {rss:.2f} GB, свободно {available:.2f} GB, бюджет {self.budget:.2f} GB)")
+        self.batch = new_batch
+        self._images, self._seconds, self._reports = 0, 0.0, 0
+
+    def report(self, n_images, seconds):
+        """Feed the timing of one finished batch; may change self.batch"""
+        rss, available = process_rss_gb(), available_memory_gb()
+        self._images += n_images
+        self._seconds += seconds
+        self._reports += 1
+        self.per_image_gb = max(self.per_image_gb, max(0.0, rss - self.baseline_rss) / max(1, self.batch))
+        throughput = self._images / self._seconds if self._seconds else 0.0
+
+        # Память проверяем после каждого батча, даже когда размер уже выбран
+        if rss > 0.9 * self.budget or available < self.headroom:
+            if self.batch == self.min_batch:
+                # Уменьшать больше некуда - не засоряем лог
+                self.settled = True
+                return self.batch
+            self.ceiling = max(self.min_batch, self.batch - 1)
+            self.settled = True
+            self._change(self.batch // 2, 'memory', throughput, rss, available)
+            return self.batch
+        if self.settled or self._reports < self.probe_batches:
+            return self.batch
+
+        if throughput > self.best[0] * (1 + self.tolerance):
+            self.best = (throughput, self.batch)
+            next_batch = self.batch * self.growth
+            extra_gb = self.per_image_gb * (next_batch - self.batch)
+            fits = rss + extra_gb < 0.9 * self.budget and available - extra_gb > self.headroom
+            if next_batch <= min(self.max_batch, self.ceiling) and fits:
+                self._change(next_batch, 'grow', throughput, rss, available)
+            else:
+                self.settled = True
+                self._change(self.batch, 'limit', throughput, rss, available)
+        else:
+            # Рост больше не окупается: возвращаемся к лучшему размеру
+            self.settled = True
+            self._change(self.best[1], 'settle', throughput, rss, available)
+        return self.batch
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self.verbose:
+            sizes = ' → '.join(str(h[0]) for h in self.history if h[0] != h[4]) or str(self.batch)
+            best = f"лучший {self.best[1]} при {self.best[0]:.1f} изобр/с" if self.best[0] else "без замеров"
+            print(f"📐 Адаптивный batch: итог {self.batch} (пробы: {sizes}; {best})")
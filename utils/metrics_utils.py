@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Prediction metrics: log-bucketed latency histograms, counters and an OpenMetrics textfile export
+"""
+
+import os
+import time
+import threading
+
+# Точность как у HDR-гистограмм: 16 корзин на каждую степень двойки (ширина корзины <= 6.25%)
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+MAX_VALUE_US = 1 << 32  # ~71 мин; большие значения попадают в последнюю корзину
+# Границы корзин в экспорте: 2^k и 1.5 * 2^k мкс (64 мкс ... ~200 с) - совпадают с границами корзин
+EXPORT_EDGES_US = sorted([1 << k for k in range(6, 28)] + [3 << (k - 1) for k in range(6, 28)])
+
+STAGES = ('decode', 'preprocess', 'forward', 'postprocess', 'end_to_end')
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer: exact below 2 * SUB_COUNT, then SUB_COUNT buckets per power of two"""
+    if value < 2 * SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_COUNT + (value >> shift) - SUB_COUNT
+
+
+def bucket_bounds(index):
+    """[low, high) of a bucket"""
+    if index < 2 * SUB_COUNT:
+        return index, index + 1
+    shift = index // SUB_COUNT - 1
+    sub = index % SUB_COUNT + SUB_COUNT
+    return sub << shift, (sub + 1) << shift
+
+
+class LogHistogram:
+    """HDR-style histogram of durations in microseconds
+
+    Recording is an index computation and a list increment; memory is a
+    fixed ~500 counters whatever the number of samples. Percentiles are
+    reported as the upper edge of their bucket (at most 6.25% high).
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (bucket_index(MAX_VALUE_US) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_us, count=1):
+        value_us = min(max(int(value_us), 0), MAX_VALUE_US)
+        self.counts[bucket_index(value_us)] += count
+        self.count += count
+        self.total += value_us * count
+        if value_us > self.max:
+            self.max = value_us
+
+    def percentile(self, q):
+        """Value (us) below which q percent of the samples fall"""
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * q / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def cumulative(self, edges):
+        """Cumulative counts of samples < each edge (edges must be bucket boundaries, ascending)"""
+        result, seen, index = [], 0, 0
+        for edge in edges:
+            while index < len(self.counts) and bucket_bounds(index)[1] <= edge:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}' if pairs else ''
+
+
+class PredictionMetrics:
+    """Latency histograms per stage and image / error / per-class counters of a prediction run
+
+    `observe(records)` takes the records of iter_predictions (their
+    `stage_ms`: decode, preprocess, forward, postprocess, end_to_end) or
+    of tiled prediction (`latency_ms`, counted as end_to_end). With `path`
+    the metrics are written as an OpenMetrics textfile (node-exporter
+    textfile collector: a *.prom file in its directory) at most every
+    `interval` seconds while observing, and on close(). `labels` are
+    added to every series, e.g. {'job': 'nightly'} when several runs
+    export into the same directory.
+    """
+
+    def __init__(self, path=None, interval=15.0, labels=None, prefix='cxr_predict'):
+        self.path = path
+        self.interval = interval
+        self.labels = sorted((labels or {}).items())
+        self.prefix = prefix
+        self.histograms = {stage: LogHistogram() for stage in STAGES}
+        self.images = 0
+        self.errors = {}
+        self.classes = {}
+        self.last_batch = None
+        self._lock = threading.Lock()
+        self._exported = time.monotonic()
+
+    def observe(self, records):
+        with self._lock:
+            for record in records:
+                self.images += 1
+                timings = record.get('stage_ms')
+                if timings is not None:
+                    for stage, ms in timings.items():
+                        self.histograms[stage].record(ms * 1000)
+                elif record.get('latency_ms') is not None:
+                    self.histograms['end_to_end'].record(record['latency_ms'] * 1000)
+
+                names = record.get('names') or {}
+                if 'top1' in record:
+                    found = (record['top1'],)
+                else:
+                    found = [box[0] for box in record.get('boxes') or ()]
+                for class_id in found:
+                    name = names.get(class_id, str(class_id))
+                    self.classes[name] = self.classes.get(name, 0) + 1
+            self.last_batch = time.time()
+        self._maybe_export()
+
+    def count_errors(self, reason, count=1):
+        """Failed images (unreadable file, failed fetch, failed batch item, ...) by reason"""
+        if count <= 0:
+            return
+        with self._lock:
+            self.errors[reason] = self.errors.get(reason, 0) + count
+        self._maybe_export()
+
+    def _maybe_export(self):
+        if self.path and time.monotonic() - self._exported >= self.interval:
+            self.export()
+
+    def render(self):
+        """OpenMetrics text exposition of the current values"""
+        prefix, base = self.prefix, self.labels
+        lines = [f'# TYPE {prefix}_images counter',
+                 f'# HELP {prefix}_images Images predicted.',
+                 f'{prefix}_images_total{_labels(base)} {self.images}',
+                 f'# TYPE {prefix}_errors counter',
+                 f'# HELP {prefix}_errors Images that could not be predicted, by reason.']
+        with self._lock:
+            errors = sorted(self.errors.items())
+            classes = sorted(self.classes.items())
+            histograms = [(stage, self.histograms[stage]) for stage in STAGES]
+            snapshot = [(stage, h.count, h.total, h.cumulative(EXPORT_EDGES_US)) for stage, h in histograms]
+            last_batch = self.last_batch
+        for reason, count in errors:
+            lines.append(f'{prefix}_errors_total{_labels(base + [("reason", reason)])} {count}')
+        lines += [f'# TYPE {prefix}_predictions counter',
+                  f'# HELP {prefix}_predictions Predicted classes (top-1 for classification, every box for detection).']
+        for name, count in classes:
+            lines.append(f'{prefix}_predictions_total{_labels(base + [("class", name)])} {count}')
+
+        lines += [f'# TYPE {prefix}_latency_seconds histogram',
+                  f'# UNIT {prefix}_latency_seconds seconds',
+                  f'# HELP {prefix}_latency_seconds Per-image latency by stage.']
+        for stage, count, total, cumulative in snapshot:
+            if not count:
+                continue
+            stage_labels = base + [('stage', stage)]
+            for edge, seen in zip(EXPORT_EDGES_US, cumulative):
+                bucket_labels = _labels(stage_labels + [('le', repr(edge / 1e6))])
+                lines.append(f'{prefix}_latency_seconds_bucket{bucket_labels} {seen}')
+            lines.append(f'{prefix}_latency_seconds_bucket{_labels(stage_labels + [("le", "+Inf")])} {count}')
+            lines.append(f'{prefix}_latency_seconds_count{_labels(stage_labels)} {count}')
+            lines.append(f'{prefix}_latency_seconds_sum{_labels(stage_labels)} {total / 1e6:.6f}')
+
+        if last_batch is not None:
+            lines += [f'# TYPE {prefix}_last_batch_timestamp_seconds gauge',
+                      f'# UNIT {prefix}_last_batch_timestamp_seconds seconds',
+                      f'# HELP {prefix}_last_batch_timestamp_seconds Time of the last predicted batch.',
+                      f'{prefix}_last_batch_timestamp_seconds{_labels(base)} {last_batch:.3f}']
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """Write the textfile atomically (the collector must never read a half-written file)"""
+        self._exported = time.monotonic()
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Метрики не должны ронять предсказания
+            print(f"⚠️ Не удалось записать метрики {self.path}: {e}")
+
+    def close(self):
+        self.export()
+
+    def print_summary(self):
+        print(f"⏱️ Задержка на изображение, мс (изображений: {self.images}, ошибок: {sum(self.errors.values())})")
+        print(f"{'Этап':>12} | {'N':>7} | {'p50':>8} | {'p90':>8} | {'p99':>8} | {'Макс.':>8}")
+        print("-" * 62)
+        for stage in STAGES:
+            h = self.histograms[stage]
+            if h.count:
+                p50, p90, p99 = (h.percentile(q) / 1000 for q in (50, 90, 99))
+                print(f"{stage:>12} | {h.count:>7} | {p50:>8.2f} | {p90:>8.2f} | {p99:>8.2f} | {h.max / 1000:>8.2f}")
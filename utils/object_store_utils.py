@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+S3-compatible object-store source: concurrent asyncio fetching with thread-pool decoding
+"""
+
+import os
+import time
+import queue
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.inference_utils import is_image_file
+from utils.trace_utils import traced
+
+_DONE = object()
+
+
+def is_object_uri(source):
+    """s3://bucket/prefix"""
+    return str(source).startswith('s3://')
+
+
+def parse_object_uri(uri):
+    """'s3://bucket/some/prefix' -> ('bucket', 'some/prefix')"""
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    if not bucket:
+        raise ValueError(f"Не указан bucket: {uri}")
+    return bucket, prefix
+
+
+@traced('image_decode', cat='decode')
+def decode_image(data):
+    """Encoded bytes -> (BGR array or None, content hash as in utils.data_utils.file_hash)"""
+    import cv2
+
+    # imdecode и sha1 отпускают GIL - потоки декодируют параллельно
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return image, hashlib.sha1(data).hexdigest()[:16]
+
+
+def _timed_decode(data):
+    start = time.perf_counter()
+    image, digest = decode_image(data)
+    return image, digest, (time.perf_counter() - start) * 1000
+
+
+class ObjectStoreSource:
+    """Iterates over the image URIs under an s3:// prefix as their images become ready
+
+    An asyncio loop in a background thread lists the prefix and fetches
+    objects over one pooled aiobotocore client: at most `concurrency` GET
+    requests are in flight, and at most `prefetch` images are held at once
+    (fetching, decoding or waiting for the model), so memory stays bounded
+    when inference is the slower side. Bytes are decoded on a thread pool.
+    Slots are freed by finish() only after a batch is predicted, so
+    `prefetch` is raised to at least `batch` (the largest batch the
+    consumer takes) - otherwise the model would wait forever for a full one.
+
+    Iteration yields URIs in completion order; `load(uri)` returns the
+    decoded BGR image (use it as the iter_predictions loader), and
+    `finish(records)` adds image_hash to the records and frees their
+    images. Endpoint and credentials follow botocore (AWS_ENDPOINT_URL,
+    AWS_ACCESS_KEY_ID, ...) unless `endpoint_url` is given, so a local
+    MinIO or moto server works the same way as S3.
+    """
+
+    def __init__(self, uri, concurrency=32, prefetch=256, decode_threads=4, endpoint_url=None, region=None, batch=1):
+        self.bucket, self.prefix = parse_object_uri(uri)
+        self.concurrency = concurrency
+        self.prefetch = max(prefetch, concurrency, batch)
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.images = {}
+        self.hashes = {}
+        self.decode_ms = {}
+        self.failed = []
+        self.bytes_fetched = 0
+        self.wait_seconds = 0.0  # время, когда модель ждала данные
+        self._ready = queue.SimpleQueue()
+        self._decoder = ThreadPoolExecutor(max_workers=decode_threads, thread_name_prefix='s3-decode')
+        self._decoding = set()  # поставленные в пул декодирования задачи - отменяются в close()
+        self._loop = None
+        self._main = None
+        self._slots = None
+        self._thread = None
+
+    def _start(self):
+        try:
+            from aiobotocore.session import get_session  # noqa: F401
+        except ImportError:
+            raise ImportError("Для s3:// источника установите aiobotocore (pip install aiobotocore)")
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._main = self._loop.create_task(self._produce())
+            started.set()
+            try:
+                self._loop.run_until_complete(self._main)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='s3-fetch', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    async def _produce(self):
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        requests = asyncio.Semaphore(self.concurrency)
+        self._slots = asyncio.Semaphore(self.prefetch)
+        # Один клиент - один пул соединений на все запросы
+        config = AioConfig(max_pool_connections=self.concurrency)
+        tasks = set()
+        try:
+            async with get_session().create_client('s3', endpoint_url=self.endpoint_url, region_name=self.region,
+                                                   config=config) as client:
+                paginator = client.get_paginator('list_objects_v2')
+                async for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                    for item in page.get('Contents', []):
+                        if not is_image_file(item['Key']):
+                            continue
+                        # Листинг тоже ждет свободного места - список не обгоняет модель
+                        await self._slots.acquire()
+                        task = asyncio.ensure_future(self._fetch(client, item['Key'], requests))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        except Exception as e:
+            self._ready.put(e)
+        finally:
+            self._ready.put(_DONE)
+
+    async def _fetch(self, client, key, requests):
+        uri = f's3://{self.bucket}/{key}'
+        try:
+            async with requests:
+                response = await client.get_object(Bucket=self.bucket, Key=key)
+                async with response['Body'] as stream:
+                    data = await stream.read()
+            self.bytes_fetched += len(data)
+            future = self._decoder.submit(_timed_decode, data)
+            self._decoding.add(future)
+            future.add_done_callback(self._decoding.discard)
+            image, digest, decode_ms = await asyncio.wrap_future(future)
+            error = None if image is not None else 'не удалось декодировать'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e)
+        if error is not None:
+            # Один битый объект не останавливает весь прогон
+            self._slots.release()
+            self.failed.append((uri, error))
+            print(f"⚠️ Пропускаем {uri}: {error}")
+            return
+        self._ready.put((uri, image, digest, decode_ms))
+
+    def __iter__(self):
+        if self._thread is None:
+            self._start()
+        while True:
+            start = time.perf_counter()
+            item = self._ready.get()
+            self.wait_seconds += time.perf_counter() - start
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            uri, image, digest, decode_ms = item
+            self.images[uri] = image
+            self.hashes[uri] = digest
+            self.decode_ms[uri] = decode_ms
+            yield uri
+
+    def load(self, uri):
+        """Decoded BGR image of a yielded URI"""
+        return self.images[uri]
+
+    def finish(self, records):
+        """Add image_hash (content sha1 like file_hash) and free the images of finished records
+
+        The decode time of the fetched bytes is added to the record's stage_ms.
+        """
+        for record in records:
+            uri = record['path']
+            record['image_hash'] = self.hashes.pop(uri, None)
+            decode_ms = self.decode_ms.pop(uri, 0.0)
+            if 'stage_ms' in record:
+                # stage_ms общий на батч - у каждой записи своя копия с ее временем декодирования
+                record['stage_ms'] = dict(record['stage_ms'], decode=record['stage_ms']['decode'] + decode_ms)
+            if self.images.pop(uri, None) is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self._slots.release)
+                except RuntimeError:
+                    pass  # цикл уже завершился - освобождать некому
+
+    def close(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._main.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        # shutdown(cancel_futures=True) есть только с Python 3.9 - отменяем ожидающие задачи сами
+        for future in list(self._decoding):
+            future.cancel()
+        self._decoder.shutdown(wait=False)
+        self.images.clear()
+        self.decode_ms.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def upload_directory(local_dir, uri, endpoint_url=None, region=None, repeat=1):
+    """Upload the images of a local directory under an s3:// prefix (fixtures and benchmarks)
+
+    With repeat > 1 every image is uploaded `repeat` times under r<i>/
+    sub-prefixes to build a larger workload. Returns the object count.
+    """
+    import boto3
+    from utils.inference_utils import list_images
+
+    bucket, prefix = parse_object_uri(uri)
+    client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+    try:
+        client.head_bucket(Bucket=bucket)
+    except Exception:
+        client.create_bucket(Bucket=bucket)
+    count = 0
+    images = list_images(local_dir)
+    for i in range(repeat):
+        for path in images:
+            name = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            key = '/'.join(part for part in (prefix.rstrip('/'), f'r{i}' if repeat > 1 else '', name) if part)
+            client.upload_file(path, bucket, key)
+            count += 1
+    return count
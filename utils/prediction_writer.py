@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Structured columnar output for predictions (Parquet or chunked .npz)
+"""
+
+import os
+import re
+import glob
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.trace_utils import traced
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+class PredictionWriter:
+    """Incremental writer for prediction records
+
+    Columns: path, image_hash, model_hash, prob_<class>..., top1, top1_name,
+    top1_conf, latency_ms. Rows are buffered and flushed as one row group
+    (Parquet) or one part file (`<name>.part-00000.npz`) every
+    `row_group_size` records, so memory stays bounded on huge sources.
+    A record's `image_hash`, when an earlier stage computed it (object
+    store, DICOM conversion, similar-case index), is written as is; only
+    records without one are hashed here.
+    """
+
+    def __init__(self, output_path, model_path, class_names=None, row_group_size=10000, append=False):
+        self.output_path = output_path
+        self.class_names = [class_names[i] for i in sorted(class_names)] if class_names else None
+        self.model_hash = file_hash(model_path) if os.path.isfile(model_path) else ''
+        self.row_group_size = row_group_size
+        extension = os.path.splitext(output_path)[1].lower()
+        if extension not in ('.parquet', '.npz'):
+            raise ValueError(f"Неизвестный формат вывода {output_path}: нужен .parquet или .npz")
+        self.format = extension[1:]
+        self.rows_written = 0
+        self.parts_written = 0
+        self._buffer = []
+        self._parquet_writer = None
+
+        if self.format == 'parquet' and pa is None:
+            raise ImportError("Для записи .parquet установите pyarrow (pip install pyarrow) или используйте .npz")
+
+        if append and self.format == 'parquet':
+            raise ValueError("Дозапись поддерживается только для .npz (Parquet нельзя дописать после закрытия)")
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        if self.format == 'npz':
+            existing = sorted(glob.glob(self._part_pattern()))
+            if append:
+                # Продолжаем нумерацию после последней части (например, после перезапуска --watch);
+                # число файлов не подходит - части могли удалить
+                indices = [int(m.group(1)) for m in map(re.compile(r'\.part-(\d+)\.npz$').search, existing) if m]
+                self.parts_written = max(indices) + 1 if indices else 0
+            else:
+                # Удаляем части от предыдущего запуска с тем же именем
+                for old_part in existing:
+                    os.remove(old_part)
+
+    def _part_pattern(self):
+        return f"{os.path.splitext(self.output_path)[0]}.part-*.npz"
+
+    @property
+    def location(self):
+        """Where the rows are: the .parquet file, or the glob of the .npz part files"""
+        return self.output_path if self.format == 'parquet' else self._part_pattern()
+
+    def write(self, records):
+        """Add records; flushes automatically when a row group is full"""
+        self._buffer.extend(records)
+        while len(self._buffer) >= self.row_group_size:
+            self._flush_rows(self._buffer[:self.row_group_size])
+            self._buffer = self._buffer[self.row_group_size:]
+
+    def flush(self):
+        """Write buffered rows now (e.g. after each watch-mode batch)"""
+        if self._buffer:
+            self._flush_rows(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _columns(self, records):
+        if self.class_names is None:
+            # Имена классов берем из первой записи (модель может жить в другом процессе)
+            names = records[0]['names']
+            self.class_names = [names[i] for i in sorted(names)]
+
+        n_classes = len(self.class_names)
+        probs = np.full((len(records), n_classes), np.nan, dtype=np.float32)
+        top1 = np.full(len(records), -1, dtype=np.int16)
+        top1_conf = np.zeros(len(records), dtype=np.float32)
+
+        for i, record in enumerate(records):
+            if 'probs' in record:
+                probs[i] = record['probs']
+                top1[i] = record['top1']
+                top1_conf[i] = record['top1conf']
+            elif record.get('boxes'):
+                # Детекция: берем самый уверенный бокс
+                class_id, confidence, _ = max(record['boxes'], key=lambda box: box[1])
+                top1[i] = class_id
+                top1_conf[i] = confidence
+
+        return {
+            'path': np.array([r['path'] for r in records]),
+            'image_hash': np.array([r.get('image_hash') or file_hash(r['path']) for r in records]),
+            'probs': probs,
+            'top1': top1,
+            'top1_name': np.array([self.class_names[c] if c >= 0 else '' for c in top1]),
+            'top1_conf': top1_conf,
+            'latency_ms': np.array([r.get('latency_ms', np.nan) for r in records], dtype=np.float32),
+        }
+
+    @traced('write', cat='io')
+    def _flush_rows(self, records):
+        columns = self._columns(records)
+
+        if self.format == 'parquet':
+            table = pa.table({
+                'path': pa.array(columns['path'].tolist(), pa.string()),
+                'image_hash': pa.array(columns['image_hash'].tolist(), pa.string()),
+                'model_hash': pa.array([self.model_hash] * len(records), pa.string()).dictionary_encode(),
+                **{f'prob_{name}': columns['probs'][:, i] for i, name in enumerate(self.class_names)},
+                'top1': columns['top1'],
+                'top1_name': pa.array(columns['top1_name'].tolist(), pa.string()).dictionary_encode(),
+                'top1_conf': columns['top1_conf'],
+                'latency_ms': columns['latency_ms'],
+            })
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.output_path, table.schema, compression='zstd')
+            self._parquet_writer.write_table(table, row_group_size=len(records))
+        else:
+            part_path = self._part_pattern().replace('*', f'{self.parts_written:05d}')
+            tmp_path = part_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    class_names=np.array(self.class_names),
+                    model_hash=np.array(self.model_hash),
+                    **columns
+                )
+            os.replace(tmp_path, part_path)
+
+        self.rows_written += len(records)
+        self.parts_written += 1
+
+
+def read_predictions(output_path):
+    """Load predictions written by PredictionWriter into a pandas DataFrame"""
+    import pandas as pd
+
+    if output_path.endswith('.parquet'):
+        return pd.read_parquet(output_path)
+
+    frames = []
+    for part_path in sorted(glob.glob(f"{os.path.splitext(output_path)[0]}.part-*.npz")):
+        with np.load(part_path) as part:
+            frame = pd.DataFrame({
+                'path': part['path'],
+                'image_hash': part['image_hash'],
+                'model_hash': str(part['model_hash']),
+            })
+            for i, name in enumerate(part['class_names']):
+                frame[f'prob_{name}'] = part['probs'][:, i]
+            for column in ('top1', 'top1_name', 'top1_conf', 'latency_ms'):
+                frame[column] = part[column]
+            frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Background rendering of annotated prediction images
+"""
+
+import os
+import queue
+import threading
+import cv2
+
+_STOP = object()
+
+
+class AnnotationRenderer:
+    """Renders annotated copies of selected predictions on a thread pool
+
+    Inference only calls submit(), which puts the record into a bounded queue
+    (blocking when it is full, so slow disks apply back-pressure instead of
+    growing memory). Decode, drawing and JPEG encode happen in worker threads;
+    cv2 releases the GIL for these calls.
+
+    Selection: with no filters every record is rendered; with `below` and/or
+    `positive` a record is rendered if it matches any of them.
+    """
+
+    def __init__(self, output_dir=None, below=None, positive=False, normal_class='normal',
+                 workers=2, queue_size=64):
+        self.output_dir = output_dir
+        self.below = below
+        self.positive = positive
+        self.normal_class = normal_class
+        self.rendered = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def should_render(self, record):
+        """Apply the confidence / positive-finding filters"""
+        if self.below is None and not self.positive:
+            return True
+
+        if 'probs' in record:
+            confidence = record['top1conf']
+            is_positive = record['names'][record['top1']] != self.normal_class
+        else:
+            boxes = record.get('boxes') or []
+            confidence = max((box[1] for box in boxes), default=0.0)
+            is_positive = bool(boxes)
+
+        if self.below is not None and confidence < self.below:
+            return True
+        return self.positive and is_positive
+
+    def submit(self, records):
+        """Queue records for rendering (returns immediately unless the queue is full)"""
+        for record in records:
+            if self.should_render(record):
+                self._queue.put(record)
+
+    def __call__(self, records):
+        self.submit(records)
+
+    def close(self):
+        """Wait until every queued image is written"""
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        if self.rendered or self.errors:
+            print(f"🖼️ Аннотированных изображений: {self.rendered} (ошибок: {self.errors})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _worker(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            try:
+                self._render(record)
+                with self._lock:
+                    self.rendered += 1
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                print(f"⚠️ Не удалось сохранить аннотацию {record['path']}: {e}")
+
+    def _render(self, record):
+        # image_path - декодированная копия, если path не читается cv2 (DICOM)
+        image = cv2.imread(record.get('image_path') or record['path'])
+        if image is None:
+            raise ValueError("изображение не читается")
+
+        names = record['names']
+        scale = max(image.shape[:2]) / 640
+        thickness = max(1, int(round(2 * scale)))
+
+        if 'probs' in record:
+            ranked = sorted(range(len(record['probs'])), key=lambda i: -record['probs'][i])
+            for row, class_id in enumerate(ranked):
+                text = f"{names[class_id]} {record['probs'][class_id]:.2f}"
+                y = int((30 + row * 30) * scale)
+                cv2.putText(image, text, (int(10 * scale), y), cv2.FONT_HERSHEY_SIMPLEX,
+                            0.8 * scale, (255, 255, 255), thickness, cv2.LINE_AA)
+            task = 'classify'
+        else:
+            for class_id, confidence, (x1, y1, x2, y2) in record.get('boxes') or []:
+                cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), thickness)
+                cv2.putText(image, f"{names[class_id]} {confidence:.2f}", (int(x1), max(0, int(y1) - 5)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6 * scale, (0, 0, 255), thickness, cv2.LINE_AA)
+            task = 'detect'
+
+        output_dir = self.output_dir or os.path.join('runs', task, 'predict')
+        os.makedirs(output_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(record['path']))[0] + '.jpg'
+        cv2.imwrite(os.path.join(output_dir, name), image)
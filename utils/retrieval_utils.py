@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Similar-case retrieval over L2-normalized embeddings (exact matmul or IVF coarse index)
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.embedding_utils import BackboneEmbedder, EmbeddingCache
+from utils.inference_utils import list_images
+
+RETRIEVAL_DIR = 'data/retrieval'
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _merge_topk(best_scores, best_rows, scores, rows, k):
+    """Keep the k highest scores per query across blocks"""
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        rows = np.take_along_axis(rows, part, axis=1)
+    return scores, rows
+
+
+def spherical_kmeans(vectors, n_lists, iters=20, sample=None, seed=0):
+    """Unit-norm centroids by cosine k-means (optionally trained on a random sample)"""
+    rng = np.random.default_rng(seed)
+    if sample and len(vectors) > sample:
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assign == c]
+            # Пустой кластер переинициализируем случайной точкой
+            centroids[c] = members.sum(axis=0) if len(members) else vectors[rng.integers(len(vectors))]
+        centroids = _normalize(centroids)
+    return centroids
+
+
+class RetrievalIndex:
+    """Archive of labeled images for nearest-neighbor lookup
+
+    Embeddings are stored L2-normalized in a float16 EmbeddingCache (rows
+    keyed by image hash); items.jsonl holds path and label per row in the
+    same order. Cosine similarity is a dot product, computed exactly in
+    blocks over the memmap, or through an IVF coarse index (spherical
+    k-means lists, `nprobe` lists per query) once the archive is large.
+    """
+
+    def __init__(self, index_dir=RETRIEVAL_DIR, model_path=None, ivf_threshold=200000, block_rows=65536):
+        self.index_dir = index_dir
+        self.ivf_threshold = ivf_threshold
+        self.block_rows = block_rows
+        self.store = EmbeddingCache(os.path.join(index_dir, 'vectors'), dtype='float16')
+        self.items_path = os.path.join(index_dir, 'items.jsonl')
+        self.items = []
+        if os.path.exists(self.items_path):
+            with open(self.items_path, 'r', encoding='utf-8') as f:
+                self.items = [json.loads(line) for line in f][:len(self.store)]
+
+        meta_path = os.path.join(index_dir, 'model.json')
+        self.model_hash = None
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            self.model_hash = meta['model_hash']
+            model_path = model_path or meta['model_path']
+        self.model_path = model_path
+        self._embedder = None
+        self._load_ivf()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            if self.model_path is None:
+                raise ValueError("Для вычисления эмбеддингов нужен model_path")
+            self._embedder = BackboneEmbedder(self.model_path)
+            if self.model_hash is None:
+                os.makedirs(self.index_dir, exist_ok=True)
+                with open(os.path.join(self.index_dir, 'model.json'), 'w') as f:
+                    json.dump({'model_hash': self._embedder.model_hash, 'model_path': self.model_path}, f)
+                self.model_hash = self._embedder.model_hash
+            elif self.model_hash != self._embedder.model_hash:
+                raise ValueError(f"Индекс {self.index_dir} построен другой моделью - пересоберите его")
+        return self._embedder
+
+    def __len__(self):
+        return len(self.store)
+
+    def embed(self, paths, batch=32):
+        """L2-normalized embeddings of image files"""
+        return np.concatenate([_normalize(self.embedder.embed_batch(paths[i:i + batch]))
+                               for i in range(0, len(paths), batch)]) if paths else np.zeros((0, 0), np.float32)
+
+    def add(self, paths, labels, vectors=None, batch=32, source='archive', hashes=None):
+        """Insert images not yet indexed (by content hash); returns the number added"""
+        hashes = hashes or [file_hash(path) for path in paths]
+        fresh, seen = [], set()
+        for i, key in enumerate(hashes):
+            if key not in self.store and key not in seen:
+                fresh.append(i)
+                seen.add(key)
+        if not fresh:
+            return 0
+
+        if vectors is None:
+            vectors = self.embed([paths[i] for i in fresh], batch)
+        else:
+            vectors = _normalize(np.asarray(vectors)[fresh])
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.items_path, 'a', encoding='utf-8') as f:
+            for i in fresh:
+                item = {'path': os.path.abspath(paths[i]), 'label': labels[i], 'source': source}
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                self.items.append(item)
+        self.store.add([hashes[i] for i in fresh], vectors)
+
+        if self.centroids is not None:
+            # Новые строки - в ближайший список, без перестроения индекса
+            new_assign = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+            self.assign = np.concatenate([self.assign, new_assign])
+            np.save(os.path.join(self.index_dir, 'ivf_assign.npy'), self.assign)
+            self._order = None
+        return len(fresh)
+
+    # --- IVF ---
+
+    def _load_ivf(self):
+        centroids_path = os.path.join(self.index_dir, 'ivf_centroids.npy')
+        assign_path = os.path.join(self.index_dir, 'ivf_assign.npy')
+        self.centroids, self.assign, self._order = None, None, None
+        if os.path.exists(centroids_path) and os.path.exists(assign_path):
+            assign = np.load(assign_path)
+            if len(assign) == len(self.store):
+                self.centroids, self.assign = np.load(centroids_path), assign
+
+    def build_ivf(self, n_lists=None, iters=20):
+        """Train the coarse quantizer on the current archive and assign every row"""
+        matrix = self.store.matrix
+        n_lists = n_lists or max(1, int(np.sqrt(len(matrix))))
+        self.centroids = spherical_kmeans(matrix, n_lists, iters, sample=256 * n_lists)
+        self.assign = np.concatenate([np.argmax(np.asarray(matrix[i:i + self.block_rows], np.float32)
+                                                @ self.centroids.T, axis=1)
+                                      for i in range(0, len(matrix), self.block_rows)]).astype(np.int32)
+        np.save(os.path.join(self.index_dir, 'ivf_centroids.npy'), self.centroids)
+        np.save(os.path.join(self.index_dir, 'ivf_assign.npy'), self.assign)
+        self._order = None
+        return n_lists
+
+    def _inverted_lists(self):
+        if self._order is None:
+            self._order = np.argsort(self.assign, kind='stable')
+            self._offsets = np.searchsorted(self.assign[self._order], np.arange(len(self.centroids) + 1))
+        return self._order, self._offsets
+
+    # --- поиск ---
+
+    def search_vectors(self, queries, k=5, nprobe=8):
+        """(scores, rows) of the top-k cosine neighbors for normalized query vectors"""
+        queries = _normalize(queries)
+        matrix = self.store.matrix
+        k = min(k, len(matrix))
+        if self.centroids is not None and len(matrix) >= self.ivf_threshold:
+            return self._search_ivf(queries, matrix, k, nprobe)
+
+        best_scores = np.full((len(queries), 0), -np.inf, np.float32)
+        best_rows = np.zeros((len(queries), 0), np.int64)
+        for start in range(0, len(matrix), self.block_rows):
+            block = np.asarray(matrix[start:start + self.block_rows], dtype=np.float32)
+            scores = queries @ block.T
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            best_scores, best_rows = _merge_topk(best_scores, best_rows, scores, rows, k)
+        return self._sorted(best_scores, best_rows)
+
+    def _search_ivf(self, queries, matrix, k, nprobe):
+        """Score each probed inverted list once against all queries that probe it"""
+        order, offsets = self._inverted_lists()
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        best_scores = [np.full(0, -np.inf, np.float32) for _ in queries]
+        best_rows = [np.zeros(0, np.int64) for _ in queries]
+        for c in np.unique(probes):
+            rows = np.sort(order[offsets[c]:offsets[c + 1]])
+            if not len(rows):
+                continue
+            members = np.flatnonzero((probes == c).any(axis=1))
+            scores = queries[members] @ np.asarray(matrix[rows], dtype=np.float32).T
+            for m, query_scores in zip(members, scores):
+                merged_scores = np.concatenate([best_scores[m], query_scores])
+                merged_rows = np.concatenate([best_rows[m], rows])
+                top = np.argpartition(-merged_scores, min(k, len(merged_scores)) - 1)[:k]
+                best_scores[m], best_rows[m] = merged_scores[top], merged_rows[top]
+
+        scores = np.stack([np.pad(s, (0, k - len(s)), constant_values=-np.inf) for s in best_scores])
+        rows = np.stack([np.pad(r, (0, k - len(r)), constant_values=-1) for r in best_rows])
+        return self._sorted(scores, rows)
+
+    @staticmethod
+    def _sorted(scores, rows):
+        order = np.argsort(-scores, axis=1)
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+    def query(self, paths, k=5, nprobe=8, exclude_self=True):
+        """Top-k similar archived cases per query image: [[{path, label, score}, ...], ...]"""
+        vectors = self.embed(paths)
+        scores, rows = self.search_vectors(vectors, k + 1 if exclude_self else k, nprobe)
+        results = []
+        for path, query_scores, query_rows in zip(paths, scores, rows):
+            own = os.path.abspath(path)
+            matches = [{**self.items[row], 'score': float(score)} for score, row in zip(query_scores, query_rows)
+                       if row >= 0 and not (exclude_self and self.items[row]['path'] == own)]
+            results.append(matches[:k])
+        return results
+
+
+class SimilarCaseLookup:
+    """Prediction hook: attach similar archived cases to flagged records, optionally archive them
+
+    Records whose top-1 class is in `classes` get record['similar'] with the
+    top-k archive matches. With insert=True every predicted image is added
+    to the archive under its predicted label (source='predicted'), reusing
+    the same embedding pass.
+    """
+
+    def __init__(self, index, k=5, classes=('foreign_body',), insert=False, nprobe=8, verbose=True):
+        self.index = index
+        self.k = k
+        self.classes = set(classes)
+        self.insert = insert
+        self.nprobe = nprobe
+        self.verbose = verbose
+
+    def _label(self, record):
+        return record['names'][record['top1']] if 'probs' in record else None
+
+    def __call__(self, records):
+        flagged = [i for i, record in enumerate(records) if self._label(record) in self.classes]
+        targets = range(len(records)) if self.insert else flagged
+        if not targets:
+            return records
+
+        paths = [records[i]['path'] for i in targets]
+        vectors = self.index.embed(paths)
+        row_of = {i: row for row, i in enumerate(targets)}
+
+        if flagged and len(self.index):
+            start = time.perf_counter()
+            scores, rows = self.index.search_vectors(vectors[[row_of[i] for i in flagged]], self.k, self.nprobe)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            for i, query_scores, query_rows in zip(flagged, scores, rows):
+                record = records[i]
+                record['similar'] = [{**self.index.items[row], 'score': float(score)}
+                                     for score, row in zip(query_scores, query_rows) if row >= 0]
+                if self.verbose:
+                    print(f"🔗 Похожие случаи для {os.path.basename(record['path'])} ({elapsed_ms:.1f} мс):")
+                    for match in record['similar']:
+                        print(f"     {match['score']:.3f} {match['label']:<18} {match['path']}")
+
+        if self.insert:
+            labels = [self._label(records[i]) or 'unknown' for i in targets]
+            # Хэш остается в записи - PredictionWriter не читает файл второй раз
+            for i in targets:
+                records[i]['image_hash'] = records[i].get('image_hash') or file_hash(records[i]['path'])
+            self.index.add(paths, labels, vectors=vectors, source='predicted',
+                           hashes=[records[i]['image_hash'] for i in targets])
+        return records
+
+
+def build_archive_index(model_path, images_root='data/images', index_dir=RETRIEVAL_DIR, batch=32, n_lists=None):
+    """Index every labeled image under images_root/<split>/<class>/ (incremental)"""
+    index = RetrievalIndex(index_dir, model_path)
+    paths, labels = [], []
+    for split in sorted(os.listdir(images_root)):
+        split_dir = os.path.join(images_root, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for path in list_images(split_dir):
+            paths.append(path)
+            labels.append(os.path.basename(os.path.dirname(path)))
+
+    start = time.perf_counter()
+    added = index.add(paths, labels, batch=batch)
+    print(f"🗄️ Архив: +{added} изображений, всего {len(index)} ({time.perf_counter() - start:.1f} с)")
+    if len(index) >= index.ivf_threshold or n_lists:
+        lists = index.build_ivf(n_lists)
+        print(f"🧭 IVF индекс: {lists} списков")
+    return index
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Fast classical thoracic ROI detection (no neural network) with a per-image box cache
+"""
+
+import os
+import json
+import cv2
+import numpy as np
+
+from utils.inference_utils import list_images
+
+
+def _trim_uniform_border(profile_std, threshold):
+    """First/last index whose row (or column) std exceeds the threshold"""
+    active = np.flatnonzero(profile_std > threshold)
+    if active.size == 0:
+        return 0, len(profile_std)
+    return int(active[0]), int(active[-1]) + 1
+
+
+def find_thoracic_roi(image, work_size=256, border_std=4.0, margin=0.04, min_area=0.3):
+    """Return (x0, y0, x1, y1) of the thoracic region in full-resolution pixels
+
+    1. Work on a grayscale copy downsampled to `work_size`.
+    2. Trim collimation borders: edge rows/columns with nearly constant intensity.
+    3. Otsu mask of body tissue, opened to drop text markers and lead letters;
+       the largest connected component gives the body box.
+    4. Intensity projections of the mask shrink the box to rows/columns that
+       actually contain tissue.
+    Falls back to the full frame if the box looks implausibly small.
+    """
+    h, w = image.shape[:2]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = work_size / max(h, w)
+    small = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    sh, sw = small.shape
+
+    # 1. Однородные рамки коллиматора по краям
+    y0, y1 = _trim_uniform_border(small.std(axis=1), border_std)
+    x0, x1 = _trim_uniform_border(small.std(axis=0), border_std)
+    inner = small[y0:y1, x0:x1]
+    if inner.size == 0:
+        return 0, 0, w, h
+
+    # 2. Маска тканей + морфологическое открытие (убирает текст и маркеры)
+    blurred = cv2.GaussianBlur(inner, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n_labels > 1:
+        largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        body = labels == largest
+
+        # 3. Проекции маски: строки/столбцы, где есть хотя бы 2% ткани
+        rows = np.flatnonzero(body.mean(axis=1) > 0.02)
+        cols = np.flatnonzero(body.mean(axis=0) > 0.02)
+        if rows.size and cols.size:
+            y0, y1 = y0 + int(rows[0]), y0 + int(rows[-1]) + 1
+            x0, x1 = x0 + int(cols[0]), x0 + int(cols[-1]) + 1
+
+    # Отступ и возврат к исходному разрешению
+    pad_y, pad_x = int(margin * sh), int(margin * sw)
+    y0, y1 = max(0, y0 - pad_y), min(sh, y1 + pad_y)
+    x0, x1 = max(0, x0 - pad_x), min(sw, x1 + pad_x)
+
+    if (y1 - y0) * (x1 - x0) < min_area * sh * sw:
+        return 0, 0, w, h
+
+    return (int(x0 / scale), int(y0 / scale), min(w, int(np.ceil(x1 / scale))), min(h, int(np.ceil(y1 / scale))))
+
+
+class RoiCache:
+    """JSON cache of ROI boxes keyed by absolute path + size + mtime"""
+
+    def __init__(self, cache_path='data/roi_cache.json'):
+        self.cache_path = cache_path
+        self.boxes = {}
+        self.dirty = False
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self.boxes = json.load(f)
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+        return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def get_box(self, path, image=None):
+        """Cached ROI box; computed (and the image decoded) only on a miss"""
+        key = self._key(path)
+        if key not in self.boxes:
+            if image is None:
+                image = cv2.imread(path)
+            if image is None:
+                raise ValueError(f"Не удалось прочитать изображение: {path}")
+            self.boxes[key] = list(find_thoracic_roi(image))
+            self.dirty = True
+        return tuple(self.boxes[key])
+
+    def crop(self, path):
+        """Read image and return its ROI crop (BGR)"""
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Не удалось прочитать изображение: {path}")
+        x0, y0, x1, y1 = self.get_box(path, image)
+        return image[y0:y1, x0:x1]
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        if os.path.exists(self.cache_path):
+            # Другие процессы (воркеры) могли дописать свои боксы
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.boxes = {**json.load(f), **self.boxes}
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.boxes, f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+
+def crop_dataset(src_root='./data', dst_root='./data/roi', splits=('train', 'val', 'test'), cache=None):
+    """Write ROI crops of a class-folder dataset (split/class/image) to dst_root
+
+    Crops that are newer than their source are kept, so re-runs only process
+    new or changed images.
+    """
+    cache = cache or RoiCache()
+    written, skipped = 0, 0
+
+    for split in splits:
+        split_dir = os.path.join(src_root, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for path in list_images(split_dir):
+            dst_path = os.path.join(dst_root, os.path.relpath(path, src_root))
+            if os.path.exists(dst_path) and os.path.getmtime(dst_path) >= os.path.getmtime(path):
+                skipped += 1
+                continue
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            cv2.imwrite(dst_path, cache.crop(path))
+            written += 1
+
+    cache.save()
+    print(f"✂️ ROI кропы: записано {written}, без изменений {skipped} → {dst_root}")
+    return dst_root
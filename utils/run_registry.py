@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+SQLite registry of training runs: args, metrics, dataset fingerprint, checkpoint hash and timings
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+from contextlib import closing
+
+REGISTRY_PATH = 'runs/registry/runs.db'
+SCHEMA_VERSION = 1
+# Основная метрика задачи - по ней выбираются лучшие запуски по умолчанию
+PRIMARY_METRICS = {'classify': 'metrics/accuracy_top1', 'detect': 'metrics/mAP50-95(B)'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    checkpoint_hash TEXT NOT NULL UNIQUE,
+    run_dir TEXT NOT NULL,
+    checkpoint TEXT NOT NULL,
+    archived TEXT,
+    task TEXT,
+    model TEXT,
+    data TEXT,
+    dataset_fingerprint TEXT,
+    device TEXT,
+    imgsz INTEGER,
+    batch INTEGER,
+    epochs INTEGER,
+    train_seconds REAL,
+    latency_ms REAL,
+    finished REAL,
+    args TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_dataset ON runs (dataset_fingerprint);
+CREATE INDEX IF NOT EXISTS runs_latency ON runs (latency_ms);
+CREATE INDEX IF NOT EXISTS runs_finished ON runs (finished);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    final REAL,
+    best REAL,
+    best_epoch INTEGER,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_best ON metrics (name, best);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    listing TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def lower_is_better(metric):
+    """Losses are minimized, every other results.csv column is maximized"""
+    return 'loss' in metric
+
+
+def dataset_splits(data):
+    """{split: directory} of a classification data folder or a detection data YAML"""
+    if os.path.isdir(data):
+        return {split: os.path.join(data, split) for split in ('train', 'val', 'test')
+                if os.path.isdir(os.path.join(data, split))}
+    if not os.path.isfile(data):
+        return {}
+    import yaml
+
+    with open(data, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    base = config.get('path') or os.path.dirname(data)
+    splits = {}
+    for split in ('train', 'val', 'test'):
+        if isinstance(config.get(split), str) and os.path.isdir(os.path.join(base, config[split])):
+            splits[split] = os.path.join(base, config[split])
+    return splits
+
+
+def _dataset_files(data):
+    """[(name inside the dataset, path)]: images of every split, YOLO label files of detection splits"""
+    from utils.inference_utils import list_images
+
+    files = []
+    if os.path.isfile(data):
+        files.append(('data.yaml', data))
+    for split, split_dir in sorted(dataset_splits(data).items()):
+        files += [(f'{split}/{os.path.relpath(path, split_dir)}', path) for path in list_images(split_dir)]
+        # Разметка YOLO лежит в .../labels/<split> рядом с .../images/<split>
+        parts = os.path.normpath(split_dir).split(os.sep)
+        if 'images' in parts:
+            parts[len(parts) - 1 - parts[::-1].index('images')] = 'labels'
+            label_dir = os.sep.join(parts)
+            for root, _, names in os.walk(label_dir):
+                files += [(f'{split}/labels/{os.path.relpath(os.path.join(root, name), label_dir)}',
+                           os.path.join(root, name)) for name in sorted(names) if name.endswith('.txt')]
+    return files
+
+
+def _listing_key(data):
+    """Digest of the dataset files' paths, sizes and mtimes (changes when a file is added, removed or rewritten)"""
+    from utils.cache_utils import file_stats_digest
+
+    return file_stats_digest(sorted(os.path.abspath(path) for _, path in _dataset_files(data)))
+
+
+def compute_fingerprint(data):
+    """Content fingerprint of a dataset: sha1 over (split/relative path, content hash) of every file
+
+    Paths inside the dataset, not absolute ones: the same data copied
+    elsewhere has the same fingerprint.
+    """
+    from utils.data_utils import file_hash
+
+    h = hashlib.sha1()
+    for name, path in sorted(_dataset_files(data)):
+        h.update(f'{name}\t{file_hash(path)}\n'.encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()[:16]
+
+
+def _read_yaml(path):
+    import yaml
+
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def summarize_results(rows):
+    """{column: (final, best, best epoch)} over the epochs of results.csv"""
+    summary = {}
+    for column in rows[0] if rows else ():
+        if column in ('epoch', 'time') or column.startswith('lr/'):
+            continue
+        values = [(row[column], int(row.get('epoch', i + 1))) for i, row in enumerate(rows) if column in row]
+        if not values:
+            continue
+        best, best_epoch = (min if lower_is_better(column) else max)(values, key=lambda item: item[0])
+        summary[column] = (values[-1][0], best, best_epoch)
+    return summary
+
+
+class RunRegistry:
+    """Index of finished training runs in one SQLite file
+
+    A run is keyed by the content hash of its best.pt, so registering the
+    same run twice updates it, while a run that overwrote the same
+    runs/<task>/<name>/ folder (exist_ok=True) gets a new row. With
+    `archive` the checkpoint is copied to runs/registry/checkpoints/<hash>.pt
+    and stays available after the folder is overwritten. Queries go
+    through indexes on (metric, value), dataset fingerprint and latency.
+    Dataset fingerprints are memoized by the paths, sizes and mtimes of
+    the dataset files, so thousands of runs on the same data hash it once.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self.archive_dir = os.path.join(os.path.dirname(os.path.abspath(path)), 'checkpoints')
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Параллельные процессы (k-fold, sweep) пишут в один файл - ждем блокировку, а не падаем
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(_SCHEMA)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return conn
+
+    def dataset_fingerprint(self, data):
+        """Fingerprint of a dataset folder / YAML (memoized by its file stats); None if it does not exist"""
+        if not data or not dataset_splits(data):
+            return None
+        listing = _listing_key(data)
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT fingerprint FROM fingerprints WHERE listing = ?', (listing,)).fetchone()
+        if row is not None:
+            return row['fingerprint']
+        fingerprint = compute_fingerprint(data)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?)', (listing, fingerprint))
+        return fingerprint
+
+    def register(self, run_dir, speed=None, archive=True):
+        """Add or update the run in run_dir (args.yaml, results.csv, weights/best.pt); returns its id
+
+        `speed` is the ultralytics validator speed of best.pt (ms per image);
+        runs registered without it have no latency.
+        """
+        from utils.data_utils import file_hash
+        from utils.training_utils import read_results_csv
+
+        checkpoint = os.path.join(run_dir, 'weights', 'best.pt')
+        args_path = os.path.join(run_dir, 'args.yaml')
+        if not os.path.exists(checkpoint) or not os.path.exists(args_path):
+            return None
+        args = _read_yaml(args_path)
+        rows = read_results_csv(run_dir)
+        checkpoint_hash = file_hash(checkpoint)
+        archived = None
+        if archive:
+            archived = os.path.join(self.archive_dir, f'{checkpoint_hash}.pt')
+            if not os.path.exists(archived):
+                os.makedirs(self.archive_dir, exist_ok=True)
+                tmp_path = f'{archived}.{os.getpid()}.tmp'
+                shutil.copy2(checkpoint, tmp_path)
+                os.replace(tmp_path, archived)
+        latency = sum(speed.get(key) or 0.0 for key in ('preprocess', 'inference', 'postprocess')) if speed else None
+        imgsz = args.get('imgsz')
+
+        values = {
+            'checkpoint_hash': checkpoint_hash,
+            'run_dir': os.path.abspath(run_dir),
+            'checkpoint': os.path.abspath(checkpoint),
+            'archived': archived and os.path.abspath(archived),
+            'task': args.get('task'),
+            'model': str(args.get('model')),
+            'data': str(args.get('data')),
+            'dataset_fingerprint': self.dataset_fingerprint(str(args.get('data') or '')),
+            'device': str(args.get('device')),
+            'imgsz': max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz,
+            'batch': args.get('batch'),
+            'epochs': len(rows),
+            # Колонка time в results.csv ultralytics - секунды от начала обучения
+            'train_seconds': rows[-1].get('time') if rows else None,
+            'latency_ms': latency,
+            'finished': os.path.getmtime(checkpoint),
+            'args': json.dumps(args, default=str),
+        }
+        columns = ', '.join(values)
+        updates = ', '.join(f'{key} = excluded.{key}' for key in values if key != 'checkpoint_hash')
+        if latency is None:
+            # Повторная регистрация без замера скорости не стирает уже записанную
+            updates = updates.replace('latency_ms = excluded.latency_ms',
+                                      'latency_ms = COALESCE(excluded.latency_ms, latency_ms)')
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'INSERT INTO runs ({columns}) VALUES ({", ".join("?" * len(values))}) '
+                         f'ON CONFLICT (checkpoint_hash) DO UPDATE SET {updates}', list(values.values()))
+            run_id = conn.execute('SELECT id FROM runs WHERE checkpoint_hash = ?', (checkpoint_hash,)).fetchone()[0]
+            conn.execute('DELETE FROM metrics WHERE run_id = ?', (run_id,))
+            conn.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?, ?)',
+                             [(run_id, name, *stats) for name, stats in summarize_results(rows).items()])
+        return run_id
+
+    def track(self, model, archive=True):
+        """Register the run when training ends (ultralytics callback; call before model.train())"""
+        def on_train_end(trainer):
+            validator = getattr(trainer, 'validator', None)
+            try:
+                run_id = self.register(trainer.save_dir, speed=getattr(validator, 'speed', None), archive=archive)
+            except Exception as e:
+                # Обучение уже завершено - ошибка реестра не должна его обесценить
+                print(f"⚠️ Запуск не записан в реестр {self.path}: {e}")
+                return
+            if run_id is not None:
+                print(f"🗂️ Запуск #{run_id} записан в реестр: {self.path}")
+
+        model.add_callback('on_train_end', on_train_end)
+        return self
+
+    def import_runs(self, root='runs', archive=False):
+        """Register run folders under root that are new or changed since registration; returns the count
+
+        Idempotent and cheap to repeat: a folder whose best.pt has the same
+        path and mtime as a registered run is skipped without hashing it.
+        """
+        known = set()
+        if os.path.exists(self.path):
+            with closing(self._connect()) as conn:
+                known = {(row['checkpoint'], row['finished'])
+                         for row in conn.execute('SELECT checkpoint, finished FROM runs')}
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if d != os.path.basename(self.archive_dir))
+            checkpoint = os.path.join(dirpath, 'weights', 'best.pt')
+            if 'args.yaml' not in filenames or not os.path.exists(checkpoint):
+                continue
+            if (os.path.abspath(checkpoint), os.path.getmtime(checkpoint)) in known:
+                continue
+            count += self.register(dirpath, archive=archive) is not None
+        return count
+
+    def count(self):
+        if not os.path.exists(self.path):
+            return 0
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def metric_names(self):
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT name FROM metrics ORDER BY name')]
+
+    def resolve_metric(self, metric):
+        """'accuracy_top1' -> 'metrics/accuracy_top1', 'mAP50-95' -> 'metrics/mAP50-95(B)'"""
+        names = self.metric_names()
+        if metric in names:
+            return metric
+        matches = [name for name in names
+                   if name.split('/')[-1] == metric or name.split('/')[-1].startswith(metric + '(')]
+        if len(matches) != 1:
+            raise ValueError(f"Метрика '{metric}' {'неоднозначна' if matches else 'не найдена'}; "
+                             f"доступны: {', '.join(matches or names)}")
+        return matches[0]
+
+    def _dataset_filter(self, dataset):
+        """SQL condition for a dataset given as a folder/YAML (matched by content), fingerprint prefix or data string"""
+        if dataset is None:
+            return '', []
+        fingerprint = self.dataset_fingerprint(dataset) if os.path.exists(dataset) else None
+        if fingerprint is not None:
+            return ' AND r.dataset_fingerprint = ?', [fingerprint]
+        return ' AND (r.dataset_fingerprint LIKE ? OR r.data = ?)', [dataset + '%', dataset]
+
+    def query(self, metric=None, dataset=None, task=None, minimum=None, order='metric', limit=10):
+        """Runs with the value of one metric (rows as dicts)
+
+        order='metric' - best value first; order='latency' - fastest
+        first (runs without a latency measurement are skipped);
+        order='recent' - newest first. `minimum` keeps runs whose metric
+        is at least that good (at most that, for losses).
+        """
+        metric = self.resolve_metric(metric or PRIMARY_METRICS.get(task, PRIMARY_METRICS['classify']))
+        better = '<=' if lower_is_better(metric) else '>='
+        sql = ('SELECT r.*, m.best AS value, m.final AS final_value, m.best_epoch '
+               'FROM metrics m JOIN runs r ON r.id = m.run_id WHERE m.name = ?')
+        params = [metric]
+        condition, extra = self._dataset_filter(dataset)
+        sql += condition
+        params += extra
+        if task is not None:
+            sql += ' AND r.task = ?'
+            params.append(task)
+        if minimum is not None:
+            sql += f' AND m.best {better} ?'
+            params.append(minimum)
+        if order == 'latency':
+            sql += ' AND r.latency_ms IS NOT NULL ORDER BY r.latency_ms'
+        elif order == 'recent':
+            sql += ' ORDER BY r.finished DESC'
+        else:
+            sql += f' ORDER BY m.best {"ASC" if lower_is_better(metric) else "DESC"}'
+        sql += ' LIMIT ?'
+        params.append(limit)
+        with closing(self._connect()) as conn:
+            return metric, [dict(row) for row in conn.execute(sql, params)]
+
+    def get(self, run_id):
+        """One run with all of its metrics, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+            if row is None:
+                return None
+            run = dict(row)
+            run['metrics'] = {m['name']: (m['final'], m['best'], m['best_epoch'])
+                              for m in conn.execute('SELECT * FROM metrics WHERE run_id = ? ORDER BY name', (run_id,))}
+        return run
+
+    def checkpoint_path(self, run):
+        """Loadable weights of a run: its best.pt if still unchanged, else the archived copy (or None)"""
+        from utils.data_utils import file_hash
+
+        if os.path.exists(run['checkpoint']) and file_hash(run['checkpoint']) == run['checkpoint_hash']:
+            return run['checkpoint']
+        if run['archived'] and os.path.exists(run['archived']):
+            return run['archived']
+        return None
+
+    def checkpoints(self, task=None):
+        """Loadable checkpoints of all runs, newest first"""
+        sql, params = 'SELECT * FROM runs', []
+        if task is not None:
+            sql, params = sql + ' WHERE task = ?', [task]
+        with closing(self._connect()) as conn:
+            runs = [dict(row) for row in conn.execute(sql + ' ORDER BY finished DESC', params)]
+        paths = []
+        for run in runs:
+            path = self.checkpoint_path(run)
+            if path is not None and path not in paths:
+                paths.append(path)
+        return paths
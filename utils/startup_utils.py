@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Command startup time measured with `python -X importtime`
+"""
+
+import os
+import csv
+import sys
+import time
+import subprocess
+
+
+def parse_importtime(stderr):
+    """[(module, self_ms, cumulative_ms, depth)] from `-X importtime` output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        rows.append((stripped, int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return rows
+
+
+def measure_startup(args, repeat=5, cwd=None, top=3):
+    """Best-of-N wall time of `python -X importtime <args>` plus its heaviest top-level imports"""
+    command = [sys.executable, '-X', 'importtime', *args]
+    best, stderr = None, ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        if completed.returncode not in (0, 1):
+            raise RuntimeError(f"{' '.join(args)} завершилась с кодом {completed.returncode}:\n"
+                               f"{completed.stderr[-2000:]}")
+        if best is None or elapsed < best:
+            best, stderr = elapsed, completed.stderr
+
+    imports = [row for row in parse_importtime(stderr) if row[3] == 0]
+    heaviest = sorted(imports, key=lambda row: row[2], reverse=True)[:top]
+    return {'command': ' '.join(args), 'wall_ms': round(best, 1),
+            'import_ms': round(sum(row[2] for row in imports), 1),
+            'heaviest': ' '.join(f'{name}:{ms:.0f}' for name, _, ms, _ in heaviest)}
+
+
+def append_startup_history(rows, path, commit=''):
+    """Append measurements to a CSV so startup regressions show up over time"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    new_file = not os.path.exists(path)
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['time', 'commit', 'command', 'wall_ms', 'import_ms', 'heaviest'])
+        for row in rows:
+            writer.writerow([stamp, commit, row['command'], row['wall_ms'], row['import_ms'], row['heaviest']])
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Parallel hyperparameter search with asynchronous successive halving (ASHA)
+"""
+
+import os
+import csv
+import math
+import time
+import random
+import multiprocessing as mp
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+import yaml
+
+from utils.inference_utils import list_images
+from utils.training_utils import best_metric
+
+# Пространство поиска: ('log', low, high) - лог-равномерно, ('uniform', low, high), список - выбор
+SEARCH_SPACE = {
+    'lr0': ('log', 1e-4, 1e-2),
+    'weight_decay': ('log', 1e-5, 1e-3),
+    'batch': [8, 16, 32],
+    'imgsz': [160, 224],
+    'dropout': ('uniform', 0.0, 0.3),
+    'fliplr': ('uniform', 0.0, 0.5),
+}
+
+# Без фиксированного оптимизатора ultralytics ('auto') сам выбирает lr и игнорирует lr0
+FIXED_ARGS = {'optimizer': 'AdamW', 'workers': 0, 'cache': 'disk', 'plots': False, 'verbose': False}
+
+
+def sample_params(space, rng):
+    """One random configuration from the search space"""
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, list):
+            params[name] = rng.choice(spec)
+        elif spec[0] == 'log':
+            params[name] = float(math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2]))))
+        else:
+            params[name] = float(rng.uniform(spec[1], spec[2]))
+    return params
+
+
+def rung_epochs(min_epochs=1, max_epochs=9, eta=3):
+    """Cumulative epoch budget of each rung: min_epochs * eta**k, capped at max_epochs"""
+    rungs = [min_epochs]
+    while rungs[-1] * eta <= max_epochs:
+        rungs.append(rungs[-1] * eta)
+    if rungs[-1] < max_epochs:
+        rungs.append(max_epochs)
+    return rungs
+
+
+def _cache_one(src_path, dst_path, max_side):
+    if os.path.exists(dst_path) and os.path.getmtime(dst_path) >= os.path.getmtime(src_path):
+        return False
+    image = cv2.imread(src_path)
+    if image is None:
+        return False
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)),
+                           interpolation=cv2.INTER_AREA)
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    cv2.imwrite(dst_path, image)
+    # .npy рядом с картинкой - формат cache='disk' ultralytics, общий для всех испытаний
+    np.save(os.path.splitext(dst_path)[0] + '.npy', image, allow_pickle=False)
+    return True
+
+
+def prepare_sweep_cache(src_root='./data', dst_root='data/sweep_cache', max_side=320,
+                        splits=('train', 'val', 'test'), threads=None):
+    """Shared preprocessed copy of the dataset for all trials
+
+    Images are downscaled once to `max_side` (enough for the largest imgsz in
+    the search space) and pre-decoded into the .npy files that ultralytics
+    reads with cache='disk', so trials skip JPEG decoding of full-size
+    X-rays and never race each other writing the cache.
+    """
+    jobs = []
+    for split in splits:
+        split_dir = os.path.join(src_root, split)
+        if os.path.isdir(split_dir):
+            jobs.extend((path, os.path.join(dst_root, os.path.relpath(path, src_root)))
+                        for path in list_images(split_dir))
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool:
+        written = sum(pool.map(lambda job: _cache_one(*job, max_side), jobs))
+    print(f"🗂️ Кэш данных для поиска: обновлено {written} из {len(jobs)} → {dst_root}")
+    return dst_root
+
+
+@contextmanager
+def _environ(**values):
+    """Temporarily set environment variables (inherited by processes started inside)"""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def set_worker_threads(threads):
+    """Process pool initializer: cap torch threads of one training / prediction process
+
+    torch.set_num_threads alone does not hold: on CPU ultralytics'
+    select_device resets it to ultralytics.utils.NUM_THREADS in every
+    train and predict call, so that constant is capped as well (torch_utils
+    imported it by name). OpenMP reads OMP_NUM_THREADS when torch is
+    imported, which happens while the pickled task's module is loaded -
+    worker_pool sets it in the environment the workers are spawned with.
+    """
+    import torch
+    import ultralytics.utils
+    from ultralytics.utils import torch_utils
+
+    ultralytics.utils.NUM_THREADS = torch_utils.NUM_THREADS = threads
+    torch.set_num_threads(threads)
+
+
+@contextmanager
+def worker_pool(workers, threads):
+    """Spawned process pool whose workers each use at most `threads` CPU threads"""
+    ctx = mp.get_context('spawn')
+    with _environ(OMP_NUM_THREADS=str(threads)), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                initializer=set_worker_threads, initargs=(threads,)) as pool:
+        yield pool
+
+
+def run_trial(job):
+    """Train one trial up to its rung budget (continuing from the previous rung's last.pt)"""
+    from ultralytics import YOLO
+    from utils.run_registry import RunRegistry
+
+    start = time.perf_counter()
+    name = f"trial_{job['trial']:03d}_r{job['rung']}"
+    continued = job['weights'].endswith('last.pt')
+    model = YOLO(job['weights'])
+    RunRegistry().track(model, archive=False)
+    model.train(data=job['data'], epochs=job['epochs'], project=job['project'], name=name,
+                exist_ok=True, device=job['device'], seed=job['trial'], patience=job['epochs'],
+                warmup_epochs=0 if continued else 1, **FIXED_ARGS, **job['params'])
+
+    save_dir = os.path.join(job['project'], name)
+    return {**job, 'save_dir': save_dir, 'accuracy': best_metric(save_dir),
+            'last': os.path.join(save_dir, 'weights', 'last.pt'), 'seconds': time.perf_counter() - start}
+
+
+class AshaScheduler:
+    """Asynchronous successive halving
+
+    Whenever a worker is free: promote the best not-yet-promoted trial of the
+    highest rung where it ranks in the top 1/eta of the trials finished there;
+    otherwise start a new trial at rung 0. No rung ever waits for a full
+    cohort, so workers stay busy while weak trials stop after `min_epochs`.
+    """
+
+    def __init__(self, n_trials, rungs, eta=3):
+        self.n_trials = n_trials
+        self.rungs = rungs
+        self.eta = eta
+        self.started = 0
+        self.finished = [dict() for _ in rungs]  # rung -> {trial: accuracy}
+        self.promoted = [set() for _ in rungs]
+
+    def report(self, trial, rung, accuracy, failed=False):
+        """Result of a rung; a failed trial counts in the ranking but is never promoted (no checkpoint)"""
+        self.finished[rung][trial] = -1.0 if math.isnan(accuracy) else accuracy
+        if failed:
+            self.promoted[rung].add(trial)
+
+    def next_job(self):
+        """(trial, rung) to run next, or None if nothing can start yet"""
+        for rung in reversed(range(len(self.rungs) - 1)):
+            done = self.finished[rung]
+            top = sorted(done, key=done.get, reverse=True)[:len(done) // self.eta]
+            for trial in top:
+                if trial not in self.promoted[rung]:
+                    self.promoted[rung].add(trial)
+                    return trial, rung + 1
+        if self.started < self.n_trials:
+            self.started += 1
+            return self.started - 1, 0
+        return None
+
+
+def run_sweep(data_path, model_path='yolov8n-cls.pt', n_trials=18, min_epochs=1, max_epochs=9, eta=3,
+              workers=None, threads=None, device='cpu', project='runs/sweep', space=None, seed=0):
+    """Run the ASHA search; returns trial results sorted best first"""
+    cpus = os.cpu_count() or 1
+    workers = workers or max(1, cpus // 2)
+    threads = threads or max(1, cpus // workers)
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    rng = random.Random(seed)
+    space = space or SEARCH_SPACE
+    params = [sample_params(space, rng) for _ in range(n_trials)]
+    scheduler = AshaScheduler(n_trials, rungs, eta)
+    project = os.path.abspath(project)
+
+    print(f"🔎 ASHA: {n_trials} испытаний | ступени (эпохи): {rungs} | eta={eta}")
+    print(f"⚙️ Процессов: {workers} | потоков на испытание: {threads}")
+
+    last_weights, results, pending = {}, [], {}
+    epochs_spent = 0
+    start = time.perf_counter()
+
+    def submit(pool):
+        job = scheduler.next_job()
+        if job is None:
+            return False
+        trial, rung = job
+        prev_epochs = rungs[rung - 1] if rung else 0
+        spec = {'trial': trial, 'rung': rung, 'epochs': rungs[rung] - prev_epochs, 'params': params[trial],
+                'weights': last_weights.get(trial, model_path), 'data': data_path,
+                'project': project, 'device': device}
+        pending[pool.submit(run_trial, spec)] = spec
+        return True
+
+    with worker_pool(workers, threads) as pool:
+        while len(pending) < workers and submit(pool):
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                spec = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ Испытание {spec['trial']} (ступень {spec['rung']}): {e}")
+                    result = {**spec, 'accuracy': float('nan'), 'seconds': 0.0}
+                    failed = True
+                else:
+                    failed = not os.path.exists(result['last'])
+                    if failed:
+                        print(f"⚠️ Испытание {spec['trial']}: нет {result['last']} - дальше не продвигается")
+                    else:
+                        last_weights[spec['trial']] = result['last']
+                scheduler.report(spec['trial'], spec['rung'], result['accuracy'], failed=failed)
+                epochs_spent += spec['epochs']
+                results.append(result)
+                print(f"   🧪 trial {spec['trial']:>3} | эпохи {rungs[spec['rung']]:>3} | "
+                      f"top1 {result['accuracy']:.3f} | {result['seconds']:.0f} с")
+            while len(pending) < workers and submit(pool):
+                pass
+
+    elapsed = time.perf_counter() - start
+    write_sweep_report(results, project, rungs)
+
+    # Лучший результат ищем на самой высокой достигнутой ступени
+    ranked = sorted(results, key=lambda r: (r['rung'], np.nan_to_num(r['accuracy'], nan=-1.0)), reverse=True)
+    best = ranked[0]
+    with open(os.path.join(project, 'best_hyp.yaml'), 'w') as f:
+        yaml.dump({'optimizer': FIXED_ARGS['optimizer'], **best['params'], 'epochs': max_epochs}, f, default_flow_style=False)
+
+    grid_epochs = n_trials * max_epochs
+    print(f"\n🏆 Лучшее испытание {best['trial']}: top1 {best['accuracy']:.3f} | {best['params']}")
+    print(f"⏱️ {elapsed / 60:.1f} мин, эпох {epochs_spent} из {grid_epochs} "
+          f"({epochs_spent / grid_epochs:.0%} от полного перебора)")
+    print(f"📁 {os.path.join(project, 'best_hyp.yaml')}")
+    return ranked
+
+
+def write_sweep_report(results, project, rungs):
+    """sweep_results.csv: one row per (trial, rung)"""
+    os.makedirs(project, exist_ok=True)
+    names = sorted({name for r in results for name in r['params']})
+    with open(os.path.join(project, 'sweep_results.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['trial', 'rung', 'epochs', 'accuracy_top1', 'seconds'] + names)
+        for r in sorted(results, key=lambda r: (r['trial'], r['rung'])):
+            writer.writerow([r['trial'], r['rung'], rungs[r['rung']], round(r['accuracy'], 4),
+                             round(r['seconds'], 1)] + [r['params'].get(name) for name in names])
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tiled high-resolution inference for the detection model
+"""
+
+import os
+import time
+import cv2
+import numpy as np
+import torch
+import torchvision
+
+
+def tile_grid(height, width, tile=640, overlap=0.2):
+    """Overlapping tile boxes (x0, y0, x1, y1) covering the whole image"""
+    stride = max(1, int(tile * (1 - overlap)))
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        positions = list(range(0, size - tile, stride))
+        positions.append(size - tile)  # последний тайл прижимаем к краю
+        return positions
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def is_background_tile(tile_image, std_threshold=6.0, probe_size=32):
+    """Cheap uniformity test: intensity std on a downsampled grayscale copy"""
+    probe = cv2.resize(tile_image, (probe_size, probe_size), interpolation=cv2.INTER_AREA)
+    if probe.ndim == 3:
+        probe = cv2.cvtColor(probe, cv2.COLOR_BGR2GRAY)
+    return float(probe.std()) < std_threshold
+
+
+def merge_detections(boxes, scores, classes, iou=0.5):
+    """Class-aware NMS over detections from all tiles"""
+    if len(boxes) == 0:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+
+    boxes_t = torch.as_tensor(np.asarray(boxes, dtype=np.float32))
+    scores_t = torch.as_tensor(np.asarray(scores, dtype=np.float32))
+    classes_t = torch.as_tensor(np.asarray(classes, dtype=np.int64))
+    keep = torchvision.ops.batched_nms(boxes_t, scores_t, classes_t, iou).numpy()
+    return boxes_t.numpy()[keep], scores_t.numpy()[keep], classes_t.numpy()[keep]
+
+
+def tiled_detect(model, image_path, tile=640, overlap=0.2, conf=0.25, iou=0.5, std_threshold=6.0):
+    """Detect on overlapping full-resolution tiles and merge into global coordinates
+
+    Returns a prediction record in the same format as
+    utils.inference_utils.result_to_record, plus tile statistics.
+    """
+    start = time.perf_counter()
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Не удалось прочитать изображение: {image_path}")
+
+    h, w = image.shape[:2]
+    grid = tile_grid(h, w, tile, overlap)
+    kept = [box for box in grid if not is_background_tile(image[box[1]:box[3], box[0]:box[2]], std_threshold)]
+
+    boxes, scores, classes = [], [], []
+    if kept:
+        # Все оставшиеся тайлы - одним батчем
+        crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in kept]
+        results = model.predict(source=crops, imgsz=tile, conf=conf, iou=iou, batch=len(crops), verbose=False)
+        for (x0, y0, _, _), result in zip(kept, results):
+            if result.boxes is None or len(result.boxes) == 0:
+                continue
+            xyxy = result.boxes.xyxy.cpu().numpy() + np.array([x0, y0, x0, y0], dtype=np.float32)
+            boxes.extend(xyxy)
+            scores.extend(result.boxes.conf.cpu().numpy())
+            classes.extend(result.boxes.cls.cpu().numpy().astype(np.int64))
+
+    boxes, scores, classes = merge_detections(boxes, scores, classes, iou)
+    return {
+        'path': image_path,
+        'names': dict(model.names),
+        'latency_ms': (time.perf_counter() - start) * 1000,
+        'boxes': [(int(c), float(s), [float(v) for v in b]) for b, s, c in zip(boxes, scores, classes)],
+        'tiles': len(grid),
+        'skipped_tiles': len(grid) - len(kept),
+    }
+
+
+def iter_tiled_predictions(model, paths, batch=16, **tile_kwargs):
+    """Yield tiled detection records in groups of `batch` images"""
+    for start in range(0, len(paths), batch):
+        yield [tiled_detect(model, path, **tile_kwargs) for path in paths[start:start + batch]]
+
+
+def load_yolo_labels(label_path, width, height):
+    """Read YOLO txt labels into [(class_id, [x1, y1, x2, y2]), ...] in pixels"""
+    boxes = []
+    if not os.path.exists(label_path):
+        return boxes
+    with open(label_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            class_id = int(parts[0])
+            xc, yc, bw, bh = (float(v) for v in parts[1:5])
+            boxes.append((class_id, [(xc - bw / 2) * width, (yc - bh / 2) * height,
+                                     (xc + bw / 2) * width, (yc + bh / 2) * height]))
+    return boxes
+
+
+def box_iou(a, b):
+    """IoU of two xyxy boxes"""
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def recall_at_iou(records, labels_dir, iou_threshold=0.5):
+    """Share of ground-truth boxes matched by a prediction of the same class"""
+    found, total = 0, 0
+    for record in records:
+        image = cv2.imread(record['path'], cv2.IMREAD_UNCHANGED)
+        if image is None:
+            continue
+        stem = os.path.splitext(os.path.basename(record['path']))[0]
+        truth = load_yolo_labels(os.path.join(labels_dir, stem + '.txt'), image.shape[1], image.shape[0])
+        total += len(truth)
+        for class_id, gt_box in truth:
+            if any(c == class_id and box_iou(gt_box, box) >= iou_threshold for c, _, box in record.get('boxes', [])):
+                found += 1
+    return found / total if total else float('nan'), total
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Lightweight span tracing: Chrome trace / Perfetto JSON across processes, plus a flat summary
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import functools
+import threading
+
+TRACE_ENV = 'CXR_TRACE_DIR'
+
+
+class _NullSpan:
+    """Трассировка выключена: span ничего не делает и ничего не выделяет"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.add(self.name, self.start, time.perf_counter_ns() - self.start, self.cat, self.args)
+        return False
+
+
+class Tracer:
+    """Per-process span buffer, appended to <trace_dir>/trace-<pid>.jsonl (one JSON array per flush)
+
+    Timestamps are perf_counter anchored to wall time once per process,
+    so spans of different processes line up on one timeline. Events are
+    flushed every `flush_every` spans and at exit (also in multiprocessing
+    workers); a fork drops the parent's unflushed events in the child.
+    """
+
+    def __init__(self, flush_every=2000):
+        self.trace_dir = None
+        self.enabled = False
+        self.flush_every = flush_every
+        self._events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self._anchor_ns = time.time_ns() - time.perf_counter_ns()
+        self._events = []
+        self._threads = set()
+        self._named = False
+
+    def enable(self, trace_dir):
+        self.trace_dir = os.path.abspath(trace_dir)
+        os.makedirs(self.trace_dir, exist_ok=True)
+        # Дочерние процессы (subprocess, пулы воркеров) включаются сами по переменной окружения
+        os.environ[TRACE_ENV] = self.trace_dir
+        if not self.enabled:
+            self.enabled = True
+            atexit.register(self.flush)
+            try:
+                from multiprocessing.util import Finalize
+                Finalize(self, self.flush, exitpriority=100)
+            except ImportError:
+                pass
+
+    def add(self, name, start_ns, duration_ns, cat='span', args=None):
+        """Record a finished span (start from time.perf_counter_ns())"""
+        if not self.enabled:
+            return
+        if os.getpid() != self.pid:
+            self._reset()
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            self._threads.add(tid)
+            with self._lock:
+                self._events.append({'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid,
+                                     'args': {'name': threading.current_thread().name}})
+        event = {'ph': 'X', 'name': name, 'cat': cat, 'pid': self.pid, 'tid': tid,
+                 'ts': (self._anchor_ns + start_ns) / 1000, 'dur': duration_ns / 1000}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+        if len(self._events) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.enabled or os.getpid() != self.pid:
+            return
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+        with self._write_lock:
+            if not self._named:
+                self._named = True
+                import multiprocessing
+                name = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python'
+                worker = multiprocessing.current_process().name
+                if worker != 'MainProcess':
+                    name = f'{name} {worker}'
+                events.insert(0, {'ph': 'M', 'name': 'process_name', 'pid': self.pid, 'tid': 0,
+                                  'args': {'name': f'{name} ({self.pid})'}})
+            try:
+                with open(os.path.join(self.trace_dir, f'trace-{self.pid}.jsonl'), 'a', encoding='utf-8') as f:
+                    # Одна строка JSON-массива на сброс: один вызов кодировщика на все события
+                    f.write(json.dumps(events, ensure_ascii=False, separators=(',', ':')) + '\n')
+            except OSError:
+                pass  # трассировка не должна ронять основную работу
+
+
+_tracer = Tracer()
+if os.environ.get(TRACE_ENV):
+    _tracer.enable(os.environ[TRACE_ENV])
+
+
+def enable_tracing(trace_dir):
+    """Start recording spans in this process and in every child started afterwards"""
+    _tracer.enable(trace_dir)
+    return _tracer.trace_dir
+
+
+def tracing_enabled():
+    return _tracer.enabled
+
+
+def span(name, cat='span', **args):
+    """with span('forward', cat='model', batch=16): ... - no-op while tracing is off"""
+    if not _tracer.enabled:
+        return _NULL_SPAN
+    return _Span(_tracer, name, cat, args)
+
+
+def add_span(name, start_ns, duration_ns, cat='span', **args):
+    """Record a span measured elsewhere (e.g. timings reported by ultralytics)"""
+    _tracer.add(name, start_ns, duration_ns, cat, args)
+
+
+def traced(name=None, cat='function'):
+    """Decorator: every call of the function becomes a span"""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return fn(*args, **kwargs)
+            with _Span(_tracer, span_name, cat, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flush_trace():
+    _tracer.flush()
+
+
+def load_trace_events(trace_dir):
+    """All events of all processes from <trace_dir>/trace-*.jsonl (a torn last chunk is skipped)"""
+    events = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, 'trace-*.jsonl'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.extend(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return events
+
+
+def merge_traces(trace_dir, output=None):
+    """Write one Chrome trace JSON (chrome://tracing, ui.perfetto.dev) for all processes"""
+    flush_trace()
+    events = load_trace_events(trace_dir)
+    output = output or os.path.join(trace_dir, 'trace.json')
+    tmp_path = f'{output}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    os.replace(tmp_path, output)
+    return output, events
+
+
+def summarize_spans(events):
+    """[(cat, name, count, total_ms, mean_ms, max_ms, processes)] sorted by total time"""
+    groups = {}
+    for event in events:
+        if event.get('ph') != 'X':
+            continue
+        key = (event.get('cat', ''), event['name'])
+        count, total, longest, pids = groups.get(key, (0, 0.0, 0.0, set()))
+        pids.add(event['pid'])
+        groups[key] = (count + 1, total + event['dur'], max(longest, event['dur']), pids)
+    rows = [(cat, name, count, total / 1000, total / count / 1000, longest / 1000, len(pids))
+            for (cat, name), (count, total, longest, pids) in groups.items()]
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+
+def print_trace_summary(events, top=20):
+    spans = [e for e in events if e.get('ph') == 'X']
+    if not spans:
+        print("🧭 Трасса пуста")
+        return
+    wall_ms = (max(e['ts'] + e['dur'] for e in spans) - min(e['ts'] for e in spans)) / 1000
+    print(f"🧭 Спанов: {len(spans)} | процессов: {len({e['pid'] for e in spans})} | окно: {wall_ms / 1000:.1f} с")
+    print(f"{'Категория':>10} | {'Спан':<40} | {'N':>6} | {'Всего, мс':>10} | {'Сред., мс':>9} | {'Макс., мс':>9}")
+    print("-" * 100)
+    for cat, name, count, total, mean, longest, _ in summarize_spans(events)[:top]:
+        print(f"{cat[:10]:>10} | {name[:40]:<40} | {count:>6} | {total:>10.1f} | {mean:>9.2f} | {longest:>9.1f}")
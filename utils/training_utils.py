@@ -1,9 +1,14 @@
 
+import os
+import csv
 import psutil
 import torch
 import time
+import yaml
 from ultralytics import YOLO
 
+from utils.memory_utils import process_rss_gb
+
 def check_system_resources():
     """Проверка доступных системных ресурсов"""
     print("🖥️ ПРОВЕРКА СИСТЕМНЫХ РЕСУРСОВ:")
@@ -24,17 +29,220 @@ def check_system_resources():
     
     return ram_gb, torch.cuda.is_available()
 
-def get_optimal_config(ram_gb, has_gpu):
-    """Автоматический выбор конфигурации based on ресурсов"""
-    if ram_gb < 8 or not has_gpu:
-        print("⚡ Используем легковесную конфигурацию")
-        return "configs/lightweight_config.yaml"
-    elif ram_gb < 16:
-        print("🚀 Используем стандартную конфигурацию") 
-        return "configs/clavicle_config.yaml"
-    else:
-        print("🔥 Используем продвинутую конфигурацию")
-        return "configs/clavicle_config.yaml"
+AUTO_CONFIG_PATH = "configs/auto_config.yaml"
+
+def _tensors(output):
+    """Все тензоры выхода модели: тензор, список/кортеж или dict (детекция ultralytics 8.4 в train)"""
+    if isinstance(output, torch.Tensor):
+        return [output]
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, (list, tuple)):
+        return [t for item in output for t in _tensors(item)]
+    return []
+
+def probe_train_step(model, imgsz, batch, device, steps=3):
+    """Короткий замер шага обучения (forward + backward) на синтетическом батче"""
+    model.to(device).train()
+    for param in model.parameters():
+        param.requires_grad = True
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4)
+
+    images = torch.rand(batch, 3, imgsz, imgsz, device=device)
+    times = []
+    peak_rss = process_rss_gb()
+    for step in range(steps + 1):
+        start = time.perf_counter()
+        preds = model(images)
+        if isinstance(preds, torch.Tensor):
+            # Классификация: логиты
+            labels = torch.randint(0, preds.shape[1], (batch,), device=device)
+            loss = torch.nn.functional.cross_entropy(preds, labels)
+        else:
+            # Детекция: для замера скорости достаточно синтетической функции потерь
+            outputs = _tensors(preds)
+            if not outputs:
+                raise RuntimeError(f"Модель не вернула тензоров: {type(preds).__name__}")
+            loss = sum(p.float().mean() for p in outputs)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if device != 'cpu':
+            torch.cuda.synchronize()
+        if step > 0:  # первый шаг - прогрев
+            times.append(time.perf_counter() - start)
+        peak_rss = max(peak_rss, process_rss_gb())
+
+    step_time = sum(times) / len(times)
+    return {'images_per_sec': batch / step_time, 'step_time': step_time,
+            'jitter': (max(times) - min(times)) / step_time, 'peak_rss_gb': peak_rss}
+
+def probe_dataloader(train_dir, imgsz, batch, workers, n_batches=5):
+    """Замер пропускной способности загрузки: декодирование + аугментации как при обучении"""
+    import torchvision
+    from torchvision import transforms
+
+    transform = transforms.Compose([
+        transforms.RandomResizedCrop(imgsz),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+    ])
+    dataset = torchvision.datasets.ImageFolder(train_dir, transform=transform)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch, shuffle=True, num_workers=workers,
+                                         persistent_workers=False, drop_last=False)
+
+    start = time.perf_counter()
+    seen, peak_rss = 0, process_rss_gb()
+    while seen < n_batches * batch:
+        for images, _ in loader:
+            seen += images.shape[0]
+            peak_rss = max(peak_rss, process_rss_gb())
+            if seen >= n_batches * batch:
+                break
+    elapsed = time.perf_counter() - start
+    return {'images_per_sec': seen / elapsed, 'peak_rss_gb': peak_rss}
+
+def pick_config(results, imgsz_tolerance=0.2):
+    """Лучший результат замеров: самый крупный imgsz, чья скорость не ниже лучшей больше чем на imgsz_tolerance
+
+    Самый быстрый вариант - всегда самый мелкий imgsz, а детали на снимке
+    теряются. Если крупнее почти не медленнее (обучение упирается в
+    загрузку данных), берем крупнее; при равном imgsz - самый быстрый.
+    """
+    fastest = max(r['throughput'] for r in results)
+    eligible = [r for r in results if r['throughput'] >= fastest * (1 - imgsz_tolerance)]
+    return max(eligible, key=lambda r: (r['imgsz'], r['throughput']))
+
+def auto_configure(data_dir="./data", model_path="yolov8n-cls.pt", output=AUTO_CONFIG_PATH,
+                   imgsz_candidates=(160, 224, 320), batch_candidates=(4, 8, 16, 32, 64), worker_candidates=None,
+                   memory_budget_gb=None, probe_loader=True, imgsz_tolerance=0.2):
+    """Подбор batch / workers / imgsz по коротким замерам вместо выбора по объему RAM
+
+    Для каждого imgsz батч растет, пока растет скорость шага и пиковый RSS
+    укладывается в бюджет памяти. Затем для лучшего батча подбирается число
+    воркеров загрузчика. Итоговая скорость = min(скорость загрузки, скорость
+    шага). Из стабильных вариантов выбирается самый крупный imgsz, который
+    не медленнее самого быстрого больше чем на imgsz_tolerance (pick_config);
+    выбор пишется в YAML для скриптов обучения.
+    Загрузчик замеряется на папках классов data_dir/train (ImageFolder);
+    для детекции (YOLO-датасет) передайте probe_loader=False - workers
+    тогда остается 0, а скорость определяется только шагом обучения.
+    Возвращает None, если ни одна конфигурация не прошла замеры.
+    """
+    print("🧪 АВТОКОНФИГУРАЦИЯ ОБУЧЕНИЯ")
+    print("-" * 40)
+
+    has_gpu = torch.cuda.is_available()
+    device = 0 if has_gpu else 'cpu'
+    torch_device = 'cuda:0' if has_gpu else 'cpu'
+    if memory_budget_gb is None:
+        memory_budget_gb = psutil.virtual_memory().available / (1024**3) * 0.7
+    cpu_count = len(psutil.Process().cpu_affinity()) if hasattr(psutil.Process(), 'cpu_affinity') else os.cpu_count()
+    if worker_candidates is None:
+        worker_candidates = sorted({0, 1, 2, 4, 8, min(cpu_count, 16)} & set(range(cpu_count + 1)))
+    train_dir = os.path.join(data_dir, 'train')
+
+    print(f"💾 Бюджет памяти: {memory_budget_gb:.1f} GB | 🧠 CPU: {cpu_count} | 🎮 GPU: {'да' if has_gpu else 'нет'}")
+
+    model = YOLO(model_path).model
+    candidates = []
+    for imgsz in imgsz_candidates:
+        best = None
+        for batch in batch_candidates:
+            try:
+                step = probe_train_step(model, imgsz, batch, torch_device)
+            except RuntimeError as e:  # OOM и подобные
+                print(f"   imgsz={imgsz} batch={batch}: ❌ {str(e)[:60]}")
+                break
+            within_budget = step['peak_rss_gb'] <= memory_budget_gb
+            print(f"   imgsz={imgsz} batch={batch}: {step['images_per_sec']:.1f} изобр/с, "
+                  f"RSS {step['peak_rss_gb']:.2f} GB{'' if within_budget else ' ⚠️ выше бюджета'}")
+            if not within_budget:
+                break
+            if best is not None and step['images_per_sec'] < best[1]['images_per_sec'] * 1.05:
+                break  # рост батча больше не ускоряет
+            best = (batch, step)
+            if has_gpu:
+                torch.cuda.empty_cache()
+        if best is not None:
+            candidates.append((imgsz, *best))
+
+    if not candidates:
+        print("❌ Ни одна конфигурация не прошла замеры")
+        return None
+    if not probe_loader:
+        print("ℹ️ Загрузчик не замеряется (датасет не в формате папок классов): workers=0")
+
+    results = []
+    for imgsz, batch, step in candidates:
+        best_loader = None
+        if probe_loader and os.path.isdir(train_dir):
+            for workers in worker_candidates:
+                try:
+                    loader = probe_dataloader(train_dir, imgsz, batch, workers)
+                except Exception as e:
+                    print(f"   workers={workers}: ❌ {str(e)[:60]}")
+                    continue
+                print(f"   imgsz={imgsz} batch={batch} workers={workers}: загрузка {loader['images_per_sec']:.1f} изобр/с")
+                if loader['peak_rss_gb'] > memory_budget_gb:
+                    break
+                if best_loader is None or loader['images_per_sec'] > best_loader[1]['images_per_sec'] * 1.05:
+                    best_loader = (workers, loader)
+        workers, loader_ips = (best_loader[0], best_loader[1]['images_per_sec']) if best_loader else (0, float('inf'))
+        results.append({'imgsz': imgsz, 'batch': batch, 'workers': workers,
+                        'throughput': min(step['images_per_sec'], loader_ips),
+                        'train_images_per_sec': step['images_per_sec'], 'loader_images_per_sec': loader_ips,
+                        'peak_rss_gb': step['peak_rss_gb']})
+
+    if len(results) > 1:
+        print(f"\n{'imgsz':>6} | {'batch':>5} | {'workers':>7} | {'изобр/с':>8}")
+        for r in results:
+            print(f"{r['imgsz']:>6} | {r['batch']:>5} | {r['workers']:>7} | {r['throughput']:>8.1f}")
+    best = pick_config(results, imgsz_tolerance)
+    bound = 'загрузкой данных' if best['loader_images_per_sec'] < best['train_images_per_sec'] else 'вычислениями'
+    config = {
+        'device': device,
+        'imgsz': best['imgsz'],
+        'batch': best['batch'],
+        'workers': best['workers'],
+        'probe': {
+            'generated': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'model': model_path,
+            'imgsz_tested': [r['imgsz'] for r in results],
+            'throughput_images_per_sec': round(best['throughput'], 2),
+            'train_images_per_sec': round(best['train_images_per_sec'], 2),
+            'loader_images_per_sec': round(best['loader_images_per_sec'], 2) if best['loader_images_per_sec'] != float('inf') else None,
+            'peak_rss_gb': round(best['peak_rss_gb'], 2),
+            'memory_budget_gb': round(memory_budget_gb, 2),
+        },
+    }
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+
+    print(f"\n🏁 Лучшее: imgsz={best['imgsz']} batch={best['batch']} workers={best['workers']} "
+          f"→ {best['throughput']:.1f} изобр/с (ограничено {bound})")
+    print(f"✅ Конфиг создан: {output}")
+    return config
+
+def get_optimal_config(data_dir="./data", model_path="yolov8n-cls.pt", output=AUTO_CONFIG_PATH, refresh=False,
+                       **probe_kwargs):
+    """Путь к автоконфигу; замеры запускаются, только если его еще нет (или refresh=True)
+
+    None, если замеры не дали конфигурации - вызывающий оставляет свои значения по умолчанию.
+    """
+    if refresh or not os.path.exists(output):
+        if auto_configure(data_dir, model_path, output, **probe_kwargs) is None:
+            return None
+    return output
+
+def load_training_config(path=AUTO_CONFIG_PATH):
+    """Параметры model.train() из автоконфига (без служебного раздела probe)"""
+    with open(path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    config.pop('probe', None)
+    return config
 
 def monitor_training_progress():
     """Мониторинг прогресса обучения"""
@@ -49,3 +257,147 @@ def monitor_training_progress():
             print(f"⏱️ Эпоха {epoch}/{total_epochs} | Прошло времени: {elapsed/60:.1f} мин")
     
     return callback
+
+class TrainingProfiler:
+    """Профилировщик обучения: колбэки ultralytics trainer, пишет profile.csv рядом с results.csv
+
+    По батчам: ожидание загрузчика (от конца прошлого батча до начала
+    текущего) и время forward/backward/optimizer. По эпохам: суммарные
+    ожидание и вычисления, изобр/с, RSS, загрузка CPU, потоки torch,
+    время валидации. В конце печатается вывод: упирается ли обучение в
+    загрузку данных или в вычисления.
+    """
+
+    FIELDS = ['level', 'epoch', 'batch', 'data_wait_s', 'compute_s', 'val_s', 'images_per_sec',
+              'rss_gb', 'cpu_percent', 'torch_threads', 'torch_interop_threads']
+
+    def __init__(self, per_batch=True, input_bound_share=0.3):
+        self.per_batch = per_batch
+        self.input_bound_share = input_bound_share
+        self.process = psutil.Process()
+        self.cuda = torch.cuda.is_available()
+        self._file = None
+        self._writer = None
+        self._train_end = None
+        self._reset_epoch()
+        self.total_wait = 0.0
+        self.total_compute = 0.0
+        self.total_images = 0
+
+    def _reset_epoch(self):
+        self.epoch_wait = 0.0
+        self.epoch_compute = 0.0
+        self.epoch_batches = 0
+        self._last_end = None
+        self._batch_start = None
+
+    def register(self, model):
+        """Подключает колбэки к YOLO модели перед model.train()"""
+        for event in ('on_train_start', 'on_train_epoch_start', 'on_train_batch_start', 'on_train_batch_end',
+                      'on_train_epoch_end', 'on_fit_epoch_end', 'on_train_end'):
+            model.add_callback(event, getattr(self, event))
+        return self
+
+    def _sync(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _row(self, **values):
+        row = {'rss_gb': round(process_rss_gb(), 3),
+               'torch_threads': torch.get_num_threads(),
+               'torch_interop_threads': torch.get_num_interop_threads()}
+        row.update(values)
+        self._writer.writerow(row)
+
+    def on_train_start(self, trainer):
+        path = os.path.join(str(trainer.save_dir), 'profile.csv')
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.FIELDS)
+        self._writer.writeheader()
+
+    def on_train_epoch_start(self, trainer):
+        self._reset_epoch()
+        self.process.cpu_percent()  # сброс счетчика загрузки CPU
+        self._epoch_start = time.perf_counter()
+        self._last_end = self._epoch_start
+
+    def on_train_batch_start(self, trainer):
+        now = time.perf_counter()
+        self._batch_wait = now - self._last_end
+        self._batch_start = now
+
+    def on_train_batch_end(self, trainer):
+        self._sync()
+        now = time.perf_counter()
+        compute = now - self._batch_start
+        self.epoch_wait += self._batch_wait
+        self.epoch_compute += compute
+        self._last_end = now
+        if self.per_batch:
+            self._row(level='batch', epoch=trainer.epoch + 1, batch=self.epoch_batches,
+                      data_wait_s=round(self._batch_wait, 5), compute_s=round(compute, 5),
+                      images_per_sec=round(trainer.batch_size / (self._batch_wait + compute), 2))
+        self.epoch_batches += 1
+
+    def on_train_epoch_end(self, trainer):
+        self._train_end = time.perf_counter()
+        self._cpu_percent = self.process.cpu_percent() / (os.cpu_count() or 1)
+
+    def on_fit_epoch_end(self, trainer):
+        if self._train_end is None:
+            return  # финальная валидация best.pt, а не эпоха обучения
+        val_time = time.perf_counter() - self._train_end
+        self._train_end = None
+        images = len(trainer.train_loader.dataset)
+        busy = self.epoch_wait + self.epoch_compute
+        self.total_wait += self.epoch_wait
+        self.total_compute += self.epoch_compute
+        self.total_images += images
+        self._row(level='epoch', epoch=trainer.epoch + 1, batch=self.epoch_batches,
+                  data_wait_s=round(self.epoch_wait, 4), compute_s=round(self.epoch_compute, 4),
+                  val_s=round(val_time, 4), images_per_sec=round(images / busy, 2) if busy else 0,
+                  cpu_percent=round(self._cpu_percent, 1))
+        self._file.flush()
+
+    def summary(self):
+        """Итог: доля ожидания данных и вывод input-bound / compute-bound"""
+        busy = self.total_wait + self.total_compute
+        wait_share = self.total_wait / busy if busy else 0.0
+        return {
+            'data_wait_s': round(self.total_wait, 2),
+            'compute_s': round(self.total_compute, 2),
+            'data_wait_share': round(wait_share, 3),
+            'images_per_sec': round(self.total_images / busy, 2) if busy else 0.0,
+            'bound': 'input' if wait_share >= self.input_bound_share else 'compute',
+        }
+
+    def on_train_end(self, trainer):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        summary = self.summary()
+        with open(os.path.join(str(trainer.save_dir), 'profile_summary.yaml'), 'w') as f:
+            yaml.dump(summary, f, default_flow_style=False, sort_keys=False)
+
+        print("\n⏱️ ПРОФИЛЬ ОБУЧЕНИЯ:")
+        print(f"   Ожидание данных: {summary['data_wait_s']} с ({summary['data_wait_share']:.0%})")
+        print(f"   Вычисления: {summary['compute_s']} с | {summary['images_per_sec']} изобр/с")
+        if summary['bound'] == 'input':
+            print("   📦 Упираемся в загрузку данных: увеличьте workers, используйте cache или меньший imgsz")
+        else:
+            print("   🧮 Упираемся в вычисления: загрузчик успевает, ускорит только модель/железо/batch")
+        print(f"   📁 {os.path.join(str(trainer.save_dir), 'profile.csv')}")
+
+def read_results_csv(save_dir):
+    """Строки results.csv запуска ultralytics (имена колонок без пробелов), по эпохам"""
+    path = os.path.join(str(save_dir), 'results.csv')
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return [{key.strip(): float(value) for key, value in row.items() if value.strip()}
+                for row in csv.DictReader(f)]
+
+def best_metric(save_dir, metric='metrics/accuracy_top1'):
+    """Лучшее значение метрики по эпохам results.csv (nan, если запуска не было)"""
+    values = [row[metric] for row in read_results_csv(save_dir) if metric in row]
+    return max(values) if values else float('nan')
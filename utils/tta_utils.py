@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test-time augmentation (TTA) for classification, applied to uncertain cases only
+"""
+
+import cv2
+import numpy as np
+
+# Набор аугментаций: отражение, небольшой масштаб и сдвиг
+TTA_VIEWS = ('original', 'hflip', 'zoom_in', 'zoom_out', 'shift_left', 'shift_right')
+
+
+def _affine(image, scale=1.0, shift_x=0.0):
+    """Scale around the center and shift horizontally (fraction of width)"""
+    h, w = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), 0, scale)
+    matrix[0, 2] += shift_x * w
+    return cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+
+def make_tta_views(image, views=TTA_VIEWS, scale=0.1, shift=0.05):
+    """Build augmented copies of one BGR image"""
+    builders = {
+        'original': lambda im: im,
+        'hflip': lambda im: cv2.flip(im, 1),
+        'zoom_in': lambda im: _affine(im, scale=1 + scale),
+        'zoom_out': lambda im: _affine(im, scale=1 - scale),
+        'shift_left': lambda im: _affine(im, shift_x=-shift),
+        'shift_right': lambda im: _affine(im, shift_x=shift),
+    }
+    return [builders[view](image) for view in views]
+
+
+def in_uncertainty_band(record, band):
+    """True if the first-pass top-1 confidence falls inside [low, high)"""
+    low, high = band
+    return 'probs' in record and low <= record['top1conf'] < high
+
+
+def apply_tta(model, records, band=(0.4, 0.7), views=TTA_VIEWS, max_views_per_pass=64, loader=None):
+    """Re-score uncertain records with TTA, updating them in place
+
+    All views of all uncertain images in a group are passed to predict() as
+    one list of arrays, which ultralytics runs as a single forward pass;
+    the softmax outputs are then averaged per image. `max_views_per_pass`
+    caps the size of that stacked batch. `loader(path)` returns the BGR
+    image to augment (default: cv2.imread).
+    """
+    loader = loader or cv2.imread
+    uncertain = [r for r in records if in_uncertainty_band(r, band)]
+    if not uncertain:
+        return records
+
+    per_pass = max(1, max_views_per_pass // len(views))
+    for start in range(0, len(uncertain), per_pass):
+        group = uncertain[start:start + per_pass]
+
+        stacked, kept = [], []
+        for record in group:
+            image = loader(record['path'])
+            if image is None:
+                continue
+            stacked.extend(make_tta_views(image, views))
+            kept.append(record)
+        if not kept:
+            continue
+
+        results = model.predict(source=stacked, batch=len(stacked), verbose=False)
+        probs = np.stack([r.probs.data.cpu().numpy() for r in results])
+        probs = probs.reshape(len(kept), len(views), -1).mean(axis=1)
+
+        for record, mean_probs in zip(kept, probs):
+            record['first_pass_top1conf'] = record['top1conf']
+            record['probs'] = [float(p) for p in mean_probs]
+            record['top1'] = int(mean_probs.argmax())
+            record['top1conf'] = float(mean_probs.max())
+            record['tta_views'] = len(views)
+
+    return records
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Inference-only weights in the safetensors layout, memory-mapped on load
+"""
+
+import os
+import gc
+import json
+import struct
+
+import numpy as np
+
+from utils.data_utils import file_hash
+from utils.trace_utils import traced
+
+WEIGHTS_SUFFIX = '.safetensors'
+FORMAT_VERSION = 1
+
+# dtype torch -> код safetensors -> dtype numpy
+_DTYPE_CODES = {'float32': 'F32', 'float16': 'F16', 'float64': 'F64', 'int64': 'I64', 'int32': 'I32',
+                'int16': 'I16', 'int8': 'I8', 'uint8': 'U8', 'bool': 'BOOL'}
+_NUMPY_DTYPES = {'F32': np.float32, 'F16': np.float16, 'F64': np.float64, 'I64': np.int64, 'I32': np.int32,
+                 'I16': np.int16, 'I8': np.int8, 'U8': np.uint8, 'BOOL': np.bool_}
+
+
+def write_tensors(path, tensors, metadata=None):
+    """Write {name: torch.Tensor} as a safetensors file (8-byte header length, JSON header, raw data)
+
+    Metadata values must be strings (safetensors rule), so nested values
+    are stored as JSON. The file also loads with the safetensors package.
+    """
+    header, offset, arrays = {}, 0, []
+    for name, tensor in tensors.items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        code = _DTYPE_CODES[str(array.dtype)]
+        header[name] = {'dtype': code, 'shape': list(array.shape),
+                        'data_offsets': [offset, offset + array.nbytes]}
+        offset += array.nbytes
+        arrays.append(array)
+    if metadata:
+        header['__metadata__'] = {key: value if isinstance(value, str) else json.dumps(value)
+                                  for key, value in metadata.items()}
+
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Данные начинаются с границы 8 байт - тензоры в mmap выровнены
+    encoded += b' ' * (-len(encoded) % 8)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for array in arrays:
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        return header_size, json.loads(f.read(header_size))
+
+
+def read_tensors(path):
+    """({name: torch.Tensor}, metadata) backed by one copy-on-write mmap of the file
+
+    Nothing is read up front: pages come from the OS page cache on first
+    touch, so processes loading the same file share the physical memory.
+    """
+    import torch
+
+    header_size, header = _read_header(path)
+    metadata = header.pop('__metadata__', {})
+    if not header:
+        return {}, metadata
+
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=8 + header_size)
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        array = data[begin:end].view(_NUMPY_DTYPES[info['dtype']]).reshape(info['shape'])
+        tensors[name] = torch.from_numpy(array)
+    return tensors, metadata
+
+
+def export_inference_weights(model_path, output=None):
+    """best.pt -> fused FP32 weights + model metadata, without optimizer state or training history
+
+    Returns the output path (default: next to the checkpoint, .safetensors).
+    """
+    from ultralytics.nn.tasks import load_checkpoint
+
+    output = output or os.path.splitext(model_path)[0] + WEIGHTS_SUFFIX
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    model, _ = load_checkpoint(model_path)
+    # Слияние Conv+BN делаем при экспорте: загрузчику не нужно ничего пересчитывать
+    model = model.fuse(verbose=False).eval()
+    metadata = {
+        'format': 'cxr-inference',
+        'format_version': str(FORMAT_VERSION),
+        'task': model.task,
+        'names': {str(k): v for k, v in model.names.items()},
+        'yaml': model.yaml,
+        'stride': [float(s) for s in model.stride],
+        'args': {key: model.args[key] for key in ('imgsz', 'data', 'task', 'single_cls') if key in model.args},
+        'source': os.path.basename(model_path),
+        'source_hash': file_hash(model_path),
+    }
+    tensors = dict(model.state_dict())
+    write_tensors(output, tensors, metadata)
+    return output
+
+
+def build_mapped_model(path):
+    """nn.Module with parameters and buffers pointing straight into the mapped file"""
+    import torch
+    from ultralytics.nn.tasks import ClassificationModel, DetectionModel, SegmentationModel, PoseModel, OBBModel
+
+    tensors, metadata = read_tensors(path)
+    if metadata.get('format') != 'cxr-inference':
+        raise ValueError(f"Не файл весов для инференса: {path} (см. scripts/16_export_weights.py)")
+    task = metadata['task']
+    model_class = {'classify': ClassificationModel, 'detect': DetectionModel, 'segment': SegmentationModel,
+                   'pose': PoseModel, 'obb': OBBModel}[task]
+
+    # Архитектура по сохраненному yaml (nc уже в нем), затем то же слияние, что при экспорте.
+    # info() при построении считает GFLOPs прогоном модели - при загрузке это лишнее
+    skeleton = type('MappedSkeleton', (model_class,), {'info': lambda self, *args, **kwargs: None})
+    # Сотни новых модулей запускают полную сборку мусора, которая обходит все объекты torch/ultralytics
+    # (~200 мс) - на время сборки модели gc выключаем, как при чтении кэшей
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        model = skeleton(json.loads(metadata['yaml']), verbose=False).fuse(verbose=False)
+        model.__class__ = model_class
+        expected = dict(model.state_dict())
+        missing = sorted(set(expected) - set(tensors))
+        if missing or set(tensors) - set(expected):
+            raise ValueError(f"Веса не совпадают с архитектурой: {path} (нет: {missing[:5]})")
+
+        for name, tensor in tensors.items():
+            if tuple(expected[name].shape) != tuple(tensor.shape):
+                raise ValueError(f"Неверная форма {name}: {tuple(tensor.shape)} вместо {tuple(expected[name].shape)}")
+            module_name, _, attr = name.rpartition('.')
+            module = model.get_submodule(module_name)
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+            else:
+                module._buffers[attr] = tensor
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    model.names = {int(k): v for k, v in json.loads(metadata['names']).items()}
+    model.stride = torch.tensor(json.loads(metadata['stride']))
+    model.task = task
+    model.args = json.loads(metadata['args'])
+    model.pt_path = str(path)
+    return model.eval()
+
+
+@traced('model_load', cat='model')
+def load_model(model_path):
+    """YOLO for a .pt checkpoint, or for exported .safetensors weights (memory-mapped)"""
+    from ultralytics import YOLO
+
+    if not str(model_path).endswith(WEIGHTS_SUFFIX):
+        return YOLO(model_path)
+
+    class MappedYOLO(YOLO):
+        def _load(self, weights, task=None):
+            self.model = build_mapped_model(weights)
+            self.ckpt = {}
+            self.task = self.model.task
+            self.overrides = dict(self.model.args)
+            self.overrides['model'] = weights
+            self.overrides['task'] = self.task
+            self.ckpt_path = weights
+            self.model_name = weights
+
+    return MappedYOLO(model_path)
+
+
+def model_imgsz(model_path):
+    """Training image size of a loaded YOLO, a .pt checkpoint or exported weights (max side if it was a list)"""
+    if hasattr(model_path, 'overrides'):
+        # Уже загруженная модель: аргументы обучения лежат в overrides (и в model.args)
+        saved = getattr(model_path.model, 'args', None)
+        args = {**(saved if isinstance(saved, dict) else {}), **model_path.overrides}
+    elif str(model_path).endswith(WEIGHTS_SUFFIX):
+        args = json.loads(_read_header(model_path)[1].get('__metadata__', {}).get('args', '{}'))
+    else:
+        from ultralytics.nn.tasks import torch_safe_load
+        args = torch_safe_load(model_path)[0].get('train_args') or {}
+    imgsz = args.get('imgsz')
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz